@@ -11,6 +11,7 @@ import flask_migrate
 from lime import app
 from lime.database import db
 from lime.database import models # pylint: disable=unused-import
+from lime.scripts import check_ordering
 from lime.scripts import cron
 from lime.scripts import run_bpython
 from lime.system import setup
@@ -56,6 +57,7 @@ def main():
   manager.add_option('config', help="Configuration file to load (prefix match)")
 
   manager.add_command('bpython', run_bpython.BpythonCommand)
+  manager.add_command('check_ordering', check_ordering.CheckOrderingCommand)
   manager.add_command('cron', cron.CronCommand)
   manager.add_command('db', flask_migrate.MigrateCommand)
   manager.add_command('run', flask_script.Server)
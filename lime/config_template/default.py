@@ -15,6 +15,15 @@ PREFERRED_URL_SCHEME: str = 'https'
 SQLALCHEMY_TRACK_MODIFICATIONS: bool = False
 SQLALCHEMY_POOL_RECYCLE: int = 300
 
+# Caches
+
+TAG_CATALOG_CACHE_SIZE: int = 1000  # number of users
+
+# Compression
+
+COMPRESSION_MIN_SIZE: int = 1024  # bytes; streamed responses are always gzipped
+COMPRESSION_LEVEL: int = 6  # 1 (fastest) to 9 (smallest)
+
 # JWT
 
 JWT_SECRET: bytes = b''  # use os.urandom(24) to generate
@@ -10,6 +10,8 @@ from . import errors
 # pylint: disable=unused-import,ungrouped-imports,invalid-name
 if typing.TYPE_CHECKING:
   from typing import (
+      Any,
+      Callable,
       Dict,
   )
   from ..util import typevars
@@ -52,3 +54,40 @@ class CustomModel(flask_sqlalchemy.Model):
         key: getattr(self, key)
         for key in self.__json_fields__ + ['object_id']
     }
+
+  @classmethod
+  def compile_json_serializer(
+      cls,
+      identifier: str
+      ) -> 'Callable[[Any], Dict[str, typevars.Serializable]]':
+    """Compile a function building the encoded dict for instances of the model.
+
+    This produces the same dict as to_json, plus the `__identifier`, but the
+    field names are fixed when the model is registered and the dict is built by
+    a single literal. Columns are read straight from the instance's `__dict__`,
+    falling back to the attribute (which loads them) only if they are expired
+    or unloaded; other fields, such as properties, are read as attributes.
+    """
+    columns = cls.__table__.columns
+    values = []
+
+    for key in cls.__json_fields__ + ['object_id']:
+      if not key.isidentifier():
+        values.append('{0!r}: getattr(obj, {0!r})'.format(key))
+      elif key in columns:
+        values.append(
+            '{0!r}: state[{0!r}] if {0!r} in state else obj.{0}'.format(key))
+      else:
+        values.append('{0!r}: obj.{0}'.format(key))
+
+    values.append("'__identifier': {!r}".format(identifier))
+    source = (
+        'def serialize(obj):\n'
+        '  state = obj.__dict__\n'
+        '  return {{{}}}\n').format(', '.join(values))
+    namespace: 'Dict[str, Any]' = {}
+
+    exec(compile(source, '<{} serializer>'.format(cls.__name__), 'exec'),  # pylint: disable=exec-used
+         namespace)
+
+    return namespace['serialize']
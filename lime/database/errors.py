@@ -7,3 +7,7 @@ class Error(Exception):
 
 class ObjectNotFoundError(Exception):
   """Looking up an object failed."""
+
+
+class InvalidTagExpressionError(Error):
+  """A tag expression was malformed."""
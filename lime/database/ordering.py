@@ -0,0 +1,283 @@
+"""Helpers for models which are ordered as a doubly linked list.
+
+Tasks and tags keep their position as `before_id`/`after_id` pointers on their
+own rows, rather than as a sortable rank. Clients address positions by
+neighbour, a move rewrites a bounded set of pointers with no rebalancing, and
+lists are read in order by walking the chain: `order_chain` in Python, or
+`Task.ordered_children` in SQL. `check_chain` finds and repairs broken lists.
+"""
+
+import collections
+import typing
+
+# pylint: disable=unused-import,ungrouped-imports,invalid-name
+if typing.TYPE_CHECKING:
+  from typing import (
+      Counter,
+      Dict,
+      Iterable,
+      List,
+      Optional,
+      Set,
+      Tuple,
+      TypeVar,
+  )
+  from . import tag
+  from . import task
+  from ..util import typevars
+
+  OrderedModel = TypeVar('OrderedModel', tag.Tag, task.Task)
+  # (object_id, before_id, after_id) for one item in a list.
+  Link = Tuple[
+      typevars.ObjectID,
+      Optional[typevars.ObjectID],
+      Optional[typevars.ObjectID],
+  ]
+  Pointers = Tuple[Optional[typevars.ObjectID], Optional[typevars.ObjectID]]
+  # Mutable [before_id, after_id] for items being rearranged.
+  PointerMap = Dict[typevars.ObjectID, List[Optional[typevars.ObjectID]]]
+  # Each item which has a next item, mapped to it.
+  NextMap = Dict[typevars.ObjectID, typevars.ObjectID]
+# pylint: enable=unused-import,ungrouped-imports,invalid-name
+
+# Kinds of problem found by check_chain.
+DANGLING = 'dangling'
+MISMATCH = 'mismatch'
+FORK = 'fork'
+EXTRA_HEAD = 'extra_head'
+CYCLE = 'cycle'
+
+
+def order_chain(items: 'List[OrderedModel]') -> 'List[OrderedModel]':
+  """Sort a list of siblings by following their `after_id` links.
+
+  This is O(n) in the number of items, and uses only the IDs already loaded on
+  the items. Items which are not reachable from the head of a chain (i.e. the
+  list is broken) are appended at the end, in their original order, so that
+  nothing is dropped.
+  """
+  by_id = {item.object_id: item for item in items}
+  linked_to = set(item.after_id for item in items)
+
+  ordered: 'List[OrderedModel]' = []
+  seen: 'Set[int]' = set()
+
+  for head in items:
+    if head.object_id in linked_to:
+      continue
+
+    item = head
+    while item is not None and item.object_id not in seen:
+      seen.add(item.object_id)
+      ordered.append(item)
+      item = by_id.get(item.after_id)
+
+  ordered.extend(item for item in items if item.object_id not in seen)
+
+  return ordered
+
+
+def _index_links(
+    links: 'Iterable[Link]',
+    problems: 'Counter[str]'
+    ) -> 'Tuple[Dict[typevars.ObjectID, Pointers], NextMap]':
+  """Map each item to its pointers, and to the next item if that exists.
+
+  Counts extra outgoing links and dangling pointers; only the first links seen
+  for each item are kept.
+  """
+  current: 'Dict[typevars.ObjectID, Pointers]' = {}
+  after: 'NextMap' = {}
+
+  for object_id, before_id, after_id in links:
+    if object_id in current:
+      problems[FORK] += 1
+      continue
+
+    current[object_id] = (before_id, after_id)
+
+  for object_id, (before_id, after_id) in current.items():
+    if before_id is not None and (
+        before_id not in current or before_id == object_id):
+      problems[DANGLING] += 1
+    if after_id is not None and (
+        after_id not in current or after_id == object_id):
+      problems[DANGLING] += 1
+    elif after_id is not None:
+      after[object_id] = after_id
+
+  return current, after
+
+
+def _walk_chain(
+    current: 'Dict[typevars.ObjectID, Pointers]',
+    after: 'NextMap',
+    problems: 'Counter[str]'
+    ) -> 'List[typevars.ObjectID]':
+  """Find the repaired order of the items, following `after` from each head.
+
+  Counts items with several predecessors, pointers which do not match in both
+  directions, extra heads, and cycles.
+  """
+  predecessors: 'Counter[typevars.ObjectID]' = collections.Counter(
+      after.values())
+
+  for count in predecessors.values():
+    if count > 1:
+      problems[FORK] += count - 1
+
+  for object_id, after_id in after.items():
+    if predecessors[after_id] == 1 and current[after_id][0] != object_id:
+      problems[MISMATCH] += 1
+
+  for object_id, (before_id, _) in current.items():
+    if (before_id in current and before_id != object_id and
+        after.get(before_id) != object_id):
+      problems[MISMATCH] += 1
+
+  heads = sorted(
+      (object_id for object_id in current if object_id not in predecessors),
+      key=lambda object_id: (current[object_id][0] is not None, object_id))
+
+  if len(heads) > 1:
+    problems[EXTRA_HEAD] += len(heads) - 1
+
+  order: 'List[typevars.ObjectID]' = []
+  seen: 'Set[typevars.ObjectID]' = set()
+
+  def walk(object_id: 'Optional[typevars.ObjectID]') -> None:
+    """Append the unseen part of the chain starting at object_id."""
+    while object_id is not None and object_id not in seen:
+      seen.add(object_id)
+      order.append(object_id)
+      object_id = after.get(object_id)
+
+  for head in heads:
+    walk(head)
+
+  for object_id in sorted(current):
+    if object_id not in seen:
+      problems[CYCLE] += 1
+      walk(object_id)
+
+  return order
+
+
+def _relinks(
+    current: 'Dict[typevars.ObjectID, Pointers]',
+    order: 'List[typevars.ObjectID]'
+    ) -> 'Dict[typevars.ObjectID, Pointers]':
+  """Find the new pointers of each item whose neighbours in `order` differ."""
+  repairs: 'Dict[typevars.ObjectID, Pointers]' = {}
+
+  for index, object_id in enumerate(order):
+    pointers = (
+        order[index - 1] if index > 0 else None,
+        order[index + 1] if index + 1 < len(order) else None)
+
+    if current[object_id] != pointers:
+      repairs[object_id] = pointers
+
+  return repairs
+
+
+def check_chain(
+    links: 'Iterable[Link]'
+    ) -> 'Tuple[Counter[str], Dict[typevars.ObjectID, Pointers]]':
+  """Check the links of a single list, and work out how to repair them.
+
+  An item may appear more than once if it has several outgoing links (a fork).
+  The repaired order follows `after_id` from each head (an item nothing links
+  to), visiting heads which already have no `before_id` first, then lowest ID
+  first. Items which are only reachable through a cycle go last, in ID order.
+  Apart from sorting the heads this is O(n) in the number of links.
+
+  Returns:
+    A count of each kind of problem found, and the (before_id, after_id) which
+    each item needing a change should be given.
+  """
+  problems: 'Counter[str]' = collections.Counter()
+  (current, after) = _index_links(links, problems)
+  order = _walk_chain(current, after, problems)
+
+  return problems, _relinks(current, order)
+
+
+def remove_items(
+    pointers: 'PointerMap',
+    object_ids: 'Iterable[typevars.ObjectID]'
+    ) -> None:
+  """Unlink items from their lists, joining up the neighbours of each run.
+
+  `pointers` must include the items and their immediate neighbours. The items
+  being removed are left with their old pointers, for insert_items to replace.
+  """
+  removed = set(object_ids)
+
+  def outside(
+      object_id: 'Optional[typevars.ObjectID]',
+      direction: int
+      ) -> 'Optional[typevars.ObjectID]':
+    """Follow the pointers in one direction until leaving the removed items."""
+    seen: 'Set[typevars.ObjectID]' = set()
+    while object_id in removed and object_id not in seen:
+      seen.add(object_id)
+      object_id = pointers[object_id][direction]
+    return None if object_id in removed else object_id
+
+  for object_id in removed:
+    before_id = outside(pointers[object_id][0], 0)
+    after_id = outside(pointers[object_id][1], 1)
+
+    if before_id is not None:
+      pointers[before_id][1] = after_id
+    if after_id is not None:
+      pointers[after_id][0] = before_id
+
+
+def insertion_point(
+    pointers: 'PointerMap',
+    object_ids: 'Iterable[typevars.ObjectID]',
+    before_id: 'Optional[typevars.ObjectID]',
+    after_id: 'Optional[typevars.ObjectID]',
+    tail_id: 'Optional[typevars.ObjectID]'
+    ) -> 'Pointers':
+  """Find the neighbours between which removed items should be inserted.
+
+  The items go after `before_id`, else before `after_id`, else at the end of the
+  list, whose last item was `tail_id` before they were removed. Call this after
+  remove_items, which leaves the removed items with their old pointers.
+  """
+  if before_id is not None:
+    return (before_id, pointers[before_id][1])
+
+  if after_id is not None:
+    return (pointers[after_id][0], after_id)
+
+  removed = set(object_ids)
+
+  while tail_id in removed:
+    tail_id = pointers[tail_id][0]
+
+  return (tail_id, None)
+
+
+def insert_items(
+    pointers: 'PointerMap',
+    object_ids: 'List[typevars.ObjectID]',
+    before_id: 'Optional[typevars.ObjectID]',
+    after_id: 'Optional[typevars.ObjectID]'
+    ) -> None:
+  """Link items, in the given order, between two adjacent items.
+
+  `pointers` must include the items and the two neighbours, if any.
+  """
+  chain = [before_id] + list(object_ids) + [after_id]
+
+  for previous, current, following in zip(chain, chain[1:], chain[2:]):
+    pointers[current] = [previous, following]
+
+  if before_id is not None:
+    pointers[before_id][1] = object_ids[0]
+  if after_id is not None:
+    pointers[after_id][0] = object_ids[-1]
@@ -0,0 +1,187 @@
+"""Tests for ordering helpers."""
+
+from absl.testing import absltest
+
+from lime.database import models
+from lime.database import ordering
+
+
+def make_chain(*object_ids):
+  """Make a list of linked tasks in the given order."""
+  tasks = [models.Task(object_id=object_id) for object_id in object_ids]
+
+  for before, after in zip(tasks, tasks[1:]):
+    before.after_id = after.object_id
+    after.before_id = before.object_id
+
+  return tasks
+
+
+class OrderingTest(absltest.TestCase):
+  """Tests for ordering helpers."""
+
+  def test_order_chain(self):
+    """Test order_chain follows the links regardless of input order."""
+    tasks = make_chain(3, 1, 4, 2)
+
+    ordered = ordering.order_chain([tasks[2], tasks[0], tasks[3], tasks[1]])
+
+    self.assertEqual([3, 1, 4, 2], [task.object_id for task in ordered])
+
+  def test_order_chain__empty(self):
+    """Test order_chain with no items."""
+    self.assertEqual([], ordering.order_chain([]))
+
+  def test_order_chain__broken_chain(self):
+    """Test order_chain keeps items which are in a cycle."""
+    tasks = make_chain(1, 2)
+    cycle = make_chain(3, 4)
+    cycle[1].after_id = cycle[0].object_id
+    cycle[0].before_id = cycle[1].object_id
+
+    ordered = ordering.order_chain([tasks[1]] + cycle + [tasks[0]])
+
+    self.assertEqual([1, 2, 3, 4], [task.object_id for task in ordered])
+
+  def test_check_chain(self):
+    """Test check_chain with a consistent list."""
+    problems, repairs = ordering.check_chain([
+        (2, 1, 3),
+        (1, None, 2),
+        (3, 2, None),
+    ])
+
+    self.assertEqual({}, problems)
+    self.assertEqual({}, repairs)
+
+  def test_check_chain__extra_head(self):
+    """Test check_chain appends orphaned heads to the list."""
+    problems, repairs = ordering.check_chain([
+        (1, None, 2),
+        (2, 1, None),
+        (3, None, None),
+    ])
+
+    self.assertEqual({ordering.EXTRA_HEAD: 1}, problems)
+    self.assertEqual({2: (1, 3), 3: (2, None)}, repairs)
+
+  def test_check_chain__fork(self):
+    """Test check_chain with two tasks claiming the same successor."""
+    problems, repairs = ordering.check_chain([
+        (1, None, 3),
+        (2, None, 3),
+        (3, 1, None),
+    ])
+
+    self.assertEqual({ordering.FORK: 1, ordering.EXTRA_HEAD: 1}, problems)
+    self.assertEqual({2: (3, None), 3: (1, 2)}, repairs)
+
+  def test_check_chain__cycle(self):
+    """Test check_chain with items only reachable through a cycle."""
+    problems, repairs = ordering.check_chain([
+        (1, None, None),
+        (2, 3, 3),
+        (3, 2, 2),
+    ])
+
+    self.assertEqual({ordering.CYCLE: 1}, problems)
+    self.assertEqual(
+        {1: (None, 2), 2: (1, 3), 3: (2, None)}, repairs)
+
+  def test_check_chain__dangling(self):
+    """Test check_chain with pointers to items outside the list."""
+    problems, repairs = ordering.check_chain([
+        (1, 4, 2),
+        (2, 1, 5),
+    ])
+
+    self.assertEqual({ordering.DANGLING: 2}, problems)
+    self.assertEqual({1: (None, 2), 2: (1, None)}, repairs)
+
+  def test_check_chain__mismatch(self):
+    """Test check_chain with before and after pointers which disagree."""
+    problems, repairs = ordering.check_chain([
+        (1, None, 2),
+        (2, None, 3),
+        (3, 1, None),
+    ])
+
+    self.assertEqual({ordering.MISMATCH: 3}, problems)
+    self.assertEqual({2: (1, 3), 3: (2, None)}, repairs)
+
+  def test_check_chain__duplicate_links(self):
+    """Test check_chain counts repeated items as forks."""
+    problems, _ = ordering.check_chain([
+        (1, None, 2),
+        (1, None, 3),
+        (2, 1, None),
+        (3, 2, None),
+    ])
+
+    self.assertEqual(1, problems[ordering.FORK])
+
+  def test_remove_items(self):
+    """Test remove_items joins up the neighbours of each removed run."""
+    pointers = {
+        1: [None, 2],
+        2: [1, 3],
+        3: [2, 4],
+        4: [3, 5],
+        5: [4, None],
+    }
+
+    ordering.remove_items(pointers, [2, 3, 5])
+
+    self.assertEqual([None, 4], pointers[1])
+    self.assertEqual([1, None], pointers[4])
+
+  def test_insertion_point(self):
+    """Test insertion_point after removing items from 1 <-> 2 <-> 3 <-> 4."""
+    pointers = {
+        1: [None, 2],
+        2: [1, 3],
+        3: [2, 4],
+        4: [3, None],
+    }
+
+    ordering.remove_items(pointers, [3, 4])
+
+    self.assertEqual(
+        (1, 2), ordering.insertion_point(pointers, [3, 4], 1, None, 4))
+    self.assertEqual(
+        (1, 2), ordering.insertion_point(pointers, [3, 4], None, 2, 4))
+    # Appending skips back past the removed items at the end of the list.
+    self.assertEqual(
+        (2, None), ordering.insertion_point(pointers, [3, 4], None, None, 4))
+    self.assertEqual(
+        (None, None), ordering.insertion_point({}, [], None, None, None))
+
+  def test_insert_items(self):
+    """Test insert_items links items between two neighbours."""
+    pointers = {
+        1: [None, 2],
+        2: [1, None],
+        3: [None, None],
+        4: [None, None],
+    }
+
+    ordering.insert_items(pointers, [4, 3], 1, 2)
+
+    self.assertEqual({
+        1: [None, 4],
+        4: [1, 3],
+        3: [4, 2],
+        2: [3, None],
+    }, pointers)
+
+  def test_insert_items__empty_list(self):
+    """Test insert_items into a list with no other items."""
+    pointers = {1: [None, None], 2: [None, None]}
+
+    ordering.insert_items(pointers, [1, 2], None, None)
+
+    self.assertEqual({1: [None, 2], 2: [1, None]}, pointers)
+
+
+if __name__ == '__main__':
+  absltest.main()
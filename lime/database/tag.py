@@ -12,6 +12,8 @@ if typing.TYPE_CHECKING:
   from typing import (
       List,
       Optional,
+      Set,
+      Union,
   )
   from . import user
   from ..util import typevars
@@ -20,22 +22,31 @@ if typing.TYPE_CHECKING:
 DB = db.DB
 
 
-ORDERING_LINK = DB.Table(
-    'tag_ordering_link',
-    DB.Model.metadata,
-    DB.Column('before_id', DB.Integer, DB.ForeignKey('tag.object_id', ondelete='CASCADE')),
-    DB.Column('after_id', DB.Integer, DB.ForeignKey('tag.object_id', ondelete='CASCADE'))
-)
-
-
 TAG_TASK_LINK = DB.Table(
     'tag_task_link',
     DB.Model.metadata,
     DB.Column('tag_id', DB.Integer, DB.ForeignKey('tag.object_id', ondelete='CASCADE')),
-    DB.Column('task_id', DB.Integer, DB.ForeignKey('task.object_id', ondelete='CASCADE'))
+    DB.Column('task_id', DB.Integer, DB.ForeignKey('task.object_id', ondelete='CASCADE')),
+    # Each direction covers lookups by the first column, and makes the other
+    # available without reading the table.
+    DB.Index('ix_tag_task_link_tag_id_task_id', 'tag_id', 'task_id'),
+    DB.Index('ix_tag_task_link_task_id_tag_id', 'task_id', 'tag_id')
 )
 
 
+# The task table, without importing the model (which depends on this module).
+_TASK = sqlalchemy.table(
+    'task',
+    sqlalchemy.column('object_id', sqlalchemy.Integer),
+    sqlalchemy.column('completed', sqlalchemy.Boolean))
+
+# The tag group table, for finding the owners of grouped tags.
+_TAG_GROUP = sqlalchemy.table(
+    'tag_group',
+    sqlalchemy.column('object_id', sqlalchemy.Integer),
+    sqlalchemy.column('owner_id', sqlalchemy.Integer))
+
+
 @api.register_serializable()
 class Tag(DB.Model):
   """Model for tags."""
@@ -43,10 +54,11 @@ class Tag(DB.Model):
   __json_fields__ = [
       # Fields
       'title',
+      'open_task_count',
+      'total_task_count',
       # Relation IDs
       'group_id',
       'owner_id',
-      # Properties
       'before_id',
       'after_id',
   ]
@@ -54,10 +66,19 @@ class Tag(DB.Model):
       sqlalchemy.CheckConstraint(
           '(group_id IS NOT NULL) <> (owner_id IS NOT NULL)',
           name='has_owner_xor_group'),
+      # Finds the end of a group's list when appending, without scanning it.
+      sqlalchemy.Index(
+          'ix_tag_list_tail', 'group_id',
+          postgresql_where=sqlalchemy.text('after_id IS NULL'),
+          sqlite_where=sqlalchemy.text('after_id IS NULL')),
   )
 
   # Fields
   title = DB.Column(DB.Unicode(200), nullable=False)
+  # Denormalized counts of the tasks with this tag, maintained by the methods
+  # below which add or remove links, and by count_task_links.
+  open_task_count = DB.Column(DB.Integer(), nullable=False, default=0)
+  total_task_count = DB.Column(DB.Integer(), nullable=False, default=0)
 
   # Relation IDs
   owner_id = DB.Column(
@@ -66,6 +87,14 @@ class Tag(DB.Model):
   group_id = DB.Column(
       DB.Integer(), DB.ForeignKey('tag_group.object_id', ondelete="CASCADE"),
       nullable=True)
+  before_id = DB.Column(
+      DB.Integer(),
+      DB.ForeignKey('tag.object_id', ondelete="SET NULL"),
+      nullable=True)
+  after_id = DB.Column(
+      DB.Integer(),
+      DB.ForeignKey('tag.object_id', ondelete="SET NULL"),
+      nullable=True)
 
   # Relations
   direct_owner = DB.relationship(
@@ -86,26 +115,26 @@ class Tag(DB.Model):
       ),
       foreign_keys=[group_id]
   )
+  # The ordering of tags in a group is a doubly linked list, stored on the rows
+  # like that of tasks; use link() and unlink() to keep it consistent.
+  before = DB.relationship(
+      'Tag',
+      foreign_keys=[before_id],
+      remote_side='Tag.object_id',
+      post_update=True
+  )
   after = DB.relationship(
       'Tag',
-      backref=DB.backref(
-          'before',
-          uselist=False,
-          lazy='joined',
-          join_depth=1
-      ),
-      secondary=ORDERING_LINK,
-      primaryjoin="Tag.object_id == tag_ordering_link.c.before_id",
-      secondaryjoin="Tag.object_id == tag_ordering_link.c.after_id",
-      uselist=False,
-      lazy='joined',
-      join_depth=1
+      foreign_keys=[after_id],
+      remote_side='Tag.object_id',
+      post_update=True
   )
   tasks = DB.relationship(
       'Task',
       backref=DB.backref(
           'tags',
-          lazy='joined'
+          # Serialization only needs the IDs, which Task.prefetch_json loads.
+          lazy='select'
       ),
       secondary=TAG_TASK_LINK,
       lazy='dynamic'
@@ -120,12 +149,258 @@ class Tag(DB.Model):
     """
     return self.group.owner if self.group is not None else self.direct_owner
 
-  @property
-  def before_id(self) -> 'Optional[typevars.ObjectID]':
-    """The the object ID of the preceding tag in the group."""
-    return self.before.object_id if self.before is not None else None
+  def link(
+      self,
+      before: 'Optional[Tag]',
+      after: 'Optional[Tag]'
+      ) -> None:
+    """Insert the tag between two adjacent tags, updating both neighbours."""
+    self.before = before
+    self.after = after
 
-  @property
-  def after_id(self) -> 'Optional[typevars.ObjectID]':
-    """The the object ID of the following tag in the group."""
-    return self.after.object_id if self.after is not None else None
+    if before is not None:
+      before.after = self
+
+    if after is not None:
+      after.before = self
+
+  def unlink(self) -> None:
+    """Remove the tag from its list, joining up its neighbours."""
+    if self.before is not None:
+      self.before.after = self.after
+
+    if self.after is not None:
+      self.after.before = self.before
+
+    self.before = None
+    self.after = None
+
+  @classmethod
+  def count_task_links(
+      cls,
+      task_ids: 'Union[List[typevars.ObjectID], sqlalchemy.sql.Select]',
+      sign: int,
+      *criteria: 'sqlalchemy.sql.ColumnElement'
+      ) -> int:
+    """Add (or subtract) tasks' links to the task counts of the linked tags.
+
+    Call this with a sign of -1 before links are deleted (including by deleting
+    the tasks), or +1 after they are inserted. Only tags matching all of the
+    criteria are updated. This is one UPDATE however many tasks there are.
+
+    Returns:
+      The number of tags updated.
+    """
+    table = cls.__table__
+    links = sqlalchemy.select([
+        sqlalchemy.func.count()
+    ]).select_from(
+        TAG_TASK_LINK.join(_TASK, _TASK.c.object_id == TAG_TASK_LINK.c.task_id)
+    ).where(
+        TAG_TASK_LINK.c.tag_id == table.c.object_id
+    ).where(
+        TAG_TASK_LINK.c.task_id.in_(task_ids)
+    )
+    linked = sqlalchemy.select([
+        TAG_TASK_LINK.c.tag_id
+    ]).where(
+        TAG_TASK_LINK.c.task_id.in_(task_ids)
+    )
+
+    return DB.session.execute(table.update().where(
+        table.c.object_id.in_(linked)
+    ).where(
+        sqlalchemy.and_(*criteria)
+    ).values(
+        open_task_count=table.c.open_task_count + sign * links.where(
+            ~_TASK.c.completed).as_scalar(),
+        total_task_count=table.c.total_task_count + sign * links.as_scalar()
+    )).rowcount
+
+  @classmethod
+  def adjust_open_task_counts(
+      cls,
+      task_id: 'typevars.ObjectID',
+      delta: int
+      ) -> int:
+    """Add `delta` to the open task count of every tag on a task.
+
+    Returns:
+      The number of tags updated.
+    """
+    table = cls.__table__
+
+    return DB.session.execute(table.update().where(
+        table.c.object_id.in_(
+            sqlalchemy.select([
+                TAG_TASK_LINK.c.tag_id
+            ]).where(
+                TAG_TASK_LINK.c.task_id == task_id
+            ))
+    ).values(
+        open_task_count=table.c.open_task_count + delta
+    )).rowcount
+
+  @classmethod
+  def recount_tasks(cls) -> 'Set[typevars.ObjectID]':
+    """Recompute the task counts of every tag which has drifted.
+
+    The owners of the drifted tags are found first, so that their cached tag
+    catalogs can be invalidated; nothing is updated if none have drifted.
+
+    Returns:
+      The IDs of the users owning the tags which were corrected.
+    """
+    table = cls.__table__
+    links = sqlalchemy.select([
+        sqlalchemy.func.count()
+    ]).select_from(
+        TAG_TASK_LINK.join(_TASK, _TASK.c.object_id == TAG_TASK_LINK.c.task_id)
+    ).where(
+        TAG_TASK_LINK.c.tag_id == table.c.object_id
+    )
+    open_tasks = links.where(~_TASK.c.completed).as_scalar()
+    total_tasks = links.as_scalar()
+
+    drifted = sqlalchemy.or_(
+        table.c.open_task_count != open_tasks,
+        table.c.total_task_count != total_tasks)
+
+    owner_ids = set(row[0] for row in DB.session.execute(
+        sqlalchemy.select([
+            sqlalchemy.func.coalesce(table.c.owner_id, _TAG_GROUP.c.owner_id)
+        ]).select_from(
+            table.outerjoin(
+                _TAG_GROUP, _TAG_GROUP.c.object_id == table.c.group_id)
+        ).where(
+            drifted
+        ).distinct()))
+
+    if owner_ids:
+      DB.session.execute(table.update().where(
+          drifted
+      ).values(
+          open_task_count=open_tasks,
+          total_task_count=total_tasks
+      ))
+
+    return owner_ids
+
+  def apply_to_tasks(self, task_ids: 'List[typevars.ObjectID]') -> None:
+    """Link the tag to tasks, replacing any other tag from the same group.
+
+    Conflicting links are deleted, and the missing links inserted, with a fixed
+    number of statements however many tasks there are; the task counts of the
+    affected tags are kept up to date. Tasks' `tags` collections in the session
+    are not updated until they are expired.
+    """
+    if not task_ids:
+      return
+
+    if self.group_id is not None:
+      conflicting = sqlalchemy.and_(
+          Tag.group_id == self.group_id,
+          Tag.object_id != self.object_id)
+
+      Tag.count_task_links(task_ids, -1, conflicting)
+      DB.session.execute(TAG_TASK_LINK.delete().where(
+          TAG_TASK_LINK.c.task_id.in_(task_ids)
+      ).where(
+          TAG_TASK_LINK.c.tag_id.in_(
+              sqlalchemy.select([Tag.object_id]).where(conflicting))
+      ))
+
+    # Counting the existing links out, and all the links back in, adds just the
+    # new ones.
+    is_self = Tag.object_id == self.object_id
+    Tag.count_task_links(task_ids, -1, is_self)
+
+    DB.session.execute(TAG_TASK_LINK.insert().from_select(
+        ['tag_id', 'task_id'],
+        sqlalchemy.select([
+            sqlalchemy.literal(self.object_id),
+            _TASK.c.object_id,
+        ]).where(
+            _TASK.c.object_id.in_(task_ids)
+        ).where(
+            ~sqlalchemy.exists().where(
+                TAG_TASK_LINK.c.tag_id == self.object_id
+            ).where(
+                TAG_TASK_LINK.c.task_id == _TASK.c.object_id
+            )
+        )))
+
+    Tag.count_task_links(task_ids, 1, is_self)
+
+  def remove_from_tasks(self, task_ids: 'List[typevars.ObjectID]') -> None:
+    """Unlink the tag from tasks, keeping its task counts up to date."""
+    if not task_ids:
+      return
+
+    Tag.count_task_links(task_ids, -1, Tag.object_id == self.object_id)
+    DB.session.execute(TAG_TASK_LINK.delete().where(
+        TAG_TASK_LINK.c.tag_id == self.object_id
+    ).where(
+        TAG_TASK_LINK.c.task_id.in_(task_ids)
+    ))
+
+  def merge_from(self, sources: 'List[Tag]') -> None:
+    """Move the links of other tags to this tag, and delete them.
+
+    Tasks with any of the source tags get this tag instead, replacing any other
+    tag from this tag's group, using a fixed number of statements however many
+    tasks there are; the task counts of the affected tags are kept up to date.
+    The sources are unlinked from their lists, and must not include this tag.
+    """
+    if not sources:
+      return
+
+    source_ids = [source.object_id for source in sources]
+    source_tasks = sqlalchemy.select([
+        TAG_TASK_LINK.c.task_id
+    ]).where(
+        TAG_TASK_LINK.c.tag_id.in_(source_ids)
+    )
+    is_self = Tag.object_id == self.object_id
+
+    Tag.count_task_links(source_tasks, -1, is_self)
+
+    existing = TAG_TASK_LINK.alias('existing')
+    DB.session.execute(TAG_TASK_LINK.insert().from_select(
+        ['tag_id', 'task_id'],
+        sqlalchemy.select([
+            sqlalchemy.literal(self.object_id),
+            TAG_TASK_LINK.c.task_id,
+        ]).distinct().where(
+            TAG_TASK_LINK.c.tag_id.in_(source_ids)
+        ).where(
+            ~sqlalchemy.exists().where(
+                existing.c.tag_id == self.object_id
+            ).where(
+                existing.c.task_id == TAG_TASK_LINK.c.task_id
+            )
+        )))
+
+    Tag.count_task_links(source_tasks, 1, is_self)
+
+    if self.group_id is not None:
+      # Links to the source tags are deleted with them below.
+      conflicting = sqlalchemy.and_(
+          Tag.group_id == self.group_id,
+          Tag.object_id != self.object_id,
+          Tag.object_id.notin_(source_ids))
+
+      Tag.count_task_links(source_tasks, -1, conflicting)
+      DB.session.execute(TAG_TASK_LINK.delete().where(
+          TAG_TASK_LINK.c.task_id.in_(source_tasks)
+      ).where(
+          TAG_TASK_LINK.c.tag_id.in_(
+              sqlalchemy.select([Tag.object_id]).where(conflicting))
+      ))
+
+    DB.session.execute(TAG_TASK_LINK.delete().where(
+        TAG_TASK_LINK.c.tag_id.in_(source_ids)))
+
+    for source in sources:
+      source.unlink()
+      DB.session.delete(source)
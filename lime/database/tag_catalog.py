@@ -0,0 +1,237 @@
+"""Flat loading and caching of a user's tag groups and tags.
+
+The serialized catalog is kept in a size-bounded, in-process LRU cache. Entries
+are keyed by `User.tag_version`, which any change to the catalog must bump (with
+`invalidate`), so every process sees the change on its next read. Each entry
+also lazily builds a title index for `suggest`.
+"""
+
+import bisect
+import collections
+import threading
+import typing
+
+import sqlalchemy
+
+from . import db
+from . import ordering
+from . import tag
+from . import tag_group
+from . import user
+from .. import app
+from ..util import api
+
+# pylint: disable=unused-import,ungrouped-imports,invalid-name
+if typing.TYPE_CHECKING:
+  from typing import (
+      Any,
+      Dict,
+      List,
+      Optional,
+  )
+  from ..util import typevars
+# pylint: enable=unused-import,ungrouped-imports,invalid-name
+
+DB = db.DB
+
+
+class _Entry:
+  """A cached catalog, and the title index built from it on first use."""
+
+  __slots__ = ('version', 'catalog', 'titles', 'tags')
+
+  def __init__(self, version: int, catalog: 'List[Dict[str, Any]]') -> None:
+    self.version = version
+    self.catalog = catalog
+    # Casefolded titles in sorted order, and the tag with each title.
+    self.titles: 'Optional[List[str]]' = None
+    self.tags: 'List[Dict[str, Any]]' = []
+
+  def build_index(self) -> None:
+    """Sort the catalog's tags by casefolded title, then ID."""
+    tags = sorted(
+        (fields['title'].casefold(), fields['object_id'], fields)
+        for fields in self.catalog
+        if fields['__identifier'] == api.identifier_of(tag.Tag))
+
+    self.tags = [fields for _, _, fields in tags]
+    self.titles = [title for title, _, _ in tags]
+
+
+# User ID -> cache entry, least recently used first.
+_CACHE: 'collections.OrderedDict[typevars.ObjectID, _Entry]' = (
+    collections.OrderedDict())
+_CACHE_LOCK = threading.Lock()
+
+
+def _serialize(cls: 'Any', fields: 'Dict[str, Any]') -> 'Dict[str, Any]':
+  """Build the same dict as encoding an instance of a model would."""
+  serialized = {
+      key: fields[key] for key in cls.__json_fields__ + ['object_id']}
+  serialized['__identifier'] = api.identifier_of(cls)
+
+  return serialized
+
+
+def load(user_id: 'typevars.ObjectID') -> 'List[Dict[str, Any]]':
+  """Load all of a user's tag groups and tags, already serialized.
+
+  This is two flat column queries (groups, then tags), so no model instances
+  or relationships are loaded. The result is groups, then the tags of each
+  group in list order, then ungrouped tags.
+  """
+  groups = DB.session.query(
+      tag_group.TagGroup.object_id,
+      tag_group.TagGroup.title,
+      tag_group.TagGroup.owner_id
+  ).filter(
+      tag_group.TagGroup.owner_id == user_id
+  ).order_by(
+      tag_group.TagGroup.object_id
+  ).all()
+
+  group_ids = [group.object_id for group in groups]
+  is_owned = tag.Tag.owner_id == user_id
+
+  if group_ids:
+    is_owned = sqlalchemy.or_(is_owned, tag.Tag.group_id.in_(group_ids))
+
+  rows = DB.session.query(
+      tag.Tag.object_id,
+      tag.Tag.title,
+      tag.Tag.open_task_count,
+      tag.Tag.total_task_count,
+      tag.Tag.group_id,
+      tag.Tag.owner_id,
+      tag.Tag.before_id,
+      tag.Tag.after_id
+  ).filter(
+      is_owned
+  ).order_by(
+      tag.Tag.object_id
+  ).all()
+
+  grouped: 'Dict[typevars.ObjectID, List[Any]]' = {
+      group_id: [] for group_id in group_ids}
+  ungrouped: 'List[Any]' = []
+
+  for row in rows:
+    if row.group_id is not None:
+      grouped[row.group_id].append(row)
+    else:
+      ungrouped.append(row)
+
+  for group_id, group_rows in grouped.items():
+    grouped[group_id] = ordering.order_chain(group_rows)
+
+  serialized = [
+      _serialize(
+          tag_group.TagGroup,
+          dict(group._asdict(), tag_ids=[
+              row.object_id for row in grouped[group.object_id]]))
+      for group in groups
+  ]
+
+  for group in groups:
+    serialized.extend(
+        _serialize(tag.Tag, row._asdict()) for row in grouped[group.object_id])
+
+  serialized.extend(_serialize(tag.Tag, row._asdict()) for row in ungrouped)
+
+  return serialized
+
+
+def _get_entry(user_id: 'typevars.ObjectID') -> _Entry:
+  """Get a user's cache entry, loading the catalog only if it is stale.
+
+  A cache hit costs one query, for the user's tag version.
+  """
+  version = DB.session.query(
+      user.User.tag_version
+  ).filter(
+      user.User.object_id == user_id
+  ).scalar()
+
+  with _CACHE_LOCK:
+    entry = _CACHE.get(user_id)
+
+    if entry is not None and entry.version == version:
+      _CACHE.move_to_end(user_id)
+      return entry
+
+  # The version was read first, so the catalog is at least that new; caching it
+  # under an old version only costs an extra load later.
+  entry = _Entry(version, load(user_id))
+
+  with _CACHE_LOCK:
+    _CACHE[user_id] = entry
+    _CACHE.move_to_end(user_id)
+
+    while len(_CACHE) > app.APP.config['TAG_CATALOG_CACHE_SIZE']:
+      _CACHE.popitem(last=False)
+
+  return entry
+
+
+def get(user_id: 'typevars.ObjectID') -> 'List[Dict[str, Any]]':
+  """Get a user's serialized catalog, loading it only if the cache is stale.
+
+  The returned list is shared between requests, and must not be modified.
+  """
+  return _get_entry(user_id).catalog
+
+
+def suggest(
+    user_id: 'typevars.ObjectID',
+    prefix: str,
+    limit: int
+    ) -> 'List[Dict[str, Any]]':
+  """Find a user's serialized tags whose titles start with a prefix.
+
+  Matching ignores case. Tags are returned in title order, then ID order. This
+  is a binary search of the cached index, which is built the first time it is
+  needed after the catalog is loaded; the returned dicts are shared, and must
+  not be modified.
+  """
+  entry = _get_entry(user_id)
+
+  with _CACHE_LOCK:
+    if entry.titles is None:
+      entry.build_index()
+
+    titles, tags = entry.titles, entry.tags
+
+  prefix = prefix.casefold()
+  start = bisect.bisect_left(titles, prefix)
+  suggestions = []
+
+  for index in range(start, min(start + limit, len(titles))):
+    if not titles[index].startswith(prefix):
+      break
+
+    suggestions.append(tags[index])
+
+  return suggestions
+
+
+def invalidate(*user_ids: 'typevars.ObjectID') -> None:
+  """Bump the tag version of each given user, in the current transaction.
+
+  This is one UPDATE however many users there are.
+  """
+  if not user_ids:
+    return
+
+  table = user.User.__table__
+
+  DB.session.execute(table.update().where(
+      table.c.object_id.in_(user_ids)
+  ).values(
+      tag_version=table.c.tag_version + 1
+  ))
+
+
+def clear_cache() -> None:
+  """Drop every cached catalog, e.g. after the database is replaced."""
+  with _CACHE_LOCK:
+    _CACHE.clear()
@@ -0,0 +1,167 @@
+"""Tests for the tag catalog loader."""
+
+from unittest import mock
+
+from absl.testing import absltest
+
+from lime import app
+from lime.database import db
+from lime.database import models
+from lime.database import tag_catalog
+from lime.util import api
+from lime.util import testing
+
+
+def serialize(obj):
+  """Serialize a model the way the API encoder does."""
+  return dict(obj.to_json(), __identifier=api.identifier_of(obj.__class__))
+
+
+class TagCatalogTest(absltest.TestCase):
+  """Tests for the tag catalog loader."""
+
+  def setUp(self):
+    tag_catalog.clear_cache()
+
+  def test_load(self):
+    """Test load matches serializing the models, for only the given user."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      other_user = models.User(
+          name='other', email='other@test.com', password='test')
+      group1 = models.TagGroup(title='Group1', owner=user)
+      group2 = models.TagGroup(title='Group2', owner=user)
+      empty_group = models.TagGroup(title='Empty', owner=user)
+      tag1 = models.Tag(title='Tag1', group=group1)
+      tag2 = models.Tag(title='Tag2', group=group1)
+      tag1.link(tag2, None)
+      tag3 = models.Tag(title='Tag3', group=group2)
+      standalone = models.Tag(title='Standalone', direct_owner=user)
+      other_group = models.TagGroup(title='Other', owner=other_user)
+      other_tag = models.Tag(title='Other', group=other_group)
+      db.DB.session.add_all([
+          user, other_user, group1, group2, empty_group, tag1, tag2, tag3,
+          standalone, other_group, other_tag])
+      db.DB.session.commit()
+
+      expected = [
+          serialize(obj) for obj in [
+              group1, group2, empty_group, tag2, tag1, tag3, standalone]]
+
+      self.assertEqual(expected, tag_catalog.load(user.object_id))
+      self.assertEqual([], tag_catalog.load(12345))
+
+  def test_get(self):
+    """Test get only reloads the catalog after it is invalidated."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      tag = models.Tag(title='Tag', direct_owner=user)
+      db.DB.session.add_all([user, tag])
+      db.DB.session.commit()
+
+      with mock.patch.object(
+          tag_catalog, 'load', wraps=tag_catalog.load) as load_mock:
+        first = tag_catalog.get(user.object_id)
+
+        self.assertEqual([serialize(tag)], first)
+        self.assertIs(first, tag_catalog.get(user.object_id))
+        self.assertEqual(1, load_mock.call_count)
+
+        tag.title = 'Renamed'
+        tag_catalog.invalidate(user.object_id)
+        db.DB.session.commit()
+
+        self.assertEqual('Renamed', tag_catalog.get(user.object_id)[0]['title'])
+        self.assertEqual(2, load_mock.call_count)
+
+  def test_invalidate(self):
+    """Test invalidate bumps the tag version of every given user."""
+    with testing.test_setup():
+      users = [
+          models.User(
+              name='test', email='test{}@test.com'.format(i), password='test')
+          for i in range(3)
+      ]
+      db.DB.session.add_all(users)
+      db.DB.session.commit()
+
+      tag_catalog.invalidate(users[0].object_id, users[2].object_id)
+      tag_catalog.invalidate()
+      db.DB.session.commit()
+      db.DB.session.expire_all()
+
+      self.assertEqual([1, 0, 1], [user.tag_version for user in users])
+
+  def test_get__evicts_least_recently_used(self):
+    """Test the cache holds at most the configured number of users."""
+    with testing.test_setup():
+      users = [
+          models.User(
+              name='test', email='test{}@test.com'.format(i), password='test')
+          for i in range(3)]
+      db.DB.session.add_all(users)
+      db.DB.session.commit()
+
+      with mock.patch.dict(app.APP.config, {'TAG_CATALOG_CACHE_SIZE': 2}):
+        with mock.patch.object(
+            tag_catalog, 'load', wraps=tag_catalog.load) as load_mock:
+          for user in users[:2] + users[:1] + users[2:] + users[:2]:
+            tag_catalog.get(user.object_id)
+
+          # users[1] is evicted by users[2], then reloaded.
+          self.assertEqual(
+              [user.object_id for user in users + users[1:2]],
+              [call[0][0] for call in load_mock.call_args_list])
+
+  def test_suggest(self):
+    """Test suggest matches title prefixes, ignoring case, in title order."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      group = models.TagGroup(title='Work', owner=user)
+      tags = [
+          models.Tag(title=title, direct_owner=user)
+          for title in ['home', 'Hobby', 'Errand', 'hobby', 'House']]
+      grouped = models.Tag(title='Holiday', group=group)
+      db.DB.session.add_all([user, group, grouped] + tags)
+      db.DB.session.commit()
+
+      def suggest(prefix, limit=10):
+        return [
+            fields['object_id']
+            for fields in tag_catalog.suggest(user.object_id, prefix, limit)]
+
+      home, hobby1, errand, hobby2, house = [tag.object_id for tag in tags]
+
+      self.assertEqual(
+          [hobby1, hobby2, grouped.object_id, home, house], suggest('h'))
+      self.assertEqual([hobby1, hobby2], suggest('HOB'))
+      self.assertEqual([hobby1, hobby2], suggest('h', 2))
+      self.assertEqual([errand], suggest('errand'))
+      self.assertEqual([], suggest('x'))
+      self.assertEqual(6, len(suggest('')))
+      self.assertEqual([], suggest('h', 0))
+
+  def test_suggest__invalidated(self):
+    """Test suggest rebuilds its index after the catalog is invalidated."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      tag = models.Tag(title='Tag', direct_owner=user)
+      db.DB.session.add_all([user, tag])
+      db.DB.session.commit()
+
+      self.assertEqual(['Tag'], [
+          fields['title'] for fields in tag_catalog.suggest(
+              user.object_id, 't', 10)])
+
+      tag.title = 'Renamed'
+      tag_catalog.invalidate(user.object_id)
+      db.DB.session.commit()
+
+      self.assertEqual([], tag_catalog.suggest(user.object_id, 't', 10))
+      self.assertEqual(['Renamed'], [
+          fields['title'] for fields in tag_catalog.suggest(
+              user.object_id, 'r', 10)])
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,100 @@
+"""Boolean expressions over tags, for filtering tasks.
+
+Expressions are JSON values:
+  - a tag ID matches tasks with that tag,
+  - `{"and": [...]}` matches tasks matching all of the sub-expressions,
+  - `{"or": [...]}` matches tasks matching any of the sub-expressions,
+  - `{"not": ...}` matches tasks not matching the sub-expression.
+
+Each tag becomes a semi-join against `tag_task_link`, which is answered from
+the (tag_id, task_id) index without loading any tasks.
+"""
+
+import typing
+
+import sqlalchemy
+
+from . import errors
+from . import tag
+
+# pylint: disable=unused-import,ungrouped-imports,invalid-name
+if typing.TYPE_CHECKING:
+  from typing import (
+      Any,
+      Set,
+  )
+  from ..util import typevars
+# pylint: enable=unused-import,ungrouped-imports,invalid-name
+
+# Bound the size of an expression, since each tag costs a semi-join.
+MAX_TERMS = 50
+
+_OPERATORS = {
+    'and': sqlalchemy.and_,
+    'or': sqlalchemy.or_,
+}
+
+
+def tag_ids(expression: 'Any') -> 'Set[typevars.ObjectID]':
+  """Validate an expression, and find all the tag IDs used in it.
+
+  Raises:
+    errors.InvalidTagExpressionError: if the expression is malformed or too
+      large.
+  """
+  found: 'Set[typevars.ObjectID]' = set()
+  terms = 0
+  pending = [expression]
+
+  while pending:
+    expression = pending.pop()
+    terms += 1
+
+    if terms > MAX_TERMS:
+      raise errors.InvalidTagExpressionError(
+          'Tag expressions may have at most {} terms'.format(MAX_TERMS))
+
+    if isinstance(expression, int) and not isinstance(expression, bool):
+      found.add(expression)
+      continue
+
+    if not isinstance(expression, dict) or len(expression) != 1:
+      raise errors.InvalidTagExpressionError(
+          'Invalid tag expression: {!r}'.format(expression))
+
+    ((operator, operands),) = expression.items()
+
+    if operator == 'not':
+      pending.append(operands)
+    elif operator in _OPERATORS and isinstance(operands, list):
+      pending.extend(operands)
+    else:
+      raise errors.InvalidTagExpressionError(
+          'Invalid tag expression: {!r}'.format(expression))
+
+  return found
+
+
+def to_clause(
+    expression: 'Any',
+    task_id: 'sqlalchemy.sql.ColumnElement'
+    ) -> 'sqlalchemy.sql.ColumnElement':
+  """Compile a validated expression to a filter on the given task ID column."""
+  if isinstance(expression, int):
+    return sqlalchemy.exists().where(
+        tag.TAG_TASK_LINK.c.tag_id == expression
+    ).where(
+        tag.TAG_TASK_LINK.c.task_id == task_id
+    )
+
+  ((operator, operands),) = expression.items()
+
+  if operator == 'not':
+    return ~to_clause(operands, task_id)
+
+  if not operands:
+    # An empty conjunction matches everything; an empty disjunction nothing.
+    return sqlalchemy.true() if operator == 'and' else sqlalchemy.false()
+
+  return _OPERATORS[operator](
+      *(to_clause(operand, task_id) for operand in operands))
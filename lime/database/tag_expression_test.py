@@ -0,0 +1,72 @@
+"""Tests for tag expressions."""
+
+from absl.testing import absltest
+
+from lime.database import db
+from lime.database import errors
+from lime.database import models
+from lime.database import tag_expression
+from lime.util import testing
+
+
+class TagExpressionTest(absltest.TestCase):
+  """Tests for tag expressions."""
+
+  def test_tag_ids(self):
+    """Test tag_ids finds every tag in a nested expression."""
+    self.assertEqual({1, 2, 3}, tag_expression.tag_ids(
+        {'and': [1, {'or': [2, {'not': 3}]}, {'not': 1}]}))
+
+  def test_tag_ids__invalid(self):
+    """Test tag_ids rejects malformed expressions."""
+    for expression in [
+        'foo',
+        True,
+        None,
+        {'xor': [1, 2]},
+        {'and': 1},
+        {'and': [1], 'or': [2]},
+        {'not': {'and': ['1']}},
+    ]:
+      with self.assertRaises(errors.InvalidTagExpressionError):
+        tag_expression.tag_ids(expression)
+
+  def test_tag_ids__too_large(self):
+    """Test tag_ids rejects expressions with too many terms."""
+    with self.assertRaises(errors.InvalidTagExpressionError):
+      tag_expression.tag_ids({'or': list(range(tag_expression.MAX_TERMS))})
+
+  def test_to_clause(self):
+    """Test to_clause filters tasks by their tags."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      tag_a = models.Tag(title='A', direct_owner=user)
+      tag_b = models.Tag(title='B', direct_owner=user)
+      tag_c = models.Tag(title='C', direct_owner=user)
+      tasks = {
+          'ab': models.Task(title='ab', owner=user, tags=[tag_a, tag_b]),
+          'abc': models.Task(
+              title='abc', owner=user, tags=[tag_a, tag_b, tag_c]),
+          'a': models.Task(title='a', owner=user, tags=[tag_a]),
+          'c': models.Task(title='c', owner=user, tags=[tag_c]),
+          '': models.Task(title='', owner=user),
+      }
+      db.DB.session.add_all([user, tag_a, tag_b, tag_c] + list(tasks.values()))
+      db.DB.session.commit()
+
+      a, b, c = tag_a.object_id, tag_b.object_id, tag_c.object_id
+
+      def find(expression):
+        tag_expression.tag_ids(expression)
+        return sorted(task.title for task in models.Task.query.filter(
+            tag_expression.to_clause(expression, models.Task.object_id)))
+
+      self.assertEqual(['ab'], find({'and': [a, b, {'not': c}]}))
+      self.assertEqual(['a', 'ab', 'abc', 'c'], find({'or': [a, c]}))
+      self.assertEqual(['', 'c'], find({'not': a}))
+      self.assertEqual(['', 'a', 'ab', 'abc', 'c'], find({'and': []}))
+      self.assertEqual([], find({'or': []}))
+
+
+if __name__ == '__main__':
+  absltest.main()
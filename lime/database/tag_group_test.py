@@ -18,6 +18,16 @@ class TagGroupTest(absltest.TestCase):
 
     self.assertItemsEqual([1, 2, 3], group.tag_ids)
 
+  def test_tag_ids__list_order(self):
+    """Test TagGroup.tag_ids follows the tags' pointers."""
+    group = models.TagGroup(tags=[
+        models.Tag(object_id=1, before_id=3, after_id=None),
+        models.Tag(object_id=2, before_id=None, after_id=3),
+        models.Tag(object_id=3, before_id=2, after_id=1),
+    ])
+
+    self.assertEqual([2, 3, 1], group.tag_ids)
+
   def test_to_json(self):
     """Test TagGroup.to_json()."""
     group = models.TagGroup(
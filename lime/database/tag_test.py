@@ -2,7 +2,18 @@
 
 from absl.testing import absltest
 
+from lime.database import db
 from lime.database import models
+from lime.util import testing
+
+
+def task_counts(*tags):
+  """Load the task counts of tags, as {title: (open, total)}."""
+  db.DB.session.expire_all()
+
+  return {
+      tag.title: (tag.open_task_count, tag.total_task_count) for tag in tags
+  }
 
 
 class TagTest(absltest.TestCase):
@@ -23,47 +34,253 @@ class TagTest(absltest.TestCase):
 
     self.assertEqual(user, tag.owner)
 
-  def test_before_id(self):
-    """Test Tag.before_id property when tag has a before tag."""
+  def test_link(self):
+    """Test Tag.link inserts the tag between two tags."""
     before = models.Tag(object_id=1)
-    tag = models.Tag(before=before)
+    after = models.Tag(object_id=2)
+    before.after = after
+    after.before = before
+    tag = models.Tag(object_id=3)
+
+    tag.link(before, after)
+
+    self.assertIs(tag, before.after)
+    self.assertIs(before, tag.before)
+    self.assertIs(after, tag.after)
+    self.assertIs(tag, after.before)
+
+  def test_unlink(self):
+    """Test Tag.unlink joins up the neighbouring tags."""
+    before = models.Tag(object_id=1)
+    after = models.Tag(object_id=2)
+    tag = models.Tag(object_id=3)
+    tag.link(before, None)
+    after.link(tag, None)
+
+    tag.unlink()
+
+    self.assertIs(after, before.after)
+    self.assertIs(before, after.before)
+    self.assertIsNone(tag.before)
+    self.assertIsNone(tag.after)
+
+  def test_link__persists_ids(self):
+    """Test both pointers are stored on the rows."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      group = models.TagGroup(title='Group', owner=user)
+      first = models.Tag(title='First', group=group)
+      second = models.Tag(title='Second', group=group)
+      second.link(first, None)
+      db.DB.session.add_all([user, group, first, second])
+      db.DB.session.commit()
+
+      self.assertEqual(
+          (None, second.object_id), (first.before_id, first.after_id))
+      self.assertEqual(
+          (first.object_id, None), (second.before_id, second.after_id))
+
+  def test_apply_to_tasks(self):
+    """Test Tag.apply_to_tasks replaces other tags from the same group."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      group = models.TagGroup(title='Group', owner=user)
+      tag = models.Tag(title='Tag', group=group)
+      other = models.Tag(title='Other', group=group)
+      standalone = models.Tag(title='Standalone', direct_owner=user)
+      task1 = models.Task(title='Task1', owner=user, tags=[other, standalone])
+      task2 = models.Task(title='Task2', owner=user, tags=[tag])
+      task3 = models.Task(title='Task3', owner=user)
+      db.DB.session.add_all([user, group, tag, other, standalone, task1, task2,
+                             task3])
+      db.DB.session.commit()
+
+      tag.apply_to_tasks([task1.object_id, task2.object_id])
+      db.DB.session.commit()
+
+      self.assertCountEqual([tag, standalone], task1.tags)
+      self.assertEqual([tag], task2.tags)
+      self.assertEqual([], task3.tags)
+
+  def test_apply_to_tasks__counts(self):
+    """Test Tag.apply_to_tasks maintains the task counts of affected tags."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      group = models.TagGroup(title='Group', owner=user)
+      tag = models.Tag(title='Tag', group=group)
+      other = models.Tag(title='Other', group=group)
+      standalone = models.Tag(title='Standalone', direct_owner=user)
+      task1 = models.Task(title='Task1', owner=user, tags=[other, standalone])
+      task2 = models.Task(title='Task2', owner=user, tags=[tag])
+      task3 = models.Task(
+          title='Task3', owner=user, completed=True, tags=[other])
+      db.DB.session.add_all([user, group, tag, other, standalone, task1, task2,
+                             task3])
+      db.DB.session.commit()
+      models.Tag.recount_tasks()
+
+      tag.apply_to_tasks([task1.object_id, task2.object_id, task3.object_id])
+      db.DB.session.commit()
+
+      self.assertEqual(
+          {'Tag': (2, 3), 'Other': (0, 0), 'Standalone': (1, 1)},
+          task_counts(tag, other, standalone))
 
-    self.assertEqual(1, tag.before_id)
+  def test_remove_from_tasks__counts(self):
+    """Test Tag.remove_from_tasks only counts tasks which had the tag."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      tag = models.Tag(title='Tag', direct_owner=user)
+      task1 = models.Task(title='Task1', owner=user, tags=[tag])
+      task2 = models.Task(title='Task2', owner=user, completed=True, tags=[tag])
+      task3 = models.Task(title='Task3', owner=user)
+      db.DB.session.add_all([user, tag, task1, task2, task3])
+      db.DB.session.commit()
+      models.Tag.recount_tasks()
 
-  def test_before_id__no_before(self):
-    """Test Tag.before_id property when tag has no before tag."""
-    tag = models.Tag()
+      tag.remove_from_tasks([task2.object_id, task3.object_id])
+      db.DB.session.commit()
 
-    self.assertEqual(None, tag.before_id)
+      self.assertEqual({'Tag': (1, 1)}, task_counts(tag))
 
-  def test_after_id(self):
-    """Test Tag.after_id property when tag has a after tag."""
-    after = models.Tag(object_id=1)
-    tag = models.Tag(after=after)
+  def test_adjust_open_task_counts(self):
+    """Test Tag.adjust_open_task_counts only updates the task's tags."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      tag = models.Tag(title='Tag', direct_owner=user)
+      other = models.Tag(title='Other', direct_owner=user)
+      task1 = models.Task(title='Task1', owner=user, tags=[tag])
+      task2 = models.Task(title='Task2', owner=user, tags=[tag, other])
+      db.DB.session.add_all([user, tag, other, task1, task2])
+      db.DB.session.commit()
+      models.Tag.recount_tasks()
 
-    self.assertEqual(1, tag.after_id)
+      self.assertEqual(
+          1, models.Tag.adjust_open_task_counts(task1.object_id, -1))
+      db.DB.session.commit()
 
-  def test_after_id__no_after(self):
-    """Test Tag.after_id property when tag has no after tag."""
-    tag = models.Tag()
+      self.assertEqual(
+          {'Tag': (1, 2), 'Other': (1, 1)}, task_counts(tag, other))
 
-    self.assertEqual(None, tag.after_id)
+  def test_count_task_links(self):
+    """Test Tag.count_task_links with a subquery of task IDs and criteria."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      tag = models.Tag(title='Tag', direct_owner=user)
+      other = models.Tag(title='Other', direct_owner=user)
+      task1 = models.Task(title='Task1', owner=user, tags=[tag, other])
+      task2 = models.Task(title='Task2', owner=user, tags=[tag])
+      db.DB.session.add_all([user, tag, other, task1, task2])
+      db.DB.session.commit()
+      models.Tag.recount_tasks()
+
+      self.assertEqual(1, models.Tag.count_task_links(
+          db.DB.session.query(models.Task.object_id).filter(
+              models.Task.title == 'Task1').subquery(),
+          -1,
+          models.Tag.title == 'Tag'))
+      db.DB.session.commit()
+
+      self.assertEqual(
+          {'Tag': (1, 1), 'Other': (1, 1)}, task_counts(tag, other))
+
+  def test_recount_tasks(self):
+    """Test Tag.recount_tasks only corrects tags which have drifted."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      other_user = models.User(
+          name='other', email='other@test.com', password='test')
+      group = models.TagGroup(title='Group', owner=other_user)
+      tag = models.Tag(title='Tag', direct_owner=user)
+      other = models.Tag(title='Other', direct_owner=user)
+      grouped = models.Tag(title='Grouped', group=group)
+      task1 = models.Task(title='Task1', owner=user, tags=[tag])
+      task2 = models.Task(title='Task2', owner=user, completed=True, tags=[tag])
+      task3 = models.Task(title='Task3', owner=other_user, tags=[grouped])
+      db.DB.session.add_all([
+          user, other_user, group, tag, other, grouped, task1, task2, task3])
+      db.DB.session.commit()
+
+      self.assertEqual(
+          {user.object_id, other_user.object_id}, models.Tag.recount_tasks())
+      db.DB.session.commit()
+
+      self.assertEqual(
+          {'Tag': (1, 2), 'Other': (0, 0), 'Grouped': (1, 1)},
+          task_counts(tag, other, grouped))
+      self.assertEqual(set(), models.Tag.recount_tasks())
+
+  def test_remove_from_tasks(self):
+    """Test Tag.remove_from_tasks only removes the given tag."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      tag = models.Tag(title='Tag', direct_owner=user)
+      other = models.Tag(title='Other', direct_owner=user)
+      task1 = models.Task(title='Task1', owner=user, tags=[tag, other])
+      task2 = models.Task(title='Task2', owner=user, tags=[tag])
+      db.DB.session.add_all([user, tag, other, task1, task2])
+      db.DB.session.commit()
+
+      tag.remove_from_tasks([task1.object_id])
+      db.DB.session.commit()
+
+      self.assertEqual([other], task1.tags)
+      self.assertEqual([tag], task2.tags)
+
+  def test_merge_from(self):
+    """Test Tag.merge_from moves links to the target and deletes the sources."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      group = models.TagGroup(title='Group', owner=user)
+      target = models.Tag(title='Target', group=group)
+      sibling = models.Tag(title='Sibling', group=group)
+      source1 = models.Tag(title='Source1', direct_owner=user)
+      source2 = models.Tag(title='Source2', group=group)
+      other = models.Tag(title='Other', direct_owner=user)
+      source2.link(target, None)
+      sibling.link(source2, None)
+      task1 = models.Task(title='Task1', owner=user, tags=[source1, sibling])
+      task2 = models.Task(
+          title='Task2', owner=user, completed=True, tags=[source1, source2])
+      task3 = models.Task(title='Task3', owner=user, tags=[target, source1])
+      task4 = models.Task(title='Task4', owner=user, tags=[sibling, other])
+      db.DB.session.add_all([user, group, target, sibling, source1, source2,
+                             other, task1, task2, task3, task4])
+      db.DB.session.commit()
+      models.Tag.recount_tasks()
+      source_ids = [source1.object_id, source2.object_id]
+
+      target.merge_from([source1, source2])
+      db.DB.session.commit()
+
+      self.assertEqual(
+          [], models.Tag.query.filter(models.Tag.object_id.in_(source_ids)
+                                      ).all())
+      self.assertEqual([target], task1.tags)
+      self.assertEqual([target], task2.tags)
+      self.assertEqual([target], task3.tags)
+      self.assertCountEqual([sibling, other], task4.tags)
+      self.assertEqual([target.object_id, sibling.object_id], group.tag_ids)
+      self.assertEqual(
+          {'Target': (2, 3), 'Sibling': (1, 1), 'Other': (1, 1)},
+          task_counts(target, sibling, other))
 
   def test_to_json__in_group(self):
     """Test serialization of Tag when not in a group."""
-    before = models.Tag(object_id=3)
-    after = models.Tag(object_id=4)
-
     tag = models.Tag(
         object_id=1,
         group_id=2,
         title='Tag',
-        before=before,
-        after=after)
+        open_task_count=5,
+        total_task_count=6,
+        before_id=3,
+        after_id=4)
 
     expected = {
         'object_id': 1,
         'title': 'Tag',
+        'open_task_count': 5,
+        'total_task_count': 6,
         'owner_id': None,
         'group_id': 2,
         'before_id': 3,
@@ -72,21 +289,38 @@ class TagTest(absltest.TestCase):
 
     self.assertEqual(expected, tag.to_json())
 
+  def test_compile_json_serializer(self):
+    """Test the compiled serializer matches to_json, even once expired."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      tag = models.Tag(title='Tag', direct_owner=user)
+      db.DB.session.add_all([user, tag])
+      db.DB.session.commit()
+
+      serialize = models.Tag.compile_json_serializer('Tag')
+      expected = dict(tag.to_json(), __identifier='Tag')
+
+      db.DB.session.expire(tag)
+
+      self.assertEqual(expected, serialize(tag))
+      self.assertEqual(expected, serialize(tag))
+
   def test_to_json__not_in_group(self):
     """Test serialization of Tag when not in a group."""
-    before = models.Tag(object_id=3)
-    after = models.Tag(object_id=4)
-
     tag = models.Tag(
         object_id=1,
         owner_id=2,
         title='Tag',
-        before=before,
-        after=after)
+        open_task_count=5,
+        total_task_count=6,
+        before_id=3,
+        after_id=4)
 
     expected = {
         'object_id': 1,
         'title': 'Tag',
+        'open_task_count': 5,
+        'total_task_count': 6,
         'owner_id': 2,
         'group_id': None,
         'before_id': 3,
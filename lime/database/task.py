@@ -1,28 +1,29 @@
 """Model for tasks."""
 
+import collections
 import typing
 
 import sqlalchemy
 
 from . import db
+from . import tag
+from . import task_closure
 from ..util import api
 
 # pylint: disable=unused-import,ungrouped-imports,invalid-name
 if typing.TYPE_CHECKING:
+  from typing import (
+      Dict,
+      List,
+      Optional,
+      Set,
+  )
   from ..util import typevars
 # pylint: enable=unused-import,ungrouped-imports,invalid-name
 
 DB = db.DB
 
 
-ORDERING_LINK = DB.Table(
-    'task_ordering_link',
-    DB.Model.metadata,
-    DB.Column('before_id', DB.Integer, DB.ForeignKey('task.object_id', ondelete='CASCADE')),
-    DB.Column('after_id', DB.Integer, DB.ForeignKey('task.object_id', ondelete='CASCADE'))
-)
-
-
 @api.register_serializable()
 class Task(DB.Model):
   """Model for tasks."""
@@ -32,20 +33,37 @@ class Task(DB.Model):
       'title',
       'completed',
       'notes',
+      'descendant_count',
+      'completed_descendant_count',
       # Relation IDs
       'owner_id',
       'parent_id',
-      # Properties
-      'has_children',
       'before_id',
       'after_id',
+      # Properties
+      'has_children',
       'tag_ids',
   ]
+  __table_args__ = (
+      # Finds the end of a list when appending, without scanning the siblings.
+      sqlalchemy.Index(
+          'ix_task_list_tail', 'owner_id', 'parent_id',
+          postgresql_where=sqlalchemy.text('after_id IS NULL'),
+          sqlite_where=sqlalchemy.text('after_id IS NULL')),
+      # Pages through a user's tasks in ID order.
+      sqlalchemy.Index('ix_task_owner_id_object_id', 'owner_id', 'object_id'),
+  )
 
   # Fields
   title = DB.Column(DB.UnicodeText(), nullable=False)
   completed = DB.Column(DB.Boolean(), nullable=False, default=False)
   notes = DB.Column(DB.UnicodeText(), nullable=False, default='')
+  child_count = DB.Column(DB.Integer(), nullable=False, default=0)
+  # Rollups over the whole subtree (excluding the task itself), maintained by
+  # the functions in task_closure.
+  descendant_count = DB.Column(DB.Integer(), nullable=False, default=0)
+  completed_descendant_count = DB.Column(
+      DB.Integer(), nullable=False, default=0)
 
   # Relation IDs
   owner_id = DB.Column(
@@ -55,6 +73,14 @@ class Task(DB.Model):
       DB.Integer(),
       DB.ForeignKey('task.object_id', ondelete="CASCADE"),
       nullable=True)
+  before_id = DB.Column(
+      DB.Integer(),
+      DB.ForeignKey('task.object_id', ondelete="SET NULL"),
+      nullable=True)
+  after_id = DB.Column(
+      DB.Integer(),
+      DB.ForeignKey('task.object_id', ondelete="SET NULL"),
+      nullable=True)
 
   # Relations
   owner = DB.relationship(
@@ -76,42 +102,277 @@ class Task(DB.Model):
       foreign_keys=[parent_id],
       remote_side='Task.object_id'
   )
+  # The ordering of siblings is a doubly linked list. Both pointers are stored
+  # on the row so that serializing a task needs no joins; use link() and
+  # unlink() to keep them consistent.
+  before = DB.relationship(
+      'Task',
+      foreign_keys=[before_id],
+      remote_side='Task.object_id',
+      post_update=True
+  )
   after = DB.relationship(
       'Task',
-      backref=DB.backref(
-          'before',
-          uselist=False,
-          lazy='joined',
-          join_depth=1
-      ),
-      secondary=ORDERING_LINK,
-      primaryjoin="Task.object_id == task_ordering_link.c.before_id",
-      secondaryjoin="Task.object_id == task_ordering_link.c.after_id",
-      uselist=False,
-      lazy='joined',
-      join_depth=1
+      foreign_keys=[after_id],
+      remote_side='Task.object_id',
+      post_update=True
   )
 
   @property
   def has_children(self) -> bool:
     """Return whether the task has any direct children."""
-    return DB.session.query(
-        sqlalchemy.literal(True)
+    return self.child_count > 0
+
+  @classmethod
+  def adjust_child_count(
+      cls,
+      task_id: 'Optional[typevars.ObjectID]',
+      delta: int
+      ) -> None:
+    """Add `delta` to the child count of a task, in the current transaction.
+
+    The increment is done in SQL to avoid lost updates from concurrent
+    requests. `task_id` being None (i.e. the top level) is a no-op.
+    """
+    cls.adjust_child_counts({task_id: delta})
+
+  @classmethod
+  def adjust_child_counts(
+      cls,
+      deltas: 'Dict[Optional[typevars.ObjectID], int]'
+      ) -> None:
+    """Adjust the child counts of several tasks with one batched UPDATE."""
+    params = [
+        {'_object_id': task_id, '_delta': delta}
+        for task_id, delta in deltas.items()
+        if task_id is not None and delta != 0
+    ]
+
+    if not params:
+      return
+
+    table = cls.__table__
+    DB.session.execute(
+        table.update().where(
+            table.c.object_id == sqlalchemy.bindparam('_object_id')
+        ).values(
+            child_count=table.c.child_count + sqlalchemy.bindparam('_delta')
+        ),
+        params)
+
+    for param in params:
+      task = DB.session.identity_map.get(
+          sqlalchemy.orm.util.identity_key(cls, param['_object_id']))
+
+      if task is not None:
+        DB.session.expire(task, ['child_count'])
+
+  @classmethod
+  def recount_children(cls) -> 'Set[typevars.ObjectID]':
+    """Recompute the child count of every task which has drifted.
+
+    Returns:
+      The IDs of the users owning the tasks which were corrected.
+    """
+    children = sqlalchemy.orm.aliased(cls)
+    actual = DB.session.query(
+        sqlalchemy.func.count(children.object_id)
     ).filter(
-        self.children.exists()
-    ).scalar()
+        children.parent_id == cls.object_id
+    ).as_scalar()
 
-  @property
-  def before_id(self) -> 'typevars.ObjectID':
-    """Indirect to the object ID of the preceding task, or None."""
-    return self.before.object_id if self.before is not None else None
+    owner_ids = set(row[0] for row in DB.session.query(
+        cls.owner_id
+    ).filter(
+        cls.child_count != actual
+    ).distinct())
 
-  @property
-  def after_id(self) -> 'typevars.ObjectID':
-    """Indirect to the object ID of the following task, or None."""
-    return self.after.object_id if self.after is not None else None
+    if owner_ids:
+      cls.query.filter(
+          cls.child_count != actual
+      ).update(
+          {cls.child_count: actual},
+          synchronize_session=False
+      )
+
+    return owner_ids
+
+  @classmethod
+  def subtree_ids(cls, task_id: 'typevars.ObjectID') -> 'sqlalchemy.sql.Select':
+    """Make a query for the IDs of a task and all its descendants.
+
+    This is a single lookup in the closure table, so the result can be used in
+    a set-based statement (e.g. `object_id IN (...)`).
+    """
+    return task_closure.descendant_ids(task_id)
+
+  @classmethod
+  def subtree_query(
+      cls,
+      task_id: 'typevars.ObjectID',
+      max_depth: 'Optional[int]' = None
+      ) -> 'sqlalchemy.orm.Query':
+    """Query a task and its descendants, up to `max_depth` levels below it.
+
+    This is one indexed query on the closure table. Tasks are ordered by depth,
+    so parents always come before their children.
+    """
+    closure = task_closure.TASK_CLOSURE
+    query = cls.query.join(
+        closure, closure.c.descendant_id == cls.object_id
+    ).filter(
+        closure.c.ancestor_id == task_id
+    )
+
+    if max_depth is not None:
+      query = query.filter(closure.c.depth <= max_depth)
+
+    return query.order_by(closure.c.depth, cls.object_id)
+
+  @classmethod
+  def subtree(
+      cls,
+      task_id: 'typevars.ObjectID',
+      max_depth: 'Optional[int]' = None
+      ) -> 'List[Task]':
+    """Load a task and its descendants; see subtree_query."""
+    return cls.subtree_query(task_id, max_depth).all()
+
+  @classmethod
+  def path(cls, task_id: 'typevars.ObjectID') -> 'List[Task]':
+    """Load a task and its ancestors, from the top level down to the task.
+
+    This is one indexed query on the closure table.
+    """
+    closure = task_closure.TASK_CLOSURE
+
+    return cls.query.join(
+        closure, closure.c.ancestor_id == cls.object_id
+    ).filter(
+        closure.c.descendant_id == task_id
+    ).order_by(
+        closure.c.depth.desc()
+    ).all()
+
+  @classmethod
+  def ordered_children(
+      cls,
+      owner_id: 'typevars.ObjectID',
+      parent_id: 'Optional[typevars.ObjectID]'
+      ) -> 'List[Task]':
+    """Load the direct children of a task in list order, in a single query.
+
+    The `after_id` chain is walked with a recursive CTE starting from the task
+    with no predecessor. Tasks which cannot be reached from the head (which only
+    happens if the list is broken) are returned last, in ID order. The walk is
+    bounded by the number of siblings so that a cycle cannot recurse forever.
+
+    `parent_id` being None is a special case for top-level tasks.
+    """
+    is_sibling = sqlalchemy.and_(
+        cls.owner_id == owner_id,
+        cls.parent_id == parent_id)
+    sibling_count = DB.session.query(
+        sqlalchemy.func.count(cls.object_id)
+    ).filter(
+        is_sibling
+    ).as_scalar()
+
+    chain = DB.session.query(
+        cls.object_id.label('task_id'),
+        sqlalchemy.literal(0).label('position')
+    ).filter(
+        is_sibling,
+        cls.before_id.is_(None)
+    ).cte(
+        'chain',
+        recursive=True
+    )
+    chain = chain.union_all(
+        DB.session.query(
+            cls.after_id,
+            chain.c.position + 1
+        ).filter(
+            cls.object_id == chain.c.task_id,
+            cls.after_id.isnot(None),
+            chain.c.position < sibling_count
+        ))
+
+    positions = DB.session.query(
+        chain.c.task_id,
+        sqlalchemy.func.min(chain.c.position).label('position')
+    ).group_by(
+        chain.c.task_id
+    ).subquery()
+
+    return cls.query.outerjoin(
+        positions, positions.c.task_id == cls.object_id
+    ).filter(
+        is_sibling
+    ).order_by(
+        positions.c.position.is_(None),
+        positions.c.position,
+        cls.object_id
+    ).all()
+
+  def link(
+      self,
+      before: 'Optional[Task]',
+      after: 'Optional[Task]'
+      ) -> None:
+    """Insert the task between two adjacent tasks, updating both neighbours."""
+    self.before = before
+    self.after = after
+
+    if before is not None:
+      before.after = self
+
+    if after is not None:
+      after.before = self
+
+  def unlink(self) -> None:
+    """Remove the task from its list, joining up its neighbours."""
+    if self.before is not None:
+      self.before.after = self.after
+
+    if self.after is not None:
+      self.after.before = self.before
+
+    self.before = None
+    self.after = None
+
+  # Set by prefetch_json, so that serializing doesn't need to load the tags.
+  _prefetched_tag_ids: 'Optional[List[typevars.ObjectID]]' = None
+
+  @classmethod
+  def prefetch_json(cls, tasks: 'List[Task]') -> None:
+    """Load the tag IDs of many tasks with one query on the link table."""
+    task_ids = [task.object_id for task in tasks if task.object_id is not None]
+    tag_ids: 'Dict[typevars.ObjectID, List[typevars.ObjectID]]' = (
+        collections.defaultdict(list))
+
+    if task_ids:
+      link = tag.TAG_TASK_LINK
+      rows = DB.session.query(
+          link.c.task_id,
+          link.c.tag_id
+      ).filter(
+          link.c.task_id.in_(task_ids)
+      ).order_by(
+          link.c.tag_id
+      )
+
+      for task_id, tag_id in rows:
+        tag_ids[task_id].append(tag_id)
+
+    for task in tasks:
+      if task.object_id is not None:
+        task._prefetched_tag_ids = tag_ids[task.object_id]  # pylint: disable=protected-access
 
   @property
   def tag_ids(self) -> 'List[typevars.ObjectID]':
-    """The the object ID of the following tag in the group."""
-    return [tag.object_id for tag in self.tags]
+    """The object IDs of the task's tags."""
+    if self._prefetched_tag_ids is not None:
+      return self._prefetched_tag_ids
+
+    return [task_tag.object_id for task_tag in self.tags]
@@ -0,0 +1,538 @@
+"""Closure table recording every ancestor/descendant pair of tasks.
+
+Each task has a row linking it to itself at depth 0, and a row for each of its
+ancestors at depth 1 (parent), 2 (grandparent) and so on. This turns subtree,
+ancestor and cycle queries into single indexed lookups, at the cost of keeping
+the table up to date whenever a task is added, moved or deleted.
+
+The functions which maintain the table also maintain the subtree rollups on the
+tasks (`descendant_count` and `completed_descendant_count`), since they already
+know which ancestor/descendant pairs are changing.
+"""
+
+import typing
+
+import sqlalchemy
+
+from . import db
+
+# pylint: disable=unused-import,ungrouped-imports,invalid-name
+if typing.TYPE_CHECKING:
+  from typing import (
+      Iterable,
+      Optional,
+      Set,
+      Tuple,
+  )
+  from ..util import typevars
+# pylint: enable=unused-import,ungrouped-imports,invalid-name
+
+DB = db.DB
+
+
+TASK_CLOSURE = DB.Table(
+    'task_closure',
+    DB.Model.metadata,
+    DB.Column(
+        'ancestor_id', DB.Integer,
+        DB.ForeignKey('task.object_id', ondelete='CASCADE'),
+        primary_key=True),
+    DB.Column(
+        'descendant_id', DB.Integer,
+        DB.ForeignKey('task.object_id', ondelete='CASCADE'),
+        primary_key=True),
+    DB.Column('depth', DB.Integer, nullable=False),
+    # The primary key covers lookups by ancestor; this covers the reverse.
+    DB.Index('ix_task_closure_descendant_id', 'descendant_id', 'depth'),
+)
+
+# The task table, without importing the model (which depends on this module).
+_TASK = sqlalchemy.table(
+    'task',
+    sqlalchemy.column('object_id', sqlalchemy.Integer),
+    sqlalchemy.column('owner_id', sqlalchemy.Integer),
+    sqlalchemy.column('parent_id', sqlalchemy.Integer),
+    sqlalchemy.column('completed', sqlalchemy.Boolean),
+    sqlalchemy.column('descendant_count', sqlalchemy.Integer),
+    sqlalchemy.column('completed_descendant_count', sqlalchemy.Integer))
+
+
+def _adjust_rollups(
+    ancestors: 'sqlalchemy.sql.Select',
+    descendants: 'sqlalchemy.sql.ColumnElement',
+    completed: 'sqlalchemy.sql.ColumnElement'
+    ) -> None:
+  """Add to the rollups of every task selected by `ancestors`."""
+  DB.session.execute(_TASK.update().where(
+      _TASK.c.object_id.in_(ancestors)
+  ).values(
+      descendant_count=_TASK.c.descendant_count + descendants,
+      completed_descendant_count=(
+          _TASK.c.completed_descendant_count + completed)
+  ))
+
+
+def _strict_ancestor_ids(
+    task_ids: 'Iterable[typevars.ObjectID]'
+    ) -> 'sqlalchemy.sql.Select':
+  """Make a query for the IDs of the ancestors of any of the given tasks."""
+  return sqlalchemy.select([
+      TASK_CLOSURE.c.ancestor_id
+  ]).where(
+      TASK_CLOSURE.c.descendant_id.in_(task_ids)
+  ).where(
+      TASK_CLOSURE.c.depth > 0
+  )
+
+
+def descendant_ids(
+    task_id: 'typevars.ObjectID',
+    max_depth: 'Optional[int]' = None
+    ) -> 'sqlalchemy.sql.Select':
+  """Make a query for the IDs of a task and its descendants.
+
+  If `max_depth` is given, only descendants at most that many levels below the
+  task are included (so 0 is just the task itself).
+  """
+  query = sqlalchemy.select([
+      TASK_CLOSURE.c.descendant_id
+  ]).where(
+      TASK_CLOSURE.c.ancestor_id == task_id
+  )
+
+  if max_depth is not None:
+    query = query.where(TASK_CLOSURE.c.depth <= max_depth)
+
+  return query
+
+
+def ancestor_ids(task_id: 'typevars.ObjectID') -> 'sqlalchemy.sql.Select':
+  """Make a query for the IDs of a task's ancestors, nearest first."""
+  return sqlalchemy.select([
+      TASK_CLOSURE.c.ancestor_id
+  ]).where(
+      TASK_CLOSURE.c.descendant_id == task_id
+  ).where(
+      TASK_CLOSURE.c.depth > 0
+  ).order_by(
+      TASK_CLOSURE.c.depth
+  )
+
+
+def is_descendant(
+    descendant_id: 'Optional[typevars.ObjectID]',
+    task_ids: 'Iterable[typevars.ObjectID]'
+    ) -> bool:
+  """Check whether a task is any of the given tasks, or a descendant of one.
+
+  `descendant_id` being None (i.e. the top level) is never a descendant.
+  """
+  task_ids = list(task_ids)
+
+  if descendant_id is None or not task_ids:
+    return False
+
+  return DB.session.query(
+      sqlalchemy.exists().where(
+          TASK_CLOSURE.c.descendant_id == descendant_id
+      ).where(
+          TASK_CLOSURE.c.ancestor_id.in_(task_ids)
+      )
+  ).scalar()
+
+
+def add_task(
+    task_id: 'typevars.ObjectID',
+    parent_id: 'Optional[typevars.ObjectID]'
+    ) -> None:
+  """Add the rows for a new, incomplete task with no children."""
+  rows = sqlalchemy.select([
+      sqlalchemy.literal(task_id).label('ancestor_id'),
+      sqlalchemy.literal(task_id).label('descendant_id'),
+      sqlalchemy.literal(0).label('depth'),
+  ])
+
+  if parent_id is not None:
+    rows = rows.union_all(
+        sqlalchemy.select([
+            TASK_CLOSURE.c.ancestor_id,
+            sqlalchemy.literal(task_id),
+            TASK_CLOSURE.c.depth + 1,
+        ]).where(
+            TASK_CLOSURE.c.descendant_id == parent_id
+        ))
+
+  DB.session.execute(TASK_CLOSURE.insert().from_select(
+      ['ancestor_id', 'descendant_id', 'depth'], rows))
+
+  if parent_id is not None:
+    _adjust_rollups(_strict_ancestor_ids([task_id]), 1, 0)
+
+
+def adjust_completed(task_id: 'typevars.ObjectID', delta: int) -> None:
+  """Add `delta` to the completed rollup of every ancestor of a task."""
+  _adjust_rollups(_strict_ancestor_ids([task_id]), 0, delta)
+
+
+def move_subtrees(
+    task_ids: 'Iterable[typevars.ObjectID]',
+    parent_id: 'Optional[typevars.ObjectID]'
+    ) -> None:
+  """Update the rows for tasks, and their subtrees, being given a new parent.
+
+  The links from the tasks' old ancestors to their subtrees are deleted, then
+  the new ancestors are linked to the subtrees; a fixed number of statements
+  however many tasks are moved. The caller must already have checked for
+  cycles.
+  """
+  task_ids = list(task_ids)
+
+  if not task_ids:
+    return
+
+  up = TASK_CLOSURE.alias('up')
+  down = TASK_CLOSURE.alias('down')
+
+  def is_detached(
+      pair: 'sqlalchemy.sql.FromClause'
+      ) -> 'sqlalchemy.sql.ColumnElement':
+    """Whether a pair links an old ancestor to a moved subtree."""
+    return sqlalchemy.exists().where(
+        up.c.descendant_id == down.c.ancestor_id
+    ).where(
+        down.c.ancestor_id.in_(task_ids)
+    ).where(
+        up.c.depth > 0
+    ).where(
+        up.c.ancestor_id == pair.c.ancestor_id
+    ).where(
+        down.c.descendant_id == pair.c.descendant_id
+    )
+
+  # Each old ancestor loses one descendant per pair being deleted.
+  pair = TASK_CLOSURE.alias('pair')
+  descendant = _TASK.alias('descendant')
+  detached = sqlalchemy.select([
+      sqlalchemy.func.count()
+  ]).select_from(
+      pair.join(descendant, descendant.c.object_id == pair.c.descendant_id)
+  ).where(
+      pair.c.ancestor_id == _TASK.c.object_id
+  ).where(
+      is_detached(pair)
+  )
+
+  _adjust_rollups(
+      _strict_ancestor_ids(task_ids),
+      -detached.as_scalar(),
+      -detached.where(descendant.c.completed).as_scalar())
+
+  DB.session.execute(TASK_CLOSURE.delete().where(is_detached(TASK_CLOSURE)))
+
+  if parent_id is None:
+    return
+
+  DB.session.execute(TASK_CLOSURE.insert().from_select(
+      ['ancestor_id', 'descendant_id', 'depth'],
+      sqlalchemy.select([
+          up.c.ancestor_id,
+          down.c.descendant_id,
+          up.c.depth + down.c.depth + 1,
+      ]).where(
+          up.c.descendant_id == parent_id
+      ).where(
+          down.c.ancestor_id.in_(task_ids)
+      )))
+
+  # The subtrees are now disjoint, and each new ancestor gains all of them.
+  attached = sqlalchemy.select([
+      sqlalchemy.func.count()
+  ]).select_from(
+      down.join(descendant, descendant.c.object_id == down.c.descendant_id)
+  ).where(
+      down.c.ancestor_id.in_(task_ids)
+  )
+
+  _adjust_rollups(
+      sqlalchemy.select([
+          TASK_CLOSURE.c.ancestor_id
+      ]).where(
+          TASK_CLOSURE.c.descendant_id == parent_id
+      ),
+      attached.as_scalar(),
+      attached.where(descendant.c.completed).as_scalar())
+
+
+def remove_task(task_id: 'typevars.ObjectID') -> None:
+  """Remove a single task, moving its descendants up a level.
+
+  This must be done before the task row itself is deleted.
+  """
+  up = TASK_CLOSURE.alias('up')
+  down = TASK_CLOSURE.alias('down')
+  removed = _TASK.alias('removed')
+
+  _adjust_rollups(
+      _strict_ancestor_ids([task_id]),
+      -1,
+      -sqlalchemy.select([
+          sqlalchemy.func.count()
+      ]).where(
+          removed.c.object_id == task_id
+      ).where(
+          removed.c.completed
+      ).as_scalar())
+
+  DB.session.execute(TASK_CLOSURE.update().where(
+      TASK_CLOSURE.c.ancestor_id.in_(
+          sqlalchemy.select([
+              up.c.ancestor_id
+          ]).where(
+              up.c.descendant_id == task_id
+          ).where(
+              up.c.depth > 0
+          ))
+  ).where(
+      TASK_CLOSURE.c.descendant_id.in_(
+          sqlalchemy.select([
+              down.c.descendant_id
+          ]).where(
+              down.c.ancestor_id == task_id
+          ).where(
+              down.c.depth > 0
+          ))
+  ).values(
+      depth=TASK_CLOSURE.c.depth - 1
+  ))
+
+  DB.session.execute(TASK_CLOSURE.delete().where(sqlalchemy.or_(
+      TASK_CLOSURE.c.ancestor_id == task_id,
+      TASK_CLOSURE.c.descendant_id == task_id)))
+
+
+def remove_subtree(task_id: 'typevars.ObjectID') -> None:
+  """Remove the rows for a task and all its descendants.
+
+  The foreign keys cascade, but not every database enforces them. The subtree
+  must first be detached from its ancestors with `move_subtrees(..., None)`,
+  which updates their rollups. This must be done after the task rows themselves
+  are deleted, since the subtree is found from this table.
+  """
+  DB.session.execute(TASK_CLOSURE.delete().where(
+      TASK_CLOSURE.c.descendant_id.in_(descendant_ids(task_id))))
+
+
+def _counted_rollups() -> 'Tuple[sqlalchemy.sql.ColumnElement, ...]':
+  """Make subqueries counting each task's descendants, and completed ones."""
+  descendant = _TASK.alias('descendant')
+  descendants = sqlalchemy.select([
+      sqlalchemy.func.count()
+  ]).select_from(
+      TASK_CLOSURE.join(
+          descendant, descendant.c.object_id == TASK_CLOSURE.c.descendant_id)
+  ).where(
+      TASK_CLOSURE.c.ancestor_id == _TASK.c.object_id
+  ).where(
+      TASK_CLOSURE.c.depth > 0
+  )
+
+  return (
+      descendants.as_scalar(),
+      descendants.where(descendant.c.completed).as_scalar())
+
+
+def _drifted_ids() -> 'sqlalchemy.sql.Select':
+  """Make a query for the IDs of tasks whose own rows are wrong.
+
+  A task's rows are right if it has its depth 0 row, and its other rows are
+  exactly its parent's rows one level deeper plus the link to the parent. If
+  that holds for every task, the whole table is right. The innermost subqueries
+  refer to the task two levels out, so must be correlated explicitly.
+  """
+  own = TASK_CLOSURE.alias('own')
+  parents = TASK_CLOSURE.alias('parents')
+
+  missing_self = ~sqlalchemy.exists().where(
+      own.c.ancestor_id == _TASK.c.object_id
+  ).where(
+      own.c.descendant_id == _TASK.c.object_id
+  ).where(
+      own.c.depth == 0
+  )
+  missing_ancestor = sqlalchemy.exists().where(
+      parents.c.descendant_id == _TASK.c.parent_id
+  ).where(
+      ~sqlalchemy.exists().where(
+          own.c.descendant_id == _TASK.c.object_id
+      ).where(
+          own.c.ancestor_id == parents.c.ancestor_id
+      ).where(
+          own.c.depth == parents.c.depth + 1
+      ).correlate_except(own)
+  )
+  extra_ancestor = sqlalchemy.exists().where(
+      own.c.descendant_id == _TASK.c.object_id
+  ).where(
+      own.c.ancestor_id != _TASK.c.object_id
+  ).where(
+      ~sqlalchemy.exists().where(
+          parents.c.descendant_id == _TASK.c.parent_id
+      ).where(
+          parents.c.ancestor_id == own.c.ancestor_id
+      ).where(
+          parents.c.depth == own.c.depth - 1
+      ).correlate_except(parents)
+  )
+
+  return sqlalchemy.select([
+      _TASK.c.object_id
+  ]).where(
+      sqlalchemy.or_(missing_self, missing_ancestor, extra_ancestor))
+
+
+def repair() -> 'Set[typevars.ObjectID]':
+  """Rebuild the rows of any subtree which has drifted, and fix the rollups.
+
+  Drift is found by checking each task's rows against its parent's, which is
+  read-only; only the subtrees of drifted tasks are deleted and reinserted (by
+  walking up from each task with a recursive CTE), and only rollups which are
+  wrong are updated.
+
+  Returns:
+    The IDs of the users owning the tasks which were corrected.
+  """
+  drifted_ids = [row[0] for row in DB.session.execute(_drifted_ids())]
+  owner_ids: 'Set[typevars.ObjectID]' = set()
+
+  if drifted_ids:
+    subtree = sqlalchemy.select([
+        _TASK.c.object_id
+    ]).where(
+        _TASK.c.object_id.in_(drifted_ids)
+    ).cte(
+        'subtree',
+        recursive=True
+    )
+    child = _TASK.alias('child')
+    # UNION rather than UNION ALL, since drifted subtrees may be nested.
+    subtree = subtree.union(
+        sqlalchemy.select([
+            child.c.object_id
+        ]).where(
+            child.c.parent_id == subtree.c.object_id
+        ))
+
+    task_ids = [row[0] for row in DB.session.execute(
+        sqlalchemy.select([subtree.c.object_id]))]
+
+    closure = sqlalchemy.select([
+        _TASK.c.object_id.label('ancestor_id'),
+        _TASK.c.object_id.label('descendant_id'),
+        sqlalchemy.literal(0).label('depth'),
+        _TASK.c.parent_id.label('next_id'),
+    ]).where(
+        _TASK.c.object_id.in_(task_ids)
+    ).cte(
+        'closure',
+        recursive=True
+    )
+    ancestor = _TASK.alias('ancestor')
+    closure = closure.union_all(
+        sqlalchemy.select([
+            ancestor.c.object_id,
+            closure.c.descendant_id,
+            closure.c.depth + 1,
+            ancestor.c.parent_id,
+        ]).where(
+            ancestor.c.object_id == closure.c.next_id
+        ))
+
+    DB.session.execute(TASK_CLOSURE.delete().where(
+        TASK_CLOSURE.c.descendant_id.in_(task_ids)))
+    DB.session.execute(TASK_CLOSURE.insert().from_select(
+        ['ancestor_id', 'descendant_id', 'depth'],
+        sqlalchemy.select([
+            closure.c.ancestor_id,
+            closure.c.descendant_id,
+            closure.c.depth,
+        ])))
+
+    owner_ids.update(row[0] for row in DB.session.execute(
+        sqlalchemy.select([
+            _TASK.c.owner_id
+        ]).where(
+            _TASK.c.object_id.in_(task_ids)
+        ).distinct()))
+
+  (descendants, completed) = _counted_rollups()
+  wrong_rollups = sqlalchemy.or_(
+      _TASK.c.descendant_count != descendants,
+      _TASK.c.completed_descendant_count != completed)
+
+  rollup_owner_ids = set(row[0] for row in DB.session.execute(
+      sqlalchemy.select([
+          _TASK.c.owner_id
+      ]).where(
+          wrong_rollups
+      ).distinct()))
+
+  if rollup_owner_ids:
+    DB.session.execute(_TASK.update().where(
+        wrong_rollups
+    ).values(
+        descendant_count=descendants,
+        completed_descendant_count=completed
+    ))
+
+  return owner_ids | rollup_owner_ids
+
+
+def rebuild() -> int:
+  """Rebuild the whole table, and the rollups, from the tasks' parent IDs.
+
+  The tree is walked with a recursive CTE, so this is a fixed number of
+  statements regardless of the number of tasks. This rewrites every row in one
+  transaction, so is for backfills and use by hand; `repair` only touches what
+  has drifted.
+
+  Returns:
+    The number of rows in the rebuilt table.
+  """
+  task = _TASK
+  closure = sqlalchemy.select([
+      task.c.object_id.label('ancestor_id'),
+      task.c.object_id.label('descendant_id'),
+      sqlalchemy.literal(0).label('depth'),
+  ]).cte(
+      'closure',
+      recursive=True
+  )
+  closure = closure.union_all(
+      sqlalchemy.select([
+          closure.c.ancestor_id,
+          task.c.object_id,
+          closure.c.depth + 1,
+      ]).where(
+          task.c.parent_id == closure.c.descendant_id
+      ))
+
+  DB.session.execute(TASK_CLOSURE.delete())
+  DB.session.execute(TASK_CLOSURE.insert().from_select(
+      ['ancestor_id', 'descendant_id', 'depth'],
+      sqlalchemy.select([
+          closure.c.ancestor_id,
+          closure.c.descendant_id,
+          closure.c.depth,
+      ])))
+
+  (descendants, completed) = _counted_rollups()
+
+  DB.session.execute(_TASK.update().values(
+      descendant_count=descendants,
+      completed_descendant_count=completed))
+
+  return DB.session.query(
+      sqlalchemy.func.count()
+  ).select_from(
+      TASK_CLOSURE
+  ).scalar()
@@ -0,0 +1,321 @@
+"""Tests for the task closure table."""
+
+from unittest import mock
+
+from absl.testing import absltest
+import sqlalchemy
+
+from lime.database import db
+from lime.database import models
+from lime.database import task_closure
+from lime.util import testing
+
+
+def make_tree():
+  """Make a tree of tasks, returned by title, with the closure rows added.
+
+  The tree is: a -> b -> c, a -> d, e.
+  """
+  user = models.User(name='test', email='test@test.com', password='test')
+  db.DB.session.add(user)
+
+  tasks = {}
+
+  for title, parent in [('a', None), ('b', 'a'), ('c', 'b'), ('d', 'a'),
+                        ('e', None)]:
+    task = models.Task(title=title, owner=user, parent=tasks.get(parent))
+    db.DB.session.add(task)
+    db.DB.session.flush()
+    task_closure.add_task(
+        task.object_id, task.parent.object_id if task.parent else None)
+    tasks[title] = task
+
+  db.DB.session.commit()
+
+  return tasks
+
+
+def closure_rows(tasks):
+  """Load the whole closure table, as (ancestor, descendant, depth) titles."""
+  titles = {task.object_id: title for title, task in tasks.items()}
+
+  return sorted(
+      (titles[row.ancestor_id], titles[row.descendant_id], row.depth)
+      for row in db.DB.session.execute(task_closure.TASK_CLOSURE.select()))
+
+
+def rollups(tasks):
+  """Load the rollups of the tasks, as {title: (descendants, completed)}."""
+  db.DB.session.expire_all()
+
+  return {
+      title: (task.descendant_count, task.completed_descendant_count)
+      for title, task in tasks.items()
+  }
+
+
+def ids(tasks, titles):
+  """Get the object IDs of tasks by title."""
+  return [tasks[title].object_id for title in titles]
+
+
+class TaskClosureTest(absltest.TestCase):
+  """Tests for the task closure table."""
+
+  def test_add_task(self):
+    """Test add_task links new tasks to all their ancestors."""
+    with testing.test_setup():
+      tasks = make_tree()
+
+      self.assertEqual([
+          ('a', 'a', 0),
+          ('a', 'b', 1),
+          ('a', 'c', 2),
+          ('a', 'd', 1),
+          ('b', 'b', 0),
+          ('b', 'c', 1),
+          ('c', 'c', 0),
+          ('d', 'd', 0),
+          ('e', 'e', 0),
+      ], closure_rows(tasks))
+      self.assertEqual({
+          'a': (3, 0),
+          'b': (1, 0),
+          'c': (0, 0),
+          'd': (0, 0),
+          'e': (0, 0),
+      }, rollups(tasks))
+
+  def test_adjust_completed(self):
+    """Test adjust_completed updates the rollups of every ancestor."""
+    with testing.test_setup():
+      tasks = make_tree()
+
+      task_closure.adjust_completed(tasks['c'].object_id, 1)
+
+      self.assertEqual({
+          'a': (3, 1),
+          'b': (1, 1),
+          'c': (0, 0),
+          'd': (0, 0),
+          'e': (0, 0),
+      }, rollups(tasks))
+
+  def test_descendant_ids(self):
+    """Test descendant_ids, with and without a maximum depth."""
+    with testing.test_setup():
+      tasks = make_tree()
+
+      def descendants(title, max_depth=None):
+        return sorted(row[0] for row in db.DB.session.execute(
+            task_closure.descendant_ids(tasks[title].object_id, max_depth)))
+
+      self.assertEqual(ids(tasks, 'abcd'), descendants('a'))
+      self.assertEqual(ids(tasks, 'abd'), descendants('a', 1))
+      self.assertEqual(ids(tasks, 'e'), descendants('e'))
+
+  def test_ancestor_ids(self):
+    """Test ancestor_ids returns the nearest ancestor first."""
+    with testing.test_setup():
+      tasks = make_tree()
+
+      self.assertEqual(ids(tasks, 'ba'), [
+          row[0] for row in db.DB.session.execute(
+              task_closure.ancestor_ids(tasks['c'].object_id))])
+
+  def test_is_descendant(self):
+    """Test is_descendant."""
+    with testing.test_setup():
+      tasks = make_tree()
+
+      self.assertTrue(task_closure.is_descendant(
+          tasks['c'].object_id, ids(tasks, 'a')))
+      self.assertTrue(task_closure.is_descendant(
+          tasks['c'].object_id, ids(tasks, 'ec')))
+      self.assertFalse(task_closure.is_descendant(
+          tasks['a'].object_id, ids(tasks, 'bcde')))
+      self.assertFalse(task_closure.is_descendant(None, ids(tasks, 'a')))
+      self.assertFalse(task_closure.is_descendant(tasks['a'].object_id, []))
+
+  def test_move_subtrees(self):
+    """Test move_subtrees relinks the moved subtrees to their new ancestors."""
+    with testing.test_setup():
+      tasks = make_tree()
+      tasks['c'].completed = True
+      tasks['d'].completed = True
+      db.DB.session.commit()
+      task_closure.rebuild()
+
+      task_closure.move_subtrees(ids(tasks, 'bd'), tasks['e'].object_id)
+
+      self.assertEqual([
+          ('a', 'a', 0),
+          ('b', 'b', 0),
+          ('b', 'c', 1),
+          ('c', 'c', 0),
+          ('d', 'd', 0),
+          ('e', 'b', 1),
+          ('e', 'c', 2),
+          ('e', 'd', 1),
+          ('e', 'e', 0),
+      ], closure_rows(tasks))
+      self.assertEqual({
+          'a': (0, 0),
+          'b': (1, 1),
+          'c': (0, 0),
+          'd': (0, 0),
+          'e': (3, 2),
+      }, rollups(tasks))
+
+  def test_move_subtrees__nested(self):
+    """Test move_subtrees with a moved task inside another moved subtree."""
+    with testing.test_setup():
+      tasks = make_tree()
+
+      task_closure.move_subtrees(ids(tasks, 'bc'), tasks['d'].object_id)
+
+      self.assertEqual([
+          ('a', 'a', 0),
+          ('a', 'b', 2),
+          ('a', 'c', 2),
+          ('a', 'd', 1),
+          ('b', 'b', 0),
+          ('c', 'c', 0),
+          ('d', 'b', 1),
+          ('d', 'c', 1),
+          ('d', 'd', 0),
+          ('e', 'e', 0),
+      ], closure_rows(tasks))
+      self.assertEqual({
+          'a': (3, 0),
+          'b': (0, 0),
+          'c': (0, 0),
+          'd': (2, 0),
+          'e': (0, 0),
+      }, rollups(tasks))
+
+  def test_move_subtrees__to_top_level(self):
+    """Test move_subtrees with no new parent."""
+    with testing.test_setup():
+      tasks = make_tree()
+
+      task_closure.move_subtrees(ids(tasks, 'b'), None)
+
+      self.assertEqual([
+          ('a', 'a', 0),
+          ('a', 'd', 1),
+          ('b', 'b', 0),
+          ('b', 'c', 1),
+          ('c', 'c', 0),
+          ('d', 'd', 0),
+          ('e', 'e', 0),
+      ], closure_rows(tasks))
+
+  def test_remove_task(self):
+    """Test remove_task moves the task's descendants up a level."""
+    with testing.test_setup():
+      tasks = make_tree()
+      tasks['b'].completed = True
+      db.DB.session.commit()
+      task_closure.rebuild()
+
+      task_closure.remove_task(tasks['b'].object_id)
+
+      self.assertEqual([
+          ('a', 'a', 0),
+          ('a', 'c', 1),
+          ('a', 'd', 1),
+          ('c', 'c', 0),
+          ('d', 'd', 0),
+          ('e', 'e', 0),
+      ], closure_rows(tasks))
+      self.assertEqual((2, 0), rollups(tasks)['a'])
+
+  def test_remove_subtree(self):
+    """Test remove_subtree removes the rows for every descendant."""
+    with testing.test_setup():
+      tasks = make_tree()
+
+      task_closure.remove_subtree(tasks['b'].object_id)
+
+      self.assertEqual([
+          ('a', 'a', 0),
+          ('a', 'd', 1),
+          ('d', 'd', 0),
+          ('e', 'e', 0),
+      ], closure_rows(tasks))
+
+  def test_repair(self):
+    """Test repair rebuilds only the drifted subtrees, and wrong rollups."""
+    with testing.test_setup():
+      tasks = make_tree()
+      expected = closure_rows(tasks)
+      table = task_closure.TASK_CLOSURE
+
+      db.DB.session.execute(table.delete().where(
+          table.c.descendant_id == tasks['b'].object_id
+      ).where(
+          table.c.depth == 1
+      ))
+      db.DB.session.execute(table.insert().values(
+          ancestor_id=tasks['e'].object_id,
+          descendant_id=tasks['d'].object_id,
+          depth=1))
+      tasks['e'].descendant_count = 7
+      db.DB.session.commit()
+
+      self.assertEqual({tasks['a'].owner_id}, task_closure.repair())
+
+      db.DB.session.commit()
+
+      self.assertEqual(expected, closure_rows(tasks))
+      self.assertEqual({
+          'a': (3, 0),
+          'b': (1, 0),
+          'c': (0, 0),
+          'd': (0, 0),
+          'e': (0, 0),
+      }, rollups(tasks))
+
+  def test_repair__no_drift(self):
+    """Test repair changes nothing if the table and rollups are right."""
+    with testing.test_setup():
+      tasks = make_tree()
+      tasks['c'].completed = True
+      db.DB.session.commit()
+      task_closure.adjust_completed(tasks['c'].object_id, 1)
+      db.DB.session.commit()
+
+      with mock.patch.object(
+          db.DB.session, 'execute', wraps=db.DB.session.execute) as execute:
+        self.assertEqual(set(), task_closure.repair())
+
+      self.assertFalse([
+          call for call in execute.call_args_list
+          if not isinstance(call[0][0], sqlalchemy.sql.Select)])
+
+  def test_rebuild(self):
+    """Test rebuild recreates the table and rollups from the tasks' parents."""
+    with testing.test_setup():
+      tasks = make_tree()
+      expected = closure_rows(tasks)
+
+      db.DB.session.execute(task_closure.TASK_CLOSURE.delete().where(
+          task_closure.TASK_CLOSURE.c.depth > 0))
+      tasks['a'].descendant_count = 7
+      tasks['c'].completed = True
+      db.DB.session.commit()
+
+      self.assertEqual(9, task_closure.rebuild())
+      self.assertEqual(expected, closure_rows(tasks))
+      self.assertEqual({
+          'a': (3, 1),
+          'b': (1, 1),
+          'c': (0, 0),
+          'd': (0, 0),
+          'e': (0, 0),
+      }, rollups(tasks))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -6,6 +6,7 @@ from absl.testing import absltest
 
 from lime.database import db
 from lime.database import models
+from lime.database import task_closure
 from lime.util import testing
 
 
@@ -14,50 +15,218 @@ class TaskTest(absltest.TestCase):
 
   def test_has_children__with_child(self):
     """Test Task.has_children property when the task has a child."""
+    task = models.Task(child_count=1)
+
+    self.assertTrue(task.has_children)
+
+  def test_has_children__no_child(self):
+    """Test Task.has_children property when the task has no child."""
+    task = models.Task(child_count=0)
+
+    self.assertFalse(task.has_children)
+
+  def test_adjust_child_count(self):
+    """Test Task.adjust_child_count updates the database and the session."""
     with testing.test_setup():
       user = models.User(name='test', email='test@test.com', password='test')
-      parent = models.Task(title='Parent', owner=user)
-      child = models.Task(title='Child', owner=user, parent=parent)
-      db.DB.session.add_all([user, parent, child])
+      parent = models.Task(title='Parent', owner=user, child_count=2)
+      db.DB.session.add_all([user, parent])
       db.DB.session.commit()
 
-      self.assertTrue(parent.has_children)
+      models.Task.adjust_child_count(parent.object_id, -1)
 
-  def test_has_children__no_child(self):
-    """Test Task.has_children property when the task has no child."""
+      self.assertEqual(1, parent.child_count)
+
+      db.DB.session.commit()
+      db.DB.session.expire_all()
+
+      self.assertEqual(1, parent.child_count)
+
+  def test_recount_children(self):
+    """Test Task.recount_children corrects drifted child counts."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      parent = models.Task(title='Parent', owner=user, child_count=5)
+      child1 = models.Task(title='Child1', owner=user, parent=parent)
+      child2 = models.Task(title='Child2', owner=user, parent=parent)
+      other = models.Task(title='Other', owner=user, child_count=0)
+      db.DB.session.add_all([user, parent, child1, child2, other])
+      db.DB.session.commit()
+
+      self.assertEqual({user.object_id}, models.Task.recount_children())
+
+      db.DB.session.commit()
+      db.DB.session.expire_all()
+
+      self.assertEqual(2, parent.child_count)
+      self.assertEqual(0, child1.child_count)
+      self.assertEqual(0, other.child_count)
+      self.assertEqual(set(), models.Task.recount_children())
+
+  def test_subtree_ids(self):
+    """Test Task.subtree_ids selects a task and all its descendants."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      root = models.Task(title='Root', owner=user)
+      child = models.Task(title='Child', owner=user, parent=root)
+      grandchild = models.Task(title='Grandchild', owner=user, parent=child)
+      other = models.Task(title='Other', owner=user)
+      db.DB.session.add_all([user, root, child, grandchild, other])
+      db.DB.session.commit()
+      task_closure.rebuild()
+
+      self.assertCountEqual(
+          [root.object_id, child.object_id, grandchild.object_id],
+          [row[0] for row in db.DB.session.execute(
+              models.Task.subtree_ids(root.object_id))])
+      self.assertCountEqual(
+          [other.object_id],
+          [row[0] for row in db.DB.session.execute(
+              models.Task.subtree_ids(other.object_id))])
+
+  def test_subtree(self):
+    """Test Task.subtree loads descendants in depth order."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      root = models.Task(title='Root', owner=user)
+      child = models.Task(title='Child', owner=user, parent=root)
+      grandchild = models.Task(title='Grandchild', owner=user, parent=child)
+      other_child = models.Task(title='Other Child', owner=user, parent=root)
+      other = models.Task(title='Other', owner=user)
+      db.DB.session.add_all([
+          user, grandchild, child, other_child, root, other])
+      db.DB.session.commit()
+      task_closure.rebuild()
+
+      self.assertEqual(
+          [root, child, other_child, grandchild],
+          models.Task.subtree(root.object_id))
+      self.assertEqual(
+          [root, child, other_child],
+          models.Task.subtree(root.object_id, max_depth=1))
+      self.assertEqual([child], models.Task.subtree(child.object_id, 0))
+
+  def test_path(self):
+    """Test Task.path loads the ancestors from the top level down."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      root = models.Task(title='Root', owner=user)
+      child = models.Task(title='Child', owner=user, parent=root)
+      grandchild = models.Task(title='Grandchild', owner=user, parent=child)
+      sibling = models.Task(title='Sibling', owner=user, parent=root)
+      db.DB.session.add_all([user, root, child, grandchild, sibling])
+      db.DB.session.commit()
+      task_closure.rebuild()
+
+      self.assertEqual(
+          [root, child, grandchild], models.Task.path(grandchild.object_id))
+      self.assertEqual([root], models.Task.path(root.object_id))
+
+  def test_ordered_children(self):
+    """Test Task.ordered_children returns siblings in list order."""
     with testing.test_setup():
       user = models.User(name='test', email='test@test.com', password='test')
       parent = models.Task(title='Parent', owner=user)
-      db.DB.session.add_all([user, parent])
+      first = models.Task(title='First', owner=user, parent=parent)
+      second = models.Task(title='Second', owner=user, parent=parent)
+      third = models.Task(title='Third', owner=user, parent=parent)
+      second.link(first, None)
+      third.link(second, None)
+      other = models.Task(title='Other', owner=user)
+      db.DB.session.add_all([user, parent, third, second, first, other])
       db.DB.session.commit()
 
-      self.assertFalse(parent.has_children)
+      self.assertEqual(
+          [first, second, third],
+          models.Task.ordered_children(user.object_id, parent.object_id))
+      self.assertEqual(
+          [parent, other],
+          models.Task.ordered_children(user.object_id, None))
+
+  def test_ordered_children__broken_chain(self):
+    """Test Task.ordered_children returns unreachable tasks last."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      first = models.Task(title='First', owner=user)
+      second = models.Task(title='Second', owner=user)
+      cycle1 = models.Task(title='Cycle1', owner=user)
+      cycle2 = models.Task(title='Cycle2', owner=user)
+      second.link(first, None)
+      cycle2.link(cycle1, None)
+      cycle1.link(cycle2, None)
+      db.DB.session.add_all([user, cycle1, cycle2, second, first])
+      db.DB.session.commit()
+
+      self.assertEqual(
+          [first, second, cycle1, cycle2],
+          models.Task.ordered_children(user.object_id, None))
+
+  def test_link(self):
+    """Test Task.link inserts the task between two tasks."""
+    before = models.Task(object_id=1)
+    after = models.Task(object_id=2)
+    before.after = after
+    after.before = before
+    task = models.Task(object_id=3)
+
+    task.link(before, after)
+
+    self.assertIs(task, before.after)
+    self.assertIs(before, task.before)
+    self.assertIs(after, task.after)
+    self.assertIs(task, after.before)
 
-  def test_before_id(self):
-    """Test Task.before_id property when task has a before task."""
+  def test_link__at_end(self):
+    """Test Task.link with no following task."""
     before = models.Task(object_id=1)
-    task = models.Task(before=before)
+    task = models.Task(object_id=2)
+
+    task.link(before, None)
+
+    self.assertIs(task, before.after)
+    self.assertIs(before, task.before)
+    self.assertIsNone(task.after)
 
-    self.assertEqual(1, task.before_id)
+  def test_unlink(self):
+    """Test Task.unlink joins up the neighbouring tasks."""
+    before = models.Task(object_id=1)
+    after = models.Task(object_id=2)
+    task = models.Task(object_id=3)
+    task.link(before, None)
+    after.link(task, None)
 
-  def test_before_id__no_before(self):
-    """Test Task.before_id property when task has no before task."""
-    task = models.Task()
+    task.unlink()
 
-    self.assertEqual(None, task.before_id)
+    self.assertIs(after, before.after)
+    self.assertIs(before, after.before)
+    self.assertIsNone(task.before)
+    self.assertIsNone(task.after)
 
-  def test_after_id(self):
-    """Test Task.after_id property when task has a after task."""
+  def test_unlink__at_start(self):
+    """Test Task.unlink on the first task in a list."""
     after = models.Task(object_id=1)
-    task = models.Task(after=after)
+    task = models.Task(object_id=2)
+    after.link(task, None)
 
-    self.assertEqual(1, task.after_id)
+    task.unlink()
 
-  def test_after_id__no_after(self):
-    """Test Task.after_id property when task has no after task."""
-    task = models.Task()
+    self.assertIsNone(after.before)
+    self.assertIsNone(task.after)
 
-    self.assertEqual(None, task.after_id)
+  def test_link__persists_ids(self):
+    """Test both pointers are stored on the rows."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      first = models.Task(title='First', owner=user)
+      second = models.Task(title='Second', owner=user)
+      second.link(first, None)
+      db.DB.session.add_all([user, first, second])
+      db.DB.session.commit()
+
+      self.assertEqual(
+          (None, second.object_id), (first.before_id, first.after_id))
+      self.assertEqual(
+          (first.object_id, None), (second.before_id, second.after_id))
 
   def test_tag_ids(self):
     """Test Task.tag_ids property."""
@@ -69,6 +238,24 @@ class TaskTest(absltest.TestCase):
 
     self.assertCountEqual([1, 2, 3], task.tag_ids)
 
+  def test_prefetch_json(self):
+    """Test Task.prefetch_json loads the tag IDs without loading the tags."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      tag1 = models.Tag(title='Tag1', direct_owner=user)
+      tag2 = models.Tag(title='Tag2', direct_owner=user)
+      task1 = models.Task(title='Task1', owner=user, tags=[tag2, tag1])
+      task2 = models.Task(title='Task2', owner=user)
+      db.DB.session.add_all([user, tag1, tag2, task1, task2])
+      db.DB.session.commit()
+
+      tasks = models.Task.query.order_by(models.Task.object_id).all()
+      models.Task.prefetch_json(tasks)
+
+      self.assertEqual([tag1.object_id, tag2.object_id], tasks[0].tag_ids)
+      self.assertEqual([], tasks[1].tag_ids)
+      self.assertNotIn('tags', tasks[0].__dict__)
+
   def test_to_json(self):
     """Test Task.to_json()."""
 
@@ -80,10 +267,12 @@ class TaskTest(absltest.TestCase):
           title='Task',
           completed=True,
           notes='Notes',
+          descendant_count=7,
+          completed_descendant_count=6,
           owner_id=2,
           parent_id=3,
-          before=models.Task(object_id=4),
-          after=models.Task(object_id=5),
+          before_id=4,
+          after_id=5,
           tags=[
               models.Tag(object_id=1),
               models.Tag(object_id=2),
@@ -97,6 +286,8 @@ class TaskTest(absltest.TestCase):
           'title': 'Task',
           'completed': True,
           'notes': 'Notes',
+          'descendant_count': 7,
+          'completed_descendant_count': 6,
           'owner_id': 2,
           'parent_id': 3,
           'has_children': True,
@@ -10,7 +10,11 @@ from ..util import settings_enums
 
 # pylint: disable=unused-import,ungrouped-imports,invalid-name
 if typing.TYPE_CHECKING:
+  from typing import (
+      Optional,
+  )
   from . import setting
+  from ..util import typevars
 # pylint: enable=unused-import,ungrouped-imports,invalid-name
 
 DB = db.DB
@@ -33,6 +37,10 @@ class User(DB.Model):
   name = DB.Column(DB.Unicode(200), nullable=False)
   email = DB.Column(DB.Unicode(200), nullable=False, unique=True)
   password_hash = DB.Column(DB.Unicode(60), nullable=False)
+  # Incremented whenever the user's tags or tag groups change.
+  tag_version = DB.Column(DB.Integer(), nullable=False, default=0)
+  # Incremented by every mutating API endpoint, and used to build ETags.
+  data_version = DB.Column(DB.Integer(), nullable=False, default=0)
 
   # Password magic
   password = passwords.PasswordDescriptor()
@@ -54,3 +62,30 @@ class User(DB.Model):
         return entry
 
     raise KeyError('No setting found with key {}'.format(key))
+
+  @classmethod
+  def get_data_version(cls, user_id: 'typevars.ObjectID') -> 'Optional[int]':
+    """Get a user's data version, in a single query."""
+    return DB.session.query(
+        cls.data_version
+    ).filter(
+        cls.object_id == user_id
+    ).scalar()
+
+  @classmethod
+  def bump_data_version(cls, *user_ids: 'typevars.ObjectID') -> None:
+    """Increment the data version of each given user, in one UPDATE.
+
+    Anything which changes a user's data outside the API endpoints (e.g. cron
+    jobs) must call this in the same transaction, so clients see the change.
+    """
+    if not user_ids:
+      return
+
+    table = cls.__table__
+
+    DB.session.execute(table.update().where(
+        table.c.object_id.in_(user_ids)
+    ).values(
+        data_version=table.c.data_version + 1
+    ))
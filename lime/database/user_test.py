@@ -35,6 +35,23 @@ class UserTest(absltest.TestCase):
       with self.assertRaises(KeyError):
         user.get_setting('does_not_exist')
 
+  def test_data_version(self):
+    """Test bump_data_version increments get_data_version."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      db.DB.session.add(user)
+      db.DB.session.commit()
+
+      self.assertEqual(0, models.User.get_data_version(user.object_id))
+
+      models.User.bump_data_version(user.object_id)
+      models.User.bump_data_version(user.object_id, user.object_id + 1)
+      models.User.bump_data_version()
+      db.DB.session.commit()
+
+      self.assertEqual(2, models.User.get_data_version(user.object_id))
+      self.assertIsNone(models.User.get_data_version(user.object_id + 1))
+
   def test_to_json(self):
     """Test User.to_json."""
     # Settings mechanism requires interaction with the database
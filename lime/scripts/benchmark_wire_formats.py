@@ -0,0 +1,115 @@
+"""Benchmark for the JSON and MessagePack wire formats of the API.
+
+Encodes and decodes a realistic tree of transient tasks (as /get_subtree
+would return it) in each format, comparing payload size and CPU time.
+
+Usage: python -m lime.scripts.benchmark_wire_formats [--tasks=N] [--repeat=N]
+"""
+
+import argparse
+import json
+import random
+import timeit
+import typing
+
+import msgpack
+
+from lime.database import models
+from lime.util import api
+
+# pylint: disable=unused-import,ungrouped-imports,invalid-name
+if typing.TYPE_CHECKING:
+  from typing import (
+      Callable,
+      List,
+  )
+# pylint: enable=unused-import,ungrouped-imports,invalid-name
+
+_WORDS = [
+    'buy', 'call', 'draft', 'email', 'fix', 'milk', 'plan', 'report', 'review',
+    'schedule', 'team', 'the', 'trip', 'update', 'weekly', 'with',
+]
+
+
+def make_tree(count: int, seed: int = 0) -> 'List[models.Task]':
+  """Make a tree of transient tasks, parents before children.
+
+  Each task has a handful of children, a short title, sometimes notes, and a
+  few tags, which is roughly the shape of a real account.
+  """
+  rng = random.Random(seed)
+  tasks: 'List[models.Task]' = []
+  last_child = {}
+
+  for object_id in range(1, count + 1):
+    parent_id = rng.choice([None] + [
+        task.object_id for task in tasks[-20:]]) if tasks else None
+    before_id = last_child.get(parent_id)
+    title = ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(2, 6)))
+    notes = ' '.join(
+        rng.choice(_WORDS) for _ in range(rng.choice([0, 0, 0, 10, 40])))
+
+    task = models.Task(
+        object_id=object_id,
+        title=title.capitalize(),
+        completed=rng.random() < 0.3,
+        notes=notes,
+        child_count=0,
+        descendant_count=0,
+        completed_descendant_count=0,
+        owner_id=1,
+        parent_id=parent_id,
+        before_id=before_id,
+        after_id=None)
+    task._prefetched_tag_ids = sorted(  # pylint: disable=protected-access
+        rng.sample(range(1, 30), rng.randint(0, 3)))
+
+    if before_id is not None:
+      tasks[before_id - 1].after_id = object_id
+    if parent_id is not None:
+      tasks[parent_id - 1].child_count += 1
+
+    last_child[parent_id] = object_id
+    tasks.append(task)
+
+  return tasks
+
+
+def best_time(func: 'Callable[[], object]', repeat: int) -> float:
+  """Time a function, returning the fastest of several runs in seconds."""
+  return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main() -> None:
+  """Run the benchmark and print the results."""
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--tasks', type=int, default=10000)
+  parser.add_argument('--repeat', type=int, default=5)
+  args = parser.parse_args()
+
+  tasks = make_tree(args.tasks)
+  json_data = api.ENCODER.encode(tasks).encode()
+  msgpack_data = api.encode_msgpack(tasks)
+
+  # Clients decode the tagged dicts without converting them to objects.
+  assert json.loads(json_data) == msgpack.unpackb(msgpack_data, raw=False)
+
+  print('Encoding {} tasks, best of {}:'.format(args.tasks, args.repeat))
+  print('  {:<8} {:>10} {:>12} {:>12}'.format(
+      'format', 'bytes', 'encode ms', 'decode ms'))
+
+  for name, data, encode, decode in [
+      ('json', json_data,
+       lambda: api.ENCODER.encode(tasks).encode(),
+       lambda: json.loads(json_data)),
+      ('msgpack', msgpack_data,
+       lambda: api.encode_msgpack(tasks),
+       lambda: msgpack.unpackb(msgpack_data, raw=False)),
+  ]:
+    print('  {:<8} {:>10} {:>12.2f} {:>12.2f}'.format(
+        name, len(data), best_time(encode, args.repeat) * 1000,
+        best_time(decode, args.repeat) * 1000))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,192 @@
+"""Verify, and optionally repair, the linked lists which order tasks and tags."""
+
+import collections
+import itertools
+import typing
+
+import flask_script
+import sqlalchemy
+
+from lime.database import db
+from lime.database import models
+from lime.database import ordering
+from lime.database import tag_catalog
+
+# pylint: disable=unused-import,ungrouped-imports,invalid-name
+if typing.TYPE_CHECKING:
+  from typing import (
+      Counter,
+      Dict,
+      Generator,
+      List,
+      Set,
+      Tuple,
+      Type,
+  )
+  from lime.util import typevars
+
+  # The links of each list, with the ID of the user who owns it.
+  OwnedLists = Generator[
+      Tuple[typevars.ObjectID, List[ordering.Link]], None, None]
+  Repairs = Dict[typevars.ObjectID, ordering.Pointers]
+# pylint: enable=unused-import,ungrouped-imports,invalid-name
+
+DB = db.DB
+
+_BATCH_SIZE = 1000
+
+
+def _task_lists() -> 'OwnedLists':
+  """Stream the links of every task list, for all users, in one query."""
+  task = models.Task
+  rows = DB.session.query(
+      task.owner_id,
+      task.parent_id,
+      task.object_id,
+      task.before_id,
+      task.after_id
+  ).order_by(
+      task.owner_id,
+      task.parent_id,
+      task.object_id
+  ).yield_per(_BATCH_SIZE)
+
+  for (owner_id, _), group in itertools.groupby(rows, key=lambda row: row[:2]):
+    yield owner_id, [tuple(row[2:]) for row in group]
+
+
+def _tag_lists() -> 'OwnedLists':
+  """Stream the links of every tag group, for all users, in one query."""
+  tag = models.Tag
+  tag_group = models.TagGroup
+  rows = DB.session.query(
+      tag.group_id,
+      tag_group.owner_id,
+      tag.object_id,
+      tag.before_id,
+      tag.after_id
+  ).join(
+      tag_group, tag_group.object_id == tag.group_id
+  ).order_by(
+      tag.group_id,
+      tag.object_id
+  ).yield_per(_BATCH_SIZE)
+
+  for (_, owner_id), group in itertools.groupby(
+      rows, key=lambda row: row[:2]):
+    yield owner_id, [tuple(row[2:]) for row in group]
+
+
+def _batches(items: 'List') -> 'Generator[List, None, None]':
+  """Split a list into batches for bulk statements."""
+  for start in range(0, len(items), _BATCH_SIZE):
+    yield items[start:start + _BATCH_SIZE]
+
+
+def _relink(
+    model: 'Type[ordering.OrderedModel]',
+    repairs: 'Repairs'
+    ) -> None:
+  """Rewrite the pointers of the given tasks or tags with batched UPDATEs."""
+  table = model.__table__
+  statement = table.update().where(
+      table.c.object_id == sqlalchemy.bindparam('_object_id')
+  ).values(
+      before_id=sqlalchemy.bindparam('_before_id'),
+      after_id=sqlalchemy.bindparam('_after_id')
+  )
+  params = [
+      {'_object_id': object_id, '_before_id': before_id, '_after_id': after_id}
+      for object_id, (before_id, after_id) in repairs.items()
+  ]
+
+  for batch in _batches(params):
+    DB.session.execute(statement, batch)
+
+
+def _check_lists(
+    lists: 'OwnedLists',
+    summary: 'Counter[str]'
+    ) -> 'Tuple[Repairs, Set[typevars.ObjectID]]':
+  """Check each list, adding to the summary and collecting the repairs.
+
+  Returns:
+    The repairs, and the IDs of the users owning the lists they affect.
+  """
+  all_repairs: 'Repairs' = {}
+  owner_ids: 'Set[typevars.ObjectID]' = set()
+
+  for owner_id, links in lists:
+    problems, repairs = ordering.check_chain(links)
+
+    summary['lists'] += 1
+    if problems:
+      summary['broken lists'] += 1
+    summary.update(problems)
+    all_repairs.update(repairs)
+
+    if repairs:
+      owner_ids.add(owner_id)
+
+  return all_repairs, owner_ids
+
+
+def check_all(repair: bool = False) -> 'Dict[str, Counter[str]]':
+  """Check every task and tag list, optionally relinking broken ones.
+
+  Repairs are collected while streaming, and only written once each scan is
+  complete, so that the bulk SELECT is not interleaved with UPDATEs. The data
+  versions of the owners of relinked lists are bumped in the same transaction,
+  and the tag order is part of the cached tag catalog, so the catalogs of the
+  owners of relinked tags are invalidated too.
+
+  Returns:
+    A summary for each of 'tasks' and 'tags', counting the lists checked, the
+    lists with problems, each kind of problem, and the items relinked.
+  """
+  summaries = {
+      'tasks': collections.Counter(),
+      'tags': collections.Counter(),
+  }
+
+  task_repairs, task_owner_ids = _check_lists(
+      _task_lists(), summaries['tasks'])
+  tag_repairs, tag_owner_ids = _check_lists(_tag_lists(), summaries['tags'])
+
+  if repair:
+    _relink(models.Task, task_repairs)
+    _relink(models.Tag, tag_repairs)
+    tag_catalog.invalidate(*tag_owner_ids)
+    models.User.bump_data_version(*(task_owner_ids | tag_owner_ids))
+    DB.session.commit()
+
+    summaries['tasks']['relinked'] = len(task_repairs)
+    summaries['tags']['relinked'] = len(tag_repairs)
+
+  return summaries
+
+
+def format_summary(summaries: 'Dict[str, Counter[str]]') -> str:
+  """Format the result of check_all for printing."""
+  return '\n'.join(
+      '{}: {}'.format(kind, ', '.join(
+          '{} {}'.format(count, name)
+          for name, count in sorted(summary.items())) or 'no lists')
+      for kind, summary in sorted(summaries.items()))
+
+
+class CheckOrderingCommand(flask_script.Command):
+  """Flask-Script command for checking the ordering of tasks and tags."""
+
+  help = 'Check the ordering of task and tag lists'
+
+  option_list = (
+      flask_script.Option(
+          '--repair', action='store_true', default=False,
+          help='Relink any broken lists'),
+  )
+
+  @staticmethod
+  def run(repair: bool): # false positive pylint: disable=method-hidden,arguments-differ
+    """Check, and optionally repair, all lists and print a summary."""
+    print(format_summary(check_all(repair)))
@@ -0,0 +1,123 @@
+"""Tests for the ordering check script."""
+
+from absl.testing import absltest
+
+from lime.database import db
+from lime.database import models
+from lime.database import ordering
+from lime.scripts import check_ordering
+from lime.util import testing
+
+
+def make_user():
+  """Make a user to own the test data."""
+  return models.User(name='test', email='test@test.com', password='test')
+
+
+class CheckOrderingTest(absltest.TestCase):
+  """Tests for the ordering check script."""
+
+  def test_check_all__consistent(self):
+    """Test check_all finds no problems in consistent lists."""
+    with testing.test_setup():
+      user = make_user()
+      first = models.Task(title='First', owner=user)
+      second = models.Task(title='Second', owner=user)
+      second.link(first, None)
+      group = models.TagGroup(title='Group', owner=user)
+      tag1 = models.Tag(title='Tag1', group=group)
+      tag2 = models.Tag(title='Tag2', group=group)
+      tag2.link(tag1, None)
+      db.DB.session.add_all([user, first, second, group, tag1, tag2])
+      db.DB.session.commit()
+
+      summaries = check_ordering.check_all(repair=True)
+
+      self.assertEqual({'lists': 1, 'relinked': 0}, summaries['tasks'])
+      self.assertEqual({'lists': 1, 'relinked': 0}, summaries['tags'])
+
+      db.DB.session.expire_all()
+
+      self.assertEqual(0, user.tag_version)
+      self.assertEqual(0, user.data_version)
+
+  def test_check_all__tasks(self):
+    """Test check_all finds and repairs a broken task list."""
+    with testing.test_setup():
+      user = make_user()
+      parent = models.Task(title='Parent', owner=user)
+      first = models.Task(title='First', owner=user, parent=parent)
+      second = models.Task(title='Second', owner=user, parent=parent)
+      orphan = models.Task(title='Orphan', owner=user, parent=parent)
+      second.link(first, None)
+      db.DB.session.add_all([user, parent, first, second, orphan])
+      db.DB.session.commit()
+
+      summaries = check_ordering.check_all()
+
+      self.assertEqual(
+          {'lists': 2, 'broken lists': 1, ordering.EXTRA_HEAD: 1},
+          summaries['tasks'])
+
+      summaries = check_ordering.check_all(repair=True)
+
+      self.assertEqual(2, summaries['tasks']['relinked'])
+
+      db.DB.session.expire_all()
+
+      self.assertEqual(0, user.tag_version)
+      self.assertEqual(1, user.data_version)
+
+      self.assertEqual(
+          [first, second, orphan],
+          models.Task.ordered_children(user.object_id, parent.object_id))
+      self.assertEqual(orphan.object_id, second.after_id)
+      self.assertEqual(second.object_id, orphan.before_id)
+      self.assertEqual({'lists': 2}, check_ordering.check_all()['tasks'])
+
+  def test_check_all__tags(self):
+    """Test check_all finds and repairs a broken tag group."""
+    with testing.test_setup():
+      user = make_user()
+      group = models.TagGroup(title='Group', owner=user)
+      tag1 = models.Tag(title='Tag1', group=group)
+      tag2 = models.Tag(title='Tag2', group=group)
+      tag2.link(tag1, None)
+      tag3 = models.Tag(title='Tag3', group=group)
+      db.DB.session.add_all([user, group, tag1, tag2, tag3])
+      db.DB.session.commit()
+      tag3.before = tag1
+      db.DB.session.commit()
+
+      summaries = check_ordering.check_all()
+
+      self.assertEqual(
+          {'lists': 1, 'broken lists': 1, ordering.MISMATCH: 1,
+           ordering.EXTRA_HEAD: 1},
+          summaries['tags'])
+
+      summaries = check_ordering.check_all(repair=True)
+
+      self.assertEqual(2, summaries['tags']['relinked'])
+
+      db.DB.session.expire_all()
+
+      self.assertEqual(1, user.tag_version)
+      self.assertEqual(1, user.data_version)
+
+      self.assertEqual([tag1.object_id, tag2.object_id, tag3.object_id],
+                       group.tag_ids)
+      self.assertEqual({'lists': 1}, check_ordering.check_all()['tags'])
+
+  def test_format_summary(self):
+    """Test format_summary."""
+    self.assertEqual(
+        'tags: no lists\ntasks: 1 broken lists, 1 fork, 2 lists',
+        check_ordering.format_summary({
+            'tasks': {'lists': 2, 'broken lists': 1, 'fork': 1},
+            'tags': {},
+        }))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -10,12 +10,19 @@ import typing
 import flask_script
 
 from lime import app
+from lime.database import db
+from lime.database import models
+from lime.database import tag_catalog
+from lime.database import task_closure
+from lime.scripts import check_ordering
 
 # pylint: disable=unused-import,ungrouped-imports,invalid-name
 if typing.TYPE_CHECKING:
   from typing import (
       Callable,
+      Dict,
       Generator,
+      List,
   )
 # pylint: enable=unused-import,ungrouped-imports,invalid-name
 
@@ -83,20 +90,63 @@ def is_due(timestamp_file: str, delta: 'datetime.timedelta',
 def make_timestamp_file(delta):
   """Generate the path to the timestamp file."""
   return os.path.abspath('./{}_cron_timestamp_{}'.format(
-      APP.config['ENVIRONMENT'], delta.seconds))
+      APP.config['ENVIRONMENT'], int(delta.total_seconds())))
 
 
-TASKS: 'Dict[datetime.timedelta, Callable]' = collections.defaultdict(list)
+TASKS: 'Dict[datetime.timedelta, List[Callable]]' = collections.defaultdict(
+    list)
 
 
 def frequency(**kwargs) -> 'Callable[[Callable], Callable]':
   """Register a task to run at a given frequency."""
   def decorator(func: 'Callable') -> 'Callable':
     TASKS[datetime.timedelta(**kwargs)].append(func)
+    return func
 
   return decorator
 
 
+@frequency(days=1)
+def reconcile_child_counts() -> None:
+  """Correct any drift in the denormalized Task.child_count column."""
+  owner_ids = models.Task.recount_children()
+  models.User.bump_data_version(*owner_ids)
+  db.DB.session.commit()
+
+  print('Corrected child counts for {} users'.format(len(owner_ids)))
+
+
+@frequency(days=1)
+def reconcile_tag_counts() -> None:
+  """Correct any drift in the denormalized Tag task count columns.
+
+  The counts are part of the cached tag catalog, so the owners' catalogs are
+  invalidated, and their data versions bumped, in the same transaction.
+  """
+  owner_ids = models.Tag.recount_tasks()
+  tag_catalog.invalidate(*owner_ids)
+  models.User.bump_data_version(*owner_ids)
+  db.DB.session.commit()
+
+  print('Corrected tag task counts for {} users'.format(len(owner_ids)))
+
+
+@frequency(days=1)
+def repair_task_closure() -> None:
+  """Rebuild any drifted subtrees of the task closure table, and rollups."""
+  owner_ids = task_closure.repair()
+  models.User.bump_data_version(*owner_ids)
+  db.DB.session.commit()
+
+  print('Repaired task closure for {} users'.format(len(owner_ids)))
+
+
+@frequency(days=1)
+def repair_ordering() -> None:
+  """Find and relink any broken task or tag lists."""
+  print(check_ordering.format_summary(check_ordering.check_all(repair=True)))
+
+
 class CronCommand(flask_script.Command):
   """Flask Script command for running Cron jobs."""
 
@@ -7,7 +7,11 @@ import tempfile
 from absl.testing import absltest
 
 from lime import app
+from lime.database import db
+from lime.database import models
+from lime.database import tag_catalog
 from lime.scripts import cron
+from lime.util import testing
 
 
 DUMMY_DATETIME = datetime.datetime(2009, 2, 13, 23, 31, 30)
@@ -92,5 +96,58 @@ class CronTest(absltest.TestCase):
     self.assertEqual(expected,
                      cron.make_timestamp_file(datetime.timedelta(minutes=5)))
 
+
+class CronJobTest(absltest.TestCase):
+  """Tests for the Cron jobs."""
+
+  def setUp(self):
+    tag_catalog.clear_cache()
+
+  def test_reconcile_tag_counts(self):
+    """Test reconcile_tag_counts invalidates the corrected catalogs."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      tag = models.Tag(title='Tag', direct_owner=user)
+      task = models.Task(title='Task', owner=user, tags=[tag])
+      db.DB.session.add_all([user, tag, task])
+      db.DB.session.commit()
+
+      (cached,) = tag_catalog.get(user.object_id)
+      self.assertEqual(0, cached['total_task_count'])
+
+      cron.reconcile_tag_counts()
+
+      (reloaded,) = tag_catalog.get(user.object_id)
+      self.assertEqual(1, reloaded['total_task_count'])
+      self.assertEqual(1, models.User.get_data_version(user.object_id))
+
+  def test_reconcile_child_counts(self):
+    """Test reconcile_child_counts bumps the corrected users' data versions."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      other = models.User(name='other', email='other@test.com', password='test')
+      parent = models.Task(title='Parent', owner=user, child_count=5)
+      db.DB.session.add_all([user, other, parent])
+      db.DB.session.commit()
+
+      cron.reconcile_child_counts()
+
+      self.assertEqual(1, models.User.get_data_version(user.object_id))
+      self.assertEqual(0, models.User.get_data_version(other.object_id))
+
+  def test_repair_task_closure(self):
+    """Test repair_task_closure bumps the corrected users' data versions."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      task = models.Task(title='Task', owner=user)
+      db.DB.session.add_all([user, task])
+      db.DB.session.commit()
+
+      cron.repair_task_closure()
+      self.assertEqual(1, models.User.get_data_version(user.object_id))
+
+      cron.repair_task_closure()
+      self.assertEqual(1, models.User.get_data_version(user.object_id))
+
 if __name__ == '__main__':
   absltest.main()
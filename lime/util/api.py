@@ -1,16 +1,35 @@
-"""Handlers for JSON based API endpoints."""
+"""Handlers for JSON based API endpoints.
+
+Clients may instead send and receive MessagePack, which carries the same
+values (including `__identifier` tagged objects) more compactly, by setting
+the `Content-Type` and `Accept` headers to `application/msgpack`.
+
+Responses are gzipped for clients which accept it, if they are at least
+`COMPRESSION_MIN_SIZE` bytes or are streamed.
+
+Read endpoints may send ETags built from the user's data version, which every
+mutating endpoint bumps; a request whose `If-None-Match` header matches gets an
+empty 304 response without the endpoint being called.
+"""
 
 import typing
 
+import collections
 import enum
 import functools
+import gzip
+import hashlib
+import itertools
 import json
+import zlib
 
 import flask
+import msgpack
 from absl import logging
 
 from . import crossdomain
 from . import errors
+from .. import app
 
 # pylint: disable=unused-import,ungrouped-imports,invalid-name
 if typing.TYPE_CHECKING:
@@ -18,6 +37,9 @@ if typing.TYPE_CHECKING:
       Any,
       Callable,
       Dict,
+      Iterable,
+      Iterator,
+      List,
       Optional,
       Type,
       TypeVar,
@@ -28,12 +50,25 @@ if typing.TYPE_CHECKING:
 
 _SERIALIAZABLE_CLASSES_BY_CLASS: 'Dict[Type, str]' = {}
 _SERIALIAZABLE_CLASSES_BY_IDENTIFIER: 'Dict[str, Type]' = {}
+_SERIALIZERS_BY_CLASS: 'Dict[Type, Callable[[Any], typevars.Serialized]]' = {}
 
 API = flask.Blueprint('api', 'api')
 
+# Number of objects prefetched and encoded together by streaming endpoints.
+STREAM_CHUNK_SIZE = 500
+
+JSON_MIMETYPE = 'text/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+_MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, 'application/x-msgpack')
+
 
 def register_serializable(_identifier: 'Optional[str]' = None) -> 'Callable[[Type], Type]':
-  """Make a decorator to register a class as JSON serialiazable."""
+  """Make a decorator to register a class as JSON serialiazable.
+
+  Classes with a `compile_json_serializer` classmethod are asked for a function
+  which builds the encoded dict, including the `__identifier`, once at
+  registration. Other classes are encoded by copying the result of `to_json`.
+  """
   def decorator(cls: 'Type') -> 'Type':
     """The decorator."""
     identifier = _identifier or cls.__name__
@@ -50,11 +85,22 @@ def register_serializable(_identifier: 'Optional[str]' = None) -> 'Callable[[Typ
     _SERIALIAZABLE_CLASSES_BY_IDENTIFIER[identifier] = cls
     _SERIALIAZABLE_CLASSES_BY_CLASS[cls] = identifier
 
+    if hasattr(cls, 'compile_json_serializer'):
+      _SERIALIZERS_BY_CLASS[cls] = cls.compile_json_serializer(identifier)
+    else:
+      _SERIALIZERS_BY_CLASS[cls] = lambda obj: dict(
+          obj.to_json(), __identifier=identifier)
+
     return cls
 
   return decorator
 
 
+def identifier_of(cls: 'Type') -> str:
+  """Get the identifier of a registered class, for building serialized dicts."""
+  return _SERIALIAZABLE_CLASSES_BY_CLASS[cls]
+
+
 class Encoder(json.JSONEncoder):
   """Custom JSON encoder for registered serializable classes."""
 
@@ -63,16 +109,27 @@ class Encoder(json.JSONEncoder):
     if isinstance(o, enum.Enum):
       return o.value
 
-    try:
-      identifier = _SERIALIAZABLE_CLASSES_BY_CLASS[o.__class__]
-      return dict(o.to_json(), __identifier=identifier)
-    except KeyError:
+    serializer = _SERIALIZERS_BY_CLASS.get(o.__class__)
+
+    if serializer is None:
       return json.JSONEncoder.default(self, o)
 
+    return serializer(o)
+
 
 ENCODER = Encoder()
 
 
+def encode_msgpack(result: 'Any') -> bytes:
+  """Encode a result as MessagePack, serializing objects as ENCODER does."""
+  return msgpack.packb(result, default=ENCODER.default, use_bin_type=True)
+
+
+def decode_msgpack(data: bytes) -> 'Any':
+  """Decode MessagePack, converting tagged dicts as for JSON."""
+  return msgpack.unpackb(data, raw=False, object_hook=from_dict)
+
+
 def from_dict(data: 'Dict[str, Any]') -> 'typevars.Serializable':
   """Convert a dict deserialized from JSON to the serializable class."""
   if '__identifier' in data:
@@ -85,15 +142,209 @@ def from_dict(data: 'Dict[str, Any]') -> 'typevars.Serializable':
   return data
 
 
-def endpoint(path: str, require_auth: bool = True, discard_token: bool = False) -> 'Callable':
+def prefetch(result: 'Any') -> None:
+  """Let serializable classes batch-load data for a result before encoding.
+
+  Registered classes may define a `prefetch_json` classmethod, which is called
+  once with every instance of that class in the (possibly list) result. This
+  lets models compute derived fields for a whole result set in a single query,
+  rather than one query per object in `to_json`.
+  """
+  if not isinstance(result, (list, tuple)):
+    result = [result]
+
+  objects_by_class: 'Dict[Type, List[Any]]' = collections.defaultdict(list)
+
+  for obj in result:
+    if obj.__class__ in _SERIALIAZABLE_CLASSES_BY_CLASS:
+      objects_by_class[obj.__class__].append(obj)
+
+  for cls, objects in objects_by_class.items():
+    if hasattr(cls, 'prefetch_json'):
+      cls.prefetch_json(objects)
+
+
+def encode_stream(result: 'Iterable[Any]') -> 'Iterator[str]':
+  """Encode an iterable as a JSON array, one chunk of objects at a time.
+
+  Each chunk is prefetched and encoded separately, so only one chunk of objects
+  and their encoded form need be held at once. The output is the same as
+  encoding a list of the objects.
+  """
+  iterator = iter(result)
+  separator = ''
+
+  yield '['
+
+  while True:
+    chunk = list(itertools.islice(iterator, STREAM_CHUNK_SIZE))
+
+    if not chunk:
+      break
+
+    prefetch(chunk)
+
+    yield separator + ', '.join(ENCODER.encode(obj) for obj in chunk)
+    separator = ', '
+
+  yield ']'
+
+
+def _gzip_stream(
+    chunks: 'Iterable[bytes]',
+    level: int
+    ) -> 'Iterator[bytes]':
+  """Gzip a streamed body, flushing after each chunk so none is held back."""
+  compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+  for chunk in chunks:
+    compressed = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    if compressed:
+      yield compressed
+
+  yield compressor.flush()
+
+
+@API.after_request
+def compress_response(response: flask.Response) -> flask.Response:
+  """Gzip a response body, if the client accepts it and it is worthwhile."""
+  response.vary.add('Accept-Encoding')
+
+  if (not flask.request.accept_encodings['gzip'] or
+      'Content-Encoding' in response.headers or
+      response.direct_passthrough):
+    return response
+
+  level = app.APP.config['COMPRESSION_LEVEL']
+
+  if response.is_streamed:
+    response.response = _gzip_stream(response.iter_encoded(), level)
+    response.headers.pop('Content-Length', None)
+  else:
+    data = response.get_data()
+
+    if len(data) < app.APP.config['COMPRESSION_MIN_SIZE']:
+      return response
+
+    response.set_data(gzip.compress(data, level))
+
+  response.headers['Content-Encoding'] = 'gzip'
+
+  return response
+
+
+def make_etag(
+    token: 'Any',
+    request: 'Dict[str, Any]',
+    mimetype: str
+    ) -> str:
+  """Build an ETag for a request from the token bearer's data version.
+
+  The ETag also covers the path, the bearer, the response format and the
+  request's other arguments, so it only matches repeats of the same request.
+  """
+  arguments = {key: value for key, value in request.items() if key != 'token'}
+  digest = hashlib.sha1(json.dumps(
+      [flask.request.path, token.user_id, mimetype, arguments],
+      sort_keys=True,
+      default=ENCODER.default
+  ).encode()).hexdigest()
+
+  return '{}-{}'.format(token.data_version(), digest)
+
+
+def negotiate_mimetype() -> str:
+  """Choose the response format the client prefers."""
+  return flask.request.accept_mimetypes.best_match(
+      (JSON_MIMETYPE,) + _MSGPACK_MIMETYPES, default=JSON_MIMETYPE)
+
+
+def make_response(result: 'Any', status: int = 200) -> flask.Response:
+  """Encode the result in the format the client prefers."""
+  mimetype = negotiate_mimetype()
+
+  if mimetype in _MSGPACK_MIMETYPES:
+    response = flask.Response(
+        response=encode_msgpack(result), status=status, mimetype=mimetype)
+  else:
+    response = flask.Response(
+        response=ENCODER.encode(result), status=status, mimetype=mimetype)
+
+  response.vary.add('Accept')
+
+  return response
+
+
+def build_response(result: 'Any', stream: bool = False) -> flask.Response:
+  """Build the response for an endpoint's result.
+
+  Streamed results are encoded as a JSON array while the response is sent;
+  anything else is prefetched and encoded in the format the client prefers.
+  """
+  if stream:
+    return flask.Response(
+        response=flask.stream_with_context(encode_stream(result)),
+        mimetype=JSON_MIMETYPE)
+
+  prefetch(result)
+
+  return make_response(result)
+
+
+def check_not_modified(tag: str) -> 'Optional[flask.Response]':
+  """Get a 304 response if the request's `If-None-Match` matches the ETag."""
+  if not flask.request.if_none_match.contains_weak(tag):
+    return None
+
+  response = flask.Response(status=304)
+  response.set_etag(tag, weak=True)
+  response.vary.add('Accept')
+
+  return response
+
+
+def endpoint(
+    path: str,
+    require_auth: bool = True,
+    discard_token: bool = False,
+    *,
+    stream: bool = False,
+    etag: bool = False,
+    mutates: bool = False
+    ) -> 'Callable':
   """Create a decorator for API methods.
 
-  Reads POSTed JSON payload, decodes it, and passes the decoded data as kwargs
-  to the wrapped function. Handles authentication, requiring an authentication
-  token by default.
+  Reads POSTed JSON (or MessagePack) payload, decodes it, and passes the
+  decoded data as kwargs to the wrapped function. Handles authentication,
+  requiring an authentication token by default. The response is JSON, unless
+  the client prefers MessagePack.
+
+  If `stream` is true, the function must return an iterable (e.g. a query with
+  `yield_per`), which is encoded as a JSON array while the response is sent.
+  Any checks which may fail must be done before returning it, since errors
+  raised while iterating cannot change the response status. MessagePack
+  arrays must start with their length, so streamed responses are always JSON.
+
+  If `etag` is true, responses carry a weak ETag from `make_etag`, and a
+  request whose `If-None-Match` header matches it gets a 304 response after
+  only the token check and one query. Every endpoint which changes a user's
+  data must set `mutates`, which bumps their data version in the endpoint's
+  transaction; the endpoint must commit all of its changes at once. Both
+  require authentication.
   """
+  if (etag or mutates) and not require_auth:
+    raise ValueError('ETags and data versions require authentication')
+
   def parse_request() -> 'Dict[str, Any]':
-    """Parse the JSON or throw an exception."""
+    """Parse the JSON or MessagePack or throw an exception."""
+    if flask.request.mimetype in _MSGPACK_MIMETYPES:
+      try:
+        return decode_msgpack(flask.request.data)
+      except (ValueError, msgpack.UnpackException) as err:
+        logging.exception(err)
+        raise errors.APIError('Could not parse request: {}'.format(err), 400)
+
     try:
       return json.loads(flask.request.data, object_hook=from_dict)
     except json.JSONDecodeError as err:
@@ -121,26 +372,42 @@ def endpoint(path: str, require_auth: bool = True, discard_token: bool = False)
       """The wrapped function."""
       try:
         request = parse_request()
+        token = request.get('token')
+        tag: 'Optional[str]' = None
 
         if require_auth:
           check_auth(request)
 
-          if discard_token:
-            del request['token']
+        if etag:
+          tag = make_etag(token, request, negotiate_mimetype())
+          not_modified = check_not_modified(tag)
+
+          if not_modified is not None:
+            return not_modified
+
+        if mutates:
+          token.bump_data_version()
+
+        if require_auth and discard_token:
+          del request['token']
+
+        response = build_response(func(**request), stream=stream)
+
+        if tag is not None:
+          response.set_etag(tag, weak=True)
 
-        return flask.Response(response=ENCODER.encode(func(**request)),
-                              mimetype='text/json')
+        return response
       except errors.APIError as err:
-        return flask.Response(response=ENCODER.encode({'error': str(err)}),
-                              status=err.code,
-                              mimetype='text/json')
+        return make_response({'error': str(err)}, status=err.code)
 
     return wrapped
 
   def decorator(func: 'Callable') -> 'Callable':
     """Create a decorator which sets up the route and crossdomain headers."""
     return API.route(path, methods=['POST', 'OPTIONS'])(
-        crossdomain.allow(origins=['*'], headers=['Content-Type', 'Accept'])(
-            wrap(func)))
+        crossdomain.allow(
+            origins=['*'],
+            headers=['Content-Type', 'Accept', 'If-None-Match'],
+            expose_headers=['ETag'])(wrap(func)))
 
   return decorator
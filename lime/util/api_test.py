@@ -1,23 +1,31 @@
 """Tests for API library."""
 
 import enum
+import gzip
+import json
+from unittest import mock
 
 from absl.testing import absltest
 
 from lime import app
 from lime.system import setup
 from lime.util import api
+from lime.util import auth
 from lime.util import errors
 from lime.util import testing
 
 # pylint: disable=no-self-use,unused-variable,missing-docstring,protected-access,blacklisted-name
 
+# Records calls to the test endpoints, in order.
+CALLS = []
+
 class APISerializationTest(absltest.TestCase):
   """Tests for API library serialization/deserialization methods."""
 
   def setUp(self):
     api._SERIALIAZABLE_CLASSES_BY_CLASS = {}
     api._SERIALIAZABLE_CLASSES_BY_IDENTIFIER = {}
+    api._SERIALIZERS_BY_CLASS = {}
 
   def test_register_serializable__no_to_json(self):
     """Error is raised when registering a class with no to_json()."""
@@ -39,6 +47,15 @@ class APISerializationTest(absltest.TestCase):
         def to_json(self):
           pass
 
+  def test_identifier_of(self):
+    """The identifier of a registered class is returned."""
+    @api.register_serializable('Bar')
+    class Foo():
+      def to_json(self):
+        pass
+
+    self.assertEqual('Bar', api.identifier_of(Foo))
+
   def test_encoder__enum(self):
     """Encoder encodes an enum to its value."""
     class Foo(enum.Enum):
@@ -57,10 +74,92 @@ class APISerializationTest(absltest.TestCase):
         api.ENCODER.encode(Foo()),
         '{"foo": "foo", "__identifier": "Foo"}')
 
+  def test_encoder__compiled_serializer(self):
+    """Encoder uses the serializer compiled when the class is registered."""
+    compiled = []
+
+    @api.register_serializable('Bar')
+    class Foo():
+      def to_json(self):
+        return {'foo': 'to_json'}
+
+      @classmethod
+      def compile_json_serializer(cls, identifier):
+        compiled.append(identifier)
+        return lambda obj: {'foo': 'compiled', '__identifier': identifier}
+
+    self.assertEqual(['Bar'], compiled)
+    self.assertEqual(
+        api.ENCODER.encode([Foo(), Foo()]),
+        '[{"foo": "compiled", "__identifier": "Bar"}, '
+        '{"foo": "compiled", "__identifier": "Bar"}]')
+    self.assertEqual(['Bar'], compiled)
+
   def test_encoder__passthrough(self):
     """Encoder passes through to the default JSON encoder."""
     self.assertEqual(api.ENCODER.encode({}), '{}')
 
+  def test_prefetch(self):
+    """prefetch calls prefetch_json once per class with all instances."""
+    prefetched = []
+
+    @api.register_serializable()
+    class Foo():
+      def to_json(self):
+        pass
+      @classmethod
+      def prefetch_json(cls, objects):
+        prefetched.append((cls, objects))
+
+    @api.register_serializable()
+    class Bar():
+      def to_json(self):
+        pass
+
+    foo1, foo2, bar = Foo(), Foo(), Bar()
+
+    api.prefetch([foo1, bar, foo2, {}])
+
+    self.assertEqual([(Foo, [foo1, foo2])], prefetched)
+
+  def test_prefetch__single_object(self):
+    """prefetch handles results which are not lists."""
+    prefetched = []
+
+    @api.register_serializable()
+    class Foo():
+      def to_json(self):
+        pass
+      @classmethod
+      def prefetch_json(cls, objects):
+        prefetched.append(objects)
+
+    foo = Foo()
+
+    api.prefetch(foo)
+
+    self.assertEqual([[foo]], prefetched)
+
+  def test_msgpack__round_trip(self):
+    """MessagePack encodes enums and serializable classes like JSON."""
+    class Foo(enum.Enum):
+      FOO = 'foo'
+
+    @api.register_serializable()
+    class Bar():
+      def __init__(self, bar):
+        self.bar = bar
+      def to_json(self):
+        return {'bar': self.bar}
+      @classmethod
+      def from_json(cls, data):
+        return cls(data['bar'])
+
+    (foo, bar) = api.decode_msgpack(api.encode_msgpack([Foo.FOO, Bar('bar')]))
+
+    self.assertEqual('foo', foo)
+    self.assertEqual('bar', bar.bar)
+
   def test_from_dict__known_class(self):
     """from_dict decodes a known class."""
     @api.register_serializable()
@@ -145,6 +244,199 @@ class APIEndpointTest(absltest.TestCase):
       self.assertEqual(resp.status, '200 OK')
       self.assertEqual(resp.get_data(as_text=True), '{"foo": "bar"}')
 
+  def test_stream(self):
+    """A streaming endpoint encodes its result as a JSON array in chunks."""
+    with mock.patch.object(api, 'STREAM_CHUNK_SIZE', 2):
+      with app.APP.test_client() as c:
+        resp = c.post(
+            '/stream',
+            data=testing.with_token({'count': 5}),
+            content_type='application/json')
+        self.assertEqual(resp.status, '200 OK')
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(
+            resp.get_data(as_text=True),
+            api.ENCODER.encode([{'n': n} for n in range(5)]))
+
+  def test_stream__empty(self):
+    """A streaming endpoint encodes an empty result as an empty array."""
+    with app.APP.test_client() as c:
+      resp = c.post(
+          '/stream',
+          data=testing.with_token({'count': 0}),
+          content_type='application/json')
+      self.assertEqual(resp.status, '200 OK')
+      self.assertEqual(resp.get_data(as_text=True), '[]')
+
+  def test_msgpack(self):
+    """MessagePack requests are decoded, and responses encoded if accepted."""
+    with app.APP.test_client() as c:
+      resp = c.post(
+          '/no_auth',
+          data=api.encode_msgpack({}),
+          content_type='application/msgpack',
+          headers={'Accept': 'application/msgpack'})
+      self.assertEqual(resp.status, '200 OK')
+      self.assertEqual(resp.mimetype, 'application/msgpack')
+      self.assertIn('Accept', resp.vary)
+      self.assertEqual(api.decode_msgpack(resp.get_data()), {'bar': 'foo'})
+
+  def test_msgpack__token(self):
+    """Tokens are decoded from MessagePack like from JSON."""
+    with app.APP.test_client() as c:
+      request = testing.with_token({})
+      resp = c.post(
+          '/',
+          data=api.encode_msgpack(json.loads(request)),
+          content_type='application/msgpack')
+      self.assertEqual(resp.status, '200 OK')
+      self.assertEqual(resp.mimetype, 'text/json')
+      self.assertEqual(resp.get_data(as_text=True), '{"foo": "bar"}')
+
+  def test_msgpack__bad_request(self):
+    """Error 400 when a MessagePack request cannot be decoded."""
+    with app.APP.test_client() as c:
+      resp = c.post(
+          '/',
+          data=b'\xc1',
+          content_type='application/msgpack',
+          headers={'Accept': 'application/msgpack'})
+      self.assertEqual(resp.status, '400 BAD REQUEST')
+      self.assertIn('error', api.decode_msgpack(resp.get_data()))
+
+  def test_msgpack__prefers_json(self):
+    """JSON is used unless the client prefers MessagePack."""
+    with app.APP.test_client() as c:
+      resp = c.post(
+          '/no_auth',
+          data='{}',
+          content_type='application/json',
+          headers={'Accept': 'text/json, application/msgpack'})
+      self.assertEqual(resp.mimetype, 'text/json')
+
+      resp = c.post(
+          '/no_auth',
+          data='{}',
+          content_type='application/json',
+          headers={'Accept': '*/*'})
+      self.assertEqual(resp.mimetype, 'text/json')
+
+  def test_stream__msgpack_accepted(self):
+    """Streaming endpoints respond with JSON even if MessagePack is accepted."""
+    with app.APP.test_client() as c:
+      resp = c.post(
+          '/stream',
+          data=testing.with_token({'count': 1}),
+          content_type='application/json',
+          headers={'Accept': 'application/msgpack'})
+      self.assertEqual(resp.mimetype, 'text/json')
+      self.assertEqual(resp.get_data(as_text=True), '[{"n": 0}]')
+
+  def test_compression(self):
+    """Responses are gzipped from the minimum size, if the client accepts it."""
+    with mock.patch.dict(app.APP.config, {'COMPRESSION_MIN_SIZE': 100}):
+      with app.APP.test_client() as c:
+        for size, accept_encoding, compressed in [
+            (50, 'gzip', False),
+            (100, 'gzip', True),
+            (100, 'deflate, gzip;q=0.5', True),
+            (100, 'gzip;q=0', False),
+            (100, None, False),
+        ]:
+          headers = {'Accept-Encoding': accept_encoding} if accept_encoding else {}
+          resp = c.post(
+              '/large',
+              data=json.dumps({'size': size}),
+              content_type='application/json',
+              headers=headers)
+          data = resp.get_data()
+
+          self.assertIn('Accept-Encoding', resp.vary)
+
+          if compressed:
+            self.assertEqual('gzip', resp.headers['Content-Encoding'])
+            self.assertEqual(str(len(data)), resp.headers['Content-Length'])
+            data = gzip.decompress(data)
+          else:
+            self.assertNotIn('Content-Encoding', resp.headers)
+
+          self.assertEqual({'data': 'x' * size}, json.loads(data))
+
+  def test_compression__stream(self):
+    """Streamed responses are gzipped whatever their size."""
+    with app.APP.test_client() as c:
+      resp = c.post(
+          '/stream',
+          data=testing.with_token({'count': 3}),
+          content_type='application/json',
+          headers={'Accept-Encoding': 'gzip'})
+      self.assertTrue(resp.is_streamed)
+      self.assertEqual('gzip', resp.headers['Content-Encoding'])
+      self.assertEqual(
+          api.ENCODER.encode([{'n': n} for n in range(3)]),
+          gzip.decompress(resp.get_data()).decode())
+
+  def test_etag(self):
+    """A matching If-None-Match gets a 304 without calling the endpoint."""
+    CALLS.clear()
+
+    with mock.patch.object(auth.JWT, 'data_version', return_value=3):
+      with app.APP.test_client() as c:
+        def post(arguments, **headers):
+          return c.post(
+              '/etag',
+              data=testing.with_token(arguments),
+              content_type='application/json',
+              headers=headers)
+
+        resp = post({'n': 1})
+        self.assertEqual(resp.status, '200 OK')
+        self.assertEqual(resp.get_data(as_text=True), '{"n": 1}')
+        etag, weak = resp.get_etag()
+        self.assertTrue(weak)
+        self.assertTrue(etag.startswith('3-'))
+        self.assertEqual([1], CALLS)
+
+        resp = post({'n': 1}, **{'If-None-Match': resp.headers['ETag']})
+        self.assertEqual(resp.status, '304 NOT MODIFIED')
+        self.assertEqual(resp.get_data(), b'')
+        self.assertEqual((etag, True), resp.get_etag())
+        self.assertEqual([1], CALLS)
+
+        for arguments, headers in [
+            ({'n': 2}, {}),
+            ({'n': 1}, {'Accept': 'application/msgpack'}),
+        ]:
+          resp = post(
+              arguments, **dict(headers, **{'If-None-Match': 'W/"' + etag + '"'}))
+          self.assertEqual(resp.status, '200 OK')
+          self.assertNotEqual(etag, resp.get_etag()[0])
+
+      with mock.patch.object(auth.JWT, 'data_version', return_value=4):
+        with app.APP.test_client() as c:
+          resp = c.post(
+              '/etag',
+              data=testing.with_token({'n': 1}),
+              content_type='application/json',
+              headers={'If-None-Match': 'W/"' + etag + '"'})
+          self.assertEqual(resp.status, '200 OK')
+          self.assertTrue(resp.get_etag()[0].startswith('4-'))
+
+  def test_mutates(self):
+    """Mutating endpoints bump the data version before they are called."""
+    CALLS.clear()
+
+    with mock.patch.object(
+        auth.JWT, 'bump_data_version', side_effect=lambda: CALLS.append('bump')):
+      with app.APP.test_client() as c:
+        resp = c.post(
+            '/mutate',
+            data=testing.with_token({}),
+            content_type='application/json')
+        self.assertEqual(resp.status, '200 OK')
+        self.assertIsNone(resp.get_etag()[0])
+        self.assertEqual(['bump', 'mutate'], CALLS)
+
   def test_options(self):
     """Crossdomain options are included."""
     with app.APP.test_client() as c:
@@ -153,7 +445,14 @@ class APIEndpointTest(absltest.TestCase):
       self.assertEqual(resp.headers['Access-Control-Allow-Origin'], '*')
       self.assertEqual(
           resp.headers['Access-Control-Allow-Headers'],
-          'CONTENT-TYPE, ACCEPT')
+          'CONTENT-TYPE, ACCEPT, IF-NONE-MATCH')
+      self.assertEqual(resp.headers['Access-Control-Expose-Headers'], 'ETAG')
+
+  def test_endpoint__etag_requires_auth(self):
+    """ETags and data versions cannot be used without authentication."""
+    for kwargs in [{'etag': True}, {'mutates': True}]:
+      with self.assertRaises(ValueError):
+        api.endpoint('/unused', require_auth=False, **kwargs)
 
 
 if __name__ == '__main__':
@@ -167,6 +466,27 @@ if __name__ == '__main__':
   def bar(*_, **__):
     return {'bar': 'foo'}
 
+  @api.endpoint('/large', require_auth=False)
+  def qux(size):
+    return {'data': 'x' * size}
+
+  @api.endpoint('/etag', etag=True)
+  def quux(token, n):
+    del token
+    CALLS.append(n)
+    return {'n': n}
+
+  @api.endpoint('/mutate', mutates=True)
+  def corge(token):
+    del token
+    CALLS.append('mutate')
+    return {}
+
+  @api.endpoint('/stream', stream=True)
+  def baz(token, count):
+    del token
+    return ({'n': n} for n in range(count))
+
   app.APP.register_blueprint(api.API)
 
   absltest.main()
@@ -16,6 +16,7 @@ if typing.TYPE_CHECKING:
   from typing import (
       Any,
       Dict,
+      List,
       Optional,
       Type,
   )
@@ -78,6 +79,14 @@ class JWT(object):
 
     return self._user
 
+  def data_version(self) -> 'Optional[int]':
+    """Get the bearer's data version, which changes whenever their data does."""
+    return models.User.get_data_version(self.user_id)
+
+  def bump_data_version(self) -> None:
+    """Increment the bearer's data version, in the current transaction."""
+    models.User.bump_data_version(self.user_id)
+
   def to_json(self) -> 'typevars.Serializable':
     """Converts the token to a JSON serializable object."""
     return {
@@ -117,7 +126,20 @@ def load_owned_objects(
     action: str,
     *object_ids: 'typevars.ObjectID'
     ) -> 'List[typevars.OwnedModels]':
-  """Load a set of objects by ID and check they're owned by the token bearer."""
+  """Load a set of objects by ID and check they're owned by the token bearer.
+
+  All the objects are loaded in a single query. None IDs are passed through as
+  None, so that optional arguments can be loaded alongside required ones.
+  """
+  wanted = set(object_id for object_id in object_ids if object_id is not None)
+  found: 'Dict[typevars.ObjectID, typevars.OwnedModels]' = {}
+
+  if wanted:
+    found = {
+        obj.object_id: obj
+        for obj in model.query.filter(model.object_id.in_(wanted))
+    }
+
   objects: 'List[typevars.OwnedModels]' = []
 
   for object_id in object_ids:
@@ -126,11 +148,42 @@ def load_owned_objects(
       continue
 
     try:
-      objects.append(model.get_by(object_id=object_id))
-    except db_errors.ObjectNotFoundError:
+      objects.append(found[object_id])
+    except KeyError:
       raise errors.APIError(
           'Could not {0}; {1} {2} not found'.format(action, model.__name__, object_id), 410)
 
   check_owner(token, action, *objects)
 
   return objects
+
+
+def check_owned_ids(
+    model: 'Type[typevars.OwnedModels]',
+    token: 'auth.JWT',
+    action: str,
+    *object_ids: 'typevars.ObjectID'
+    ) -> None:
+  """Check that objects exist and are owned by the token bearer.
+
+  Only the IDs and owner IDs are selected, in a single query, so this is cheaper
+  than load_owned_objects when the objects themselves are not needed. The model
+  must have an `owner_id` column.
+  """
+  owners: 'Dict[typevars.ObjectID, typevars.ObjectID]' = {}
+
+  if object_ids:
+    owners = dict(model.query.with_entities(
+        model.object_id, model.owner_id
+    ).filter(
+        model.object_id.in_(set(object_ids))
+    ))
+
+  for object_id in object_ids:
+    if object_id not in owners:
+      raise errors.APIError(
+          'Could not {0}; {1} {2} not found'.format(action, model.__name__, object_id), 410)
+
+    if owners[object_id] != token.user_id:
+      raise errors.APIError(
+          'Could not {}; not authorized'.format(action), 403)
@@ -109,6 +109,21 @@ class AuthTest(absltest.TestCase):
       self.assertEqual(objects[1], task1)
       self.assertEqual(objects[2], task2)
 
+  def test_load_owned_objects__repeated_id(self):
+    """Repeated IDs load the same object in each position."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      task = models.Task(title='Foo', owner=user)
+      db.DB.session.add_all([user, task])
+      db.DB.session.commit()
+
+      token = auth.JWT.from_user(user)
+
+      objects = auth.load_owned_objects(
+          models.Task, token, 'load owned objects', 1, 1)
+
+      self.assertEqual([task, task], objects)
+
   def test_load_owned_objects__not_owned(self):
     """Objects not owned by the token bearer raise an exception."""
     with testing.test_setup():
@@ -135,5 +150,45 @@ class AuthTest(absltest.TestCase):
             'load owned objects',
             1)
 
+  def test_check_owned_ids(self):
+    """IDs of objects owned by the token bearer pass the check."""
+    with testing.test_setup():
+      user = models.User(name='test', email='test@test.com', password='test')
+      task1 = models.Task(title='Foo', owner=user)
+      task2 = models.Task(title='Bar', owner=user)
+      db.DB.session.add_all([user, task1, task2])
+      db.DB.session.commit()
+
+      auth.check_owned_ids(
+          models.Task, auth.JWT.from_user(user), 'check owned ids', 1, 2, 1)
+
+  def test_check_owned_ids__not_owned(self):
+    """IDs of objects not owned by the token bearer raise an exception."""
+    with testing.test_setup():
+      user1 = models.User(name='test', email='test@test.com', password='test')
+      user2 = models.User(name='test2', email='test2@test.com', password='test')
+      task1 = models.Task(title='Foo', owner=user1)
+      task2 = models.Task(title='Bar', owner=user2)
+      db.DB.session.add_all([user1, user2, task1, task2])
+      db.DB.session.commit()
+
+      with self.assertRaises(errors.APIError) as context:
+        auth.check_owned_ids(
+            models.Task, auth.JWT.from_user(user1), 'check owned ids', 1, 2)
+
+      self.assertEqual(403, context.exception.code)
+
+  def test_check_owned_ids__non_existent(self):
+    """IDs of objects which don't exist raise an exception."""
+    with testing.test_setup():
+      with self.assertRaises(errors.APIError) as context:
+        auth.check_owned_ids(
+            models.Task,
+            auth.JWT.from_user(models.User(object_id=1)),
+            'check owned ids',
+            1)
+
+      self.assertEqual(410, context.exception.code)
+
 if __name__ == '__main__':
   absltest.main()
@@ -26,10 +26,17 @@ _MAX_AGE = '21600'
 
 def allow(
     origins: 'List[str]',
-    headers: 'List[str]') -> 'Callable[[Callable], Callable]':
-  """Create a decorator to allow cross-domain requests using Access-Control."""
+    headers: 'List[str]',
+    expose_headers: 'Optional[List[str]]' = None
+    ) -> 'Callable[[Callable], Callable]':
+  """Create a decorator to allow cross-domain requests using Access-Control.
+
+  `expose_headers` are the response headers which scripts may read, besides
+  the simple ones such as Content-Type.
+  """
   origins = ', '.join(origins)
   headers = ', '.join(x.upper() for x in headers)
+  expose_headers = ', '.join(x.upper() for x in expose_headers or [])
 
   def decorator(f: 'Callable') -> 'Callable':
     """The decorator."""
@@ -47,6 +54,9 @@ def allow(
       resp.headers['Access-Control-Allow-Methods'] = opts_resp.headers['allow']
       resp.headers['Access-Control-Max-Age'] = _MAX_AGE
 
+      if expose_headers:
+        resp.headers['Access-Control-Expose-Headers'] = expose_headers
+
       return resp
 
     f.provide_automatic_options = False
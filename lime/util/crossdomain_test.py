@@ -30,6 +30,23 @@ class CrossdomainTest(absltest.TestCase):
         ['GET', 'HEAD', 'OPTIONS'])
     self.assertEqual(
         resp.headers['Access-Control-Max-Age'], '21600')
+    self.assertNotIn('Access-Control-Expose-Headers', resp.headers)
+
+  def test_allow__expose_headers(self):
+    """Response headers may be exposed to scripts."""
+    @app.APP.route('/exposed', methods=['GET', 'OPTIONS'])
+    @crossdomain.allow(
+        origins=['*'],
+        headers=['Content-Type'],
+        expose_headers=['ETag', 'X-Foo'])
+    def g():  # pylint: disable=unused-variable
+      return ""
+
+    with app.APP.test_client() as c:
+      resp = c.get('/exposed')
+
+    self.assertEqual(
+        resp.headers['Access-Control-Expose-Headers'], 'ETAG, X-FOO')
 
 if __name__ == '__main__':
   absltest.main()
@@ -3,6 +3,9 @@
 import typing
 
 import contextlib
+import json
+
+from absl.testing import absltest
 
 from lime import app
 from lime.database import db
@@ -16,6 +19,7 @@ if typing.TYPE_CHECKING:
   from typing import (
       Any,
       Dict,
+      Tuple,
   )
 
 
@@ -34,3 +38,39 @@ def with_token(request: 'Dict[str, Any]') -> 'str':
   """Build a JSON request with a valid token."""
   return api.ENCODER.encode(
       dict(request, token=auth.JWT.from_user(models.User(object_id=1))))
+
+
+def add_users() -> 'Tuple[models.User, models.User]':
+  """Add user 1, whose token with_token uses, and another user."""
+  user = models.User(name='test', email='test@test.com', password='test')
+  other = models.User(name='other', email='other@test.com', password='test')
+  db.DB.session.add_all([user, other])
+  db.DB.session.commit()
+
+  return user, other
+
+
+class EndpointTestCase(absltest.TestCase):
+  """Base class for tests which call endpoints, with a fresh database each.
+
+  The app must be configured once, before the tests run, since blueprints
+  cannot be registered after the first request.
+  """
+
+  def setUp(self):
+    self.context = app.APP.app_context()
+    self.context.push()
+    db.DB.create_all()
+    self.client = app.APP.test_client()
+
+  def tearDown(self):
+    db.DB.session.remove()
+    db.DB.drop_all()
+    self.context.pop()
+
+  def post(self, path: str, **request: 'Any') -> 'Tuple[int, Any]':
+    """Call an endpoint as user 1, returning the status and decoded response."""
+    resp = self.client.post(
+        path, data=with_token(request), content_type='application/json')
+
+    return resp.status_code, json.loads(resp.get_data(as_text=True))
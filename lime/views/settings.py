@@ -27,13 +27,13 @@ SET_SETTING_WHITELIST = set([
 ])
 
 
-@api.endpoint('/get_settings')
+@api.endpoint('/get_settings', etag=True)
 def get_settings(token: 'auth.JWT') -> 'models.User':
   """Get all settings for the bearer of the given token."""
   return token.user
 
 
-@api.endpoint('/set_setting')
+@api.endpoint('/set_setting', mutates=True)
 def set_setting(
     token: 'auth.JWT',
     key: str,
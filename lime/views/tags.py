@@ -5,14 +5,16 @@ import typing
 from ..database import db
 from ..database import errors as db_errors
 from ..database import models
+from ..database import tag_catalog
 from ..util import api
 from ..util import auth
+from ..util import errors as util_errors
 
 # pylint: disable=unused-import,ungrouped-imports,invalid-name
 if typing.TYPE_CHECKING:
   from typing import (
+      Any,
       Dict,
-      Generator,
       List,
       Optional,
       Union,
@@ -20,26 +22,48 @@ if typing.TYPE_CHECKING:
   from ..util import typevars
 # pylint: enable=unused-import,ungrouped-imports,invalid-name
 
+MAX_SUGGEST_TAGS_LIMIT = 100
 
-def tags_from_groups(
-    groups: 'List[models.TagGroup]'
-    ) -> 'Generator[models.Tag, None, None]':
-  """Generate all the tags within the given groups."""
-  for group in groups:
-    yield from group.tags
 
+def load_tasks(task_ids: 'List[typevars.ObjectID]') -> 'List[models.Task]':
+  """Load tasks in a single query."""
+  if not task_ids:
+    return []
 
-@api.endpoint('/get_tags_and_groups')
+  return models.Task.query.filter(models.Task.object_id.in_(task_ids)).all()
+
+
+@api.endpoint('/get_tags_and_groups', etag=True)
 def get_tags_and_groups(
     token: 'auth.JWT'
-    ) -> 'List[Union[models.TagGroup], List[models.Tag]]':
-  """Get all tags and tag groups owned by the token bearer."""
-  groups = list(token.user.tag_groups.all())
+    ) -> 'List[Dict[str, Any]]':
+  """Get all tags and tag groups owned by the token bearer.
 
-  return groups + list(tags_from_groups(groups)) + list(token.user.tags.all())
+  These are loaded already serialized by tag_catalog, and cached until the
+  user's tags next change.
+  """
+  return tag_catalog.get(token.user_id)
 
 
-@api.endpoint('/add_tag_group')
+@api.endpoint('/suggest_tags')
+def suggest_tags(
+    token: 'auth.JWT',
+    prefix: str,
+    limit: int = 10
+    ) -> 'List[Dict[str, Any]]':
+  """Get the token bearer's tags whose titles start with a prefix.
+
+  These are served from an index over the cached tag catalog, so only the
+  user's tag version is read from the database.
+  """
+  if not 0 < limit <= MAX_SUGGEST_TAGS_LIMIT:
+    raise util_errors.APIError(
+        'limit must be between 1 and {}'.format(MAX_SUGGEST_TAGS_LIMIT), 400)
+
+  return tag_catalog.suggest(token.user_id, prefix, limit)
+
+
+@api.endpoint('/add_tag_group', mutates=True)
 def add_tag_group(
     token: 'auth.JWT',
     title: str
@@ -48,12 +72,13 @@ def add_tag_group(
   group = models.TagGroup(owner=token.user, title=title)
 
   db.DB.session.add(group)
+  tag_catalog.invalidate(token.user_id)
   db.DB.session.commit()
 
   return [group]
 
 
-@api.endpoint('/add_tag')
+@api.endpoint('/add_tag', mutates=True)
 def add_tag(
     token: 'auth.JWT',
     title: str,
@@ -71,7 +96,7 @@ def add_tag(
     mutated.append(group)
 
     try:
-      before = models.Tag.get_by(group_id=group_id, after=None)
+      before = models.Tag.get_by(group_id=group_id, after_id=None)
 
       mutated.append(before)
     except db_errors.ObjectNotFoundError:
@@ -80,9 +105,11 @@ def add_tag(
     owner = token.user
     group = None
 
-  tag = models.Tag(group=group, direct_owner=owner, title=title, before=before)
+  tag = models.Tag(group=group, direct_owner=owner, title=title)
+  tag.link(before, None)
 
   db.DB.session.add(tag)
+  tag_catalog.invalidate(token.user_id)
   db.DB.session.commit()
 
   mutated.append(tag)
@@ -90,34 +117,25 @@ def add_tag(
   return [m for m in set(mutated) if m is not None]
 
 
-@api.endpoint('/apply_tag_to_tasks')
+@api.endpoint('/apply_tag_to_tasks', mutates=True)
 def apply_tag_to_tasks(
     token: 'auth.JWT',
     tag_id: 'typevars.ObjectID',
     task_ids: 'List[typevars.ObjectID]'
     ) -> 'List[models.Task]':
   """Add a tag to tasks, enforcing mutual exclusivity of tags in groups."""
-  (new_tag,) = auth.load_owned_objects(
+  (tag,) = auth.load_owned_objects(
       models.Tag, token, 'apply tag to tasks', tag_id)
-  tasks = auth.load_owned_objects(
-      models.Task, token, 'apply tag to tasks', *task_ids)
-
-  for task in tasks:
-    if new_tag.group_id is not None:
-      try:
-        task.tags.remove([
-            tag for tag in task.tags if tag.group_id == new_tag.group_id][0])
-      except IndexError:
-        pass
-
-    task.tags.append(new_tag)
+  auth.check_owned_ids(models.Task, token, 'apply tag to tasks', *task_ids)
 
+  tag.apply_to_tasks(task_ids)
+  tag_catalog.invalidate(token.user_id)
   db.DB.session.commit()
 
-  return tasks
+  return load_tasks(task_ids)
 
 
-@api.endpoint('/remove_tag_from_tasks')
+@api.endpoint('/remove_tag_from_tasks', mutates=True)
 def remove_tag_from_tasks(
     token: 'auth.JWT',
     tag_id: 'typevars.ObjectID',
@@ -126,21 +144,48 @@ def remove_tag_from_tasks(
   """Remove a tag from tasks."""
   (tag,) = auth.load_owned_objects(
       models.Tag, token, 'remove tag from tasks', tag_id)
-  tasks = auth.load_owned_objects(
-      models.Task, token, 'remove tag from tasks', *task_ids)
+  auth.check_owned_ids(models.Task, token, 'remove tag from tasks', *task_ids)
 
-  for task in tasks:
-    try:
-      task.tags.remove(tag)
-    except ValueError:
-      pass
+  tag.remove_from_tasks(task_ids)
+  tag_catalog.invalidate(token.user_id)
+  db.DB.session.commit()
+
+  return load_tasks(task_ids)
 
+
+@api.endpoint('/merge_tags', mutates=True)
+def merge_tags(
+    token: 'auth.JWT',
+    source_ids: 'List[typevars.ObjectID]',
+    target_id: 'typevars.ObjectID'
+    ) -> 'List[Union[models.Tag, models.Task]]':
+  """Merge tags into another tag, deleting them.
+
+  Tasks with any of the source tags get the target tag instead, enforcing
+  mutual exclusivity of tags in the target's group.
+  """
+  if target_id in source_ids:
+    raise util_errors.APIError('Cannot merge a tag into itself', 400)
+
+  (target, *sources) = auth.load_owned_objects(
+      models.Tag, token, 'merge tags', target_id, *set(source_ids))
+
+  task_ids = [
+      row.object_id for row in db.DB.session.query(
+          models.Task.object_id
+      ).filter(
+          models.Task.tags.any(models.Tag.object_id.in_(source_ids))
+      )
+  ] if sources else []
+
+  target.merge_from(sources)
+  tag_catalog.invalidate(token.user_id)
   db.DB.session.commit()
 
-  return tasks
+  return [target, *load_tasks(task_ids)]
 
 
-@api.endpoint('/delete_tag_group')
+@api.endpoint('/delete_tag_group', mutates=True)
 def delete_tag_group(
     token: 'auth.JWT',
     group_id: 'typevars.ObjectID'
@@ -150,12 +195,13 @@ def delete_tag_group(
       models.TagGroup, token, 'delete tag group', group_id)
 
   db.DB.session.delete(group)
+  tag_catalog.invalidate(token.user_id)
   db.DB.session.commit()
 
   return {}
 
 
-@api.endpoint('/delete_tag')
+@api.endpoint('/delete_tag', mutates=True)
 def delete_tag(
     token: 'auth.JWT',
     tag_id: 'typevars.ObjectID'
@@ -164,7 +210,9 @@ def delete_tag(
   (tag,) = auth.load_owned_objects(
       models.Tag, token, 'delete tag', tag_id)
 
+  tag.unlink()
   db.DB.session.delete(tag)
+  tag_catalog.invalidate(token.user_id)
   db.DB.session.commit()
 
   return {}
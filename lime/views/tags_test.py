@@ -0,0 +1,113 @@
+"""Tests for tag views."""
+
+from absl.testing import absltest
+
+from lime.database import db
+from lime.database import models
+from lime.database import tag as tag_model
+from lime.system import setup
+from lime.util import testing
+
+
+class MergeTagsTest(testing.EndpointTestCase):
+  """Tests for /merge_tags."""
+
+  def add_tag(self, title, group_id=None):
+    """Add a tag through /add_tag, returning its ID."""
+    (status, _) = self.post('/add_tag', title=title, group_id=group_id)
+    self.assertEqual(200, status)
+
+    return models.Tag.get_by(title=title).object_id
+
+  def add_task(self, title, *tag_ids, completed=False):
+    """Add a top-level task with the given tags, returning its ID."""
+    (status, _) = self.post('/add_task', title=title)
+    self.assertEqual(200, status)
+    task_id = models.Task.get_by(title=title).object_id
+
+    if completed:
+      (status, _) = self.post('/update_task', task_id=task_id, completed=True)
+      self.assertEqual(200, status)
+
+    for tag_id in tag_ids:
+      (status, _) = self.post(
+          '/apply_tag_to_tasks', tag_id=tag_id, task_ids=[task_id])
+      self.assertEqual(200, status)
+
+    return task_id
+
+  def test_merge_tags(self):
+    """Test tasks get the target once, and its counts are recomputed."""
+    testing.add_users()
+    target = self.add_tag('Target')
+    source1 = self.add_tag('Source1')
+    source2 = self.add_tag('Source2')
+    both = self.add_task('Both', target, source1, source2)
+    self.add_task('Source', source1, completed=True)
+    self.add_task('Neither')
+
+    (status, _) = self.post(
+        '/merge_tags', source_ids=[source1, source2], target_id=target)
+
+    self.assertEqual(200, status)
+    db.DB.session.expire_all()
+    self.assertEqual(
+        [], models.Tag.query.filter(
+            models.Tag.object_id.in_([source1, source2])).all())
+    self.assertEqual(
+        [(target, both)],
+        db.DB.session.query(
+            tag_model.TAG_TASK_LINK.c.tag_id, tag_model.TAG_TASK_LINK.c.task_id
+        ).filter(tag_model.TAG_TASK_LINK.c.task_id == both).all())
+    self.assertEqual(
+        {'Both': [target], 'Source': [target], 'Neither': []},
+        {task.title: task.tag_ids for task in models.Task.query})
+
+    tag = models.Tag.get_by(object_id=target)
+    self.assertEqual((1, 2), (tag.open_task_count, tag.total_task_count))
+
+  def test_merge_tags__group_chain(self):
+    """Test the sources are unlinked from their group's list."""
+    testing.add_users()
+    (status, _) = self.post('/add_tag_group', title='Group')
+    self.assertEqual(200, status)
+    group_id = models.TagGroup.get_by(title='Group').object_id
+    (source1, target, source2, other) = [
+        self.add_tag(title, group_id)
+        for title in ('Source1', 'Target', 'Source2', 'Other')]
+
+    (status, _) = self.post(
+        '/merge_tags', source_ids=[source1, source2], target_id=target)
+
+    self.assertEqual(200, status)
+    db.DB.session.expire_all()
+    self.assertEqual(
+        [target, other], models.TagGroup.get_by(object_id=group_id).tag_ids)
+    self.assertEqual(
+        {target: (None, other), other: (target, None)},
+        {
+            tag.object_id: (tag.before_id, tag.after_id)
+            for tag in models.Tag.query
+        })
+
+  def test_merge_tags__not_owned(self):
+    """Test a source or target owned by another user is rejected."""
+    (_, other) = testing.add_users()
+    mine = self.add_tag('Mine')
+    theirs = models.Tag(title='Theirs', direct_owner=other)
+    db.DB.session.add(theirs)
+    db.DB.session.commit()
+    theirs_id = theirs.object_id
+
+    for source_id, target_id in ((theirs_id, mine), (mine, theirs_id)):
+      (status, _) = self.post(
+          '/merge_tags', source_ids=[source_id], target_id=target_id)
+
+      self.assertEqual(403, status)
+      self.assertCountEqual(
+          ['Mine', 'Theirs'], [tag.title for tag in models.Tag.query])
+
+
+if __name__ == '__main__':
+  setup.configure_app('testing')
+  absltest.main()
@@ -1,10 +1,17 @@
 """Views for handling tasks."""
 
+import collections
 import typing
 
+import sqlalchemy
+
 from ..database import db
 from ..database import errors as db_errors
 from ..database import models
+from ..database import ordering
+from ..database import tag_catalog
+from ..database import tag_expression
+from ..database import task_closure
 from ..util import api
 from ..util import auth
 from ..util import errors as util_errors
@@ -13,50 +20,79 @@ from ..util import errors as util_errors
 if typing.TYPE_CHECKING:
   from typing import (
       Any,
+      Counter,
+      Dict,
+      Iterable,
       List,
       Optional,
+      Set,
+      Tuple,
   )
   from ..util import typevars
+
+  # Tasks to move, and the tasks they should go after and before (if any).
+  MovedTasks = Tuple[
+      List[models.Task], Optional[models.Task], Optional[models.Task]]
+  # The parent_id of each task being moved, and of its neighbours.
+  ParentMap = Dict[typevars.ObjectID, Optional[typevars.ObjectID]]
 # pylint: enable=unused-import,ungrouped-imports,invalid-name
 
+MAX_FIND_TASKS_LIMIT = 1000
+
+# Other columns are derived, or must be changed with the endpoints which keep
+# the ordering, closure table, rollups and tag counts consistent.
+UPDATE_TASK_WHITELIST = set([
+    'title',
+    'notes',
+    'completed',
+])
+
 
 def check_reparent(
     task: 'models.Task',
     new_parent: 'models.Task'
-    ) -> None:
-  """Reparent a task, checking for cycles."""
-  parent = new_parent
+    ) -> 'List[models.Task]':
+  """Reparent a task, checking for cycles.
 
-  while parent is not None:
-    if task is parent:
-      raise util_errors.APIError(
-          'Cannot make task its own descendant', 400)
-    parent = parent.parent
+  Returns:
+    The old and new ancestors of the task, whose rollups have changed.
+  """
+  new_parent_id = new_parent.object_id if new_parent is not None else None
+
+  if task_closure.is_descendant(new_parent_id, [task.object_id]):
+    raise util_errors.APIError(
+        'Cannot make task its own descendant', 400)
+
+  ancestors = []
+  for parent_id in (task.parent_id, new_parent_id):
+    if parent_id is not None:
+      ancestors.extend(models.Task.path(parent_id))
 
   task.parent = new_parent
+  task_closure.move_subtrees([task.object_id], new_parent_id)
 
+  return ancestors
 
-@api.endpoint('/get_tasks')
+
+@api.endpoint('/get_tasks', etag=True)
 def get_tasks(
     token: 'auth.JWT',
     parent_id: 'Optional[typevars.ObjectID]' = None
     ) -> 'List[models.Task]':
-  """Get all direct child tasks of the given parent.
+  """Get all direct child tasks of the given parent, in list order.
 
   We load the parent to assert that it exists, rather than just loading all
   tasks with the given parent ID.
 
   `parent_id` being None is a special case for top-level tasks.
   """
-  if parent_id is None:
-    return list(token.user.tasks.filter_by(parent_id=None).all())
-
-  (parent,) = auth.load_owned_objects(models.Task, token, 'get tasks', parent_id)
+  if parent_id is not None:
+    auth.load_owned_objects(models.Task, token, 'get tasks', parent_id)
 
-  return parent.children.all() or []
+  return models.Task.ordered_children(token.user_id, parent_id)
 
 
-@api.endpoint('/get_task')
+@api.endpoint('/get_task', etag=True)
 def get_task(
     token: 'auth.JWT',
     task_id: 'typevars.ObjectID'
@@ -65,7 +101,76 @@ def get_task(
   return auth.load_owned_objects(models.Task, token, 'get task', task_id)
 
 
-@api.endpoint('/add_task')
+@api.endpoint('/get_subtree', stream=True)
+def get_subtree(
+    token: 'auth.JWT',
+    root_id: 'typevars.ObjectID',
+    max_depth: 'Optional[int]' = None
+    ) -> 'Iterable[models.Task]':
+  """Get a task and all its descendants, in one round trip.
+
+  If `max_depth` is given, only descendants at most that many levels below the
+  root are included. The tasks are returned as a flat list, parents before
+  children; `parent_id`, `before_id` and `after_id` give the tree structure.
+
+  Subtrees can be large, so the tasks are loaded and encoded in chunks while
+  the response is streamed.
+  """
+  if max_depth is not None and max_depth < 0:
+    raise util_errors.APIError('max_depth cannot be negative', 400)
+
+  auth.load_owned_objects(models.Task, token, 'get tasks', root_id)
+
+  return models.Task.subtree_query(root_id, max_depth).yield_per(
+      api.STREAM_CHUNK_SIZE)
+
+
+@api.endpoint('/get_ancestors', etag=True)
+def get_ancestors(
+    token: 'auth.JWT',
+    task_id: 'typevars.ObjectID'
+    ) -> 'List[models.Task]':
+  """Get the path from the top level down to a task, including the task."""
+  auth.load_owned_objects(models.Task, token, 'get tasks', task_id)
+
+  return models.Task.path(task_id)
+
+
+@api.endpoint('/find_tasks', etag=True)
+def find_tasks(
+    token: 'auth.JWT',
+    expression: 'Any',
+    cursor: 'Optional[typevars.ObjectID]' = None,
+    limit: int = 100
+    ) -> 'List[models.Task]':
+  """Find tasks matching a boolean expression over tags, one page at a time.
+
+  See tag_expression for the expression format. Tasks are returned in ID order,
+  starting after the task with ID `cursor`; pass the last ID of one page as the
+  cursor for the next. A page shorter than `limit` is the last.
+  """
+  if not 0 < limit <= MAX_FIND_TASKS_LIMIT:
+    raise util_errors.APIError(
+        'limit must be between 1 and {}'.format(MAX_FIND_TASKS_LIMIT), 400)
+
+  try:
+    tag_ids = tag_expression.tag_ids(expression)
+  except db_errors.InvalidTagExpressionError as err:
+    raise util_errors.APIError(str(err), 400)
+
+  auth.load_owned_objects(models.Tag, token, 'find tasks', *sorted(tag_ids))
+
+  query = models.Task.query.filter(
+      models.Task.owner_id == token.user_id,
+      tag_expression.to_clause(expression, models.Task.object_id))
+
+  if cursor is not None:
+    query = query.filter(models.Task.object_id > cursor)
+
+  return query.order_by(models.Task.object_id).limit(limit).all()
+
+
+@api.endpoint('/add_task', mutates=True)
 def add_task(
     token: 'auth.JWT',
     title: str,
@@ -76,24 +181,30 @@ def add_task(
 
   try:
     before = models.Task.get_by(
-        owner=token.user, parent_id=parent_id, after=None)
+        owner_id=token.user_id, parent_id=parent_id, after_id=None)
 
     mutated.append(before)
   except db_errors.ObjectNotFoundError:
     before = None
 
-  task = models.Task(
-      owner=token.user, title=title, parent_id=parent_id, before=before)
+  task = models.Task(owner=token.user, title=title, parent_id=parent_id)
+  task.link(before, None)
 
   db.DB.session.add(task)
+  db.DB.session.flush()
+  task_closure.add_task(task.object_id, parent_id)
+  models.Task.adjust_child_count(parent_id, 1)
   db.DB.session.commit()
 
   mutated.append(task)
 
+  if parent_id is not None:
+    mutated.extend(models.Task.path(parent_id))
+
   return [m for m in set(mutated) if m is not None]
 
 
-@api.endpoint('/delete_task')
+@api.endpoint('/delete_task', mutates=True)
 def delete_task(
     token: 'auth.JWT',
     task_id: 'typevars.ObjectID',
@@ -104,56 +215,131 @@ def delete_task(
   If `cascade` is true, then all descendants of the given task are also deleted.
   Otherwise, any child tasks are made children of the deleted task's parent, and
   inserted in the position of the deleted task.
+
+  Either way this is a fixed number of set-based statements, however large the
+  subtree is.
   """
   (task,) = auth.load_owned_objects(models.Task, token, 'get tasks', task_id)
 
-  mutated = [task.parent, task.before, task.after]
+  table = models.Task.__table__
+  links: 'Dict[typevars.ObjectID, Dict[str, Optional[typevars.ObjectID]]]' = (
+      collections.defaultdict(dict))
+
+  # The IDs which the deleted task's neighbours should be linked to.
+  first_id = task.after_id
+  last_id = task.before_id
+
+  mutated_ids = set([task.parent_id, task.before_id, task.after_id])
+  mutated_ids.update(
+      row[0] for row in db.DB.session.execute(
+          task_closure.ancestor_ids(task.object_id)))
 
   if cascade:
-    if task.before is not None:
-      task.before.after = task.after
-    elif task.after is not None:
-      task.after.before = None
+    models.Task.adjust_child_count(task.parent_id, -1)
+    task_closure.move_subtrees([task.object_id], None)
+
+    deleted = table.c.object_id.in_(models.Task.subtree_ids(task.object_id))
   else:
-    for child in task.children:
-      child.parent = task.parent
+    children = db.DB.session.query(
+        models.Task.object_id,
+        models.Task.before_id,
+        models.Task.after_id
+    ).filter(
+        models.Task.parent_id == task.object_id
+    ).order_by(
+        models.Task.object_id
+    ).all()
+
+    if children:
+      first_id = next(
+          (child.object_id for child in children if child.before_id is None),
+          children[0].object_id)
+      last_id = next(
+          (child.object_id for child in children if child.after_id is None),
+          children[-1].object_id)
+
+      links[first_id]['before_id'] = task.before_id
+      links[last_id]['after_id'] = task.after_id
+
+      db.DB.session.execute(table.update().where(
+          table.c.parent_id == task.object_id
+      ).values(
+          parent_id=task.parent_id
+      ))
+
+      mutated_ids.update(child.object_id for child in children)
+
+    models.Task.adjust_child_count(task.parent_id, len(children) - 1)
+    task_closure.remove_task(task.object_id)
+
+    deleted = table.c.object_id == task.object_id
+
+  if task.before_id is not None:
+    links[task.before_id]['after_id'] = first_id
+
+  if task.after_id is not None:
+    links[task.after_id]['before_id'] = last_id
 
-      if child.before is None:
-        child.before = task.before
+  db.DB.session.bulk_update_mappings(models.Task, [
+      dict(values, object_id=object_id) for object_id, values in links.items()
+  ])
 
-      if child.after is None:
-        child.after = task.after
+  if models.Tag.count_task_links(
+      sqlalchemy.select([table.c.object_id]).where(deleted), -1):
+    tag_catalog.invalidate(token.user_id)
 
-      mutated.append(child)
+  db.DB.session.execute(table.delete().where(deleted))
+
+  if cascade:
+    task_closure.remove_subtree(task.object_id)
 
-  db.DB.session.delete(task)
   db.DB.session.commit()
 
-  return [m for m in set(mutated) if m is not None]
+  mutated_ids.discard(None)
+
+  if not mutated_ids:
+    return []
 
+  return models.Task.query.filter(
+      models.Task.object_id.in_(mutated_ids)).all()
 
-@api.endpoint('/update_task')
+
+@api.endpoint('/update_task', mutates=True)
 def update_task(
     token: 'auth.JWT',
     task_id: 'typevars.ObjectID',
     **kwargs: 'Any'
     ) -> 'List[models.Task]':
-  """Set arbitrary fields on a task."""
+  """Set the editable fields of a task."""
+  for key in kwargs:
+    if key not in UPDATE_TASK_WHITELIST:
+      raise util_errors.APIError(
+          'Cannot set attribute {}'.format(key), 400)
+
   (task,) = auth.load_owned_objects(models.Task, token, 'get tasks', task_id)
 
+  completed = task.completed
+
   for key, value in kwargs.items():
-    try:
-      setattr(task, key, value)
-    except AttributeError:
-      raise util_errors.APIError(
-          'Could not set attribute {}'.format(key), 400)
+    setattr(task, key, value)
+
+  if bool(task.completed) == bool(completed):
+    db.DB.session.commit()
+
+    return [task]
+
+  delta = 1 if task.completed else -1
+  task_closure.adjust_completed(task.object_id, delta)
+
+  if models.Tag.adjust_open_task_counts(task.object_id, -delta):
+    tag_catalog.invalidate(token.user_id)
 
   db.DB.session.commit()
 
-  return [task]
+  return models.Task.path(task.object_id)
 
 
-@api.endpoint('/reorder_task')
+@api.endpoint('/reorder_task', mutates=True)
 def reorder_task(
     token: 'auth.JWT',
     task_id: 'typevars.ObjectID',
@@ -181,6 +367,10 @@ def reorder_task(
   if after is None:
     after = before.after
 
+  if before is task or after is task:
+    # The task is already in the requested position.
+    return [task]
+
   if (
       (before is not None and before.after is not after) or
       (after is not None and after.before is not before)):
@@ -189,27 +379,214 @@ def reorder_task(
 
   mutated = [before, after, task, task.before, task.after]
 
+  old_parent_id = task.parent_id
+
   if before is not None and task.parent is not before.parent:
     mutated.extend([task.parent, before.parent])
-    check_reparent(task, before.parent)
+    mutated.extend(check_reparent(task, before.parent))
   elif after is not None and task.parent is not after.parent:
     mutated.extend([task.parent, after.parent])
-    check_reparent(task, after.parent)
+    mutated.extend(check_reparent(task, after.parent))
+
+  new_parent_id = task.parent.object_id if task.parent is not None else None
 
-  if task.before is not None:
-    task.before.after = task.after
-  elif task.after is not None:
-    task.after.before = None
+  if new_parent_id != old_parent_id:
+    models.Task.adjust_child_count(old_parent_id, -1)
+    models.Task.adjust_child_count(new_parent_id, 1)
 
-  task.before = before
-  task.after = after
+  task.unlink()
+  task.link(before, after)
 
   db.DB.session.commit()
 
   return [m for m in set(mutated) if m is not None]
 
 
-@api.endpoint('/reparent_task')
+def load_moved_tasks(
+    token: 'auth.JWT',
+    task_ids: 'List[typevars.ObjectID]',
+    parent_id: 'Optional[typevars.ObjectID]',
+    before_id: 'Optional[typevars.ObjectID]',
+    after_id: 'Optional[typevars.ObjectID]'
+    ) -> 'MovedTasks':
+  """Check a request to move tasks, and load the tasks and the anchors."""
+  if not task_ids:
+    raise util_errors.APIError('No tasks to reorder', 400)
+
+  if before_id is not None and after_id is not None:
+    raise util_errors.APIError(
+        'Only one of before_id or after_id may be provided', 400)
+
+  moved = set(task_ids)
+
+  if len(moved) != len(task_ids):
+    raise util_errors.APIError('Tasks cannot be moved more than once', 400)
+
+  if moved.intersection([parent_id, before_id, after_id]):
+    raise util_errors.APIError(
+        'Tasks cannot be moved relative to themselves', 400)
+
+  # The parent is only loaded to check that the token bearer owns it.
+  (_, before, after, *tasks) = auth.load_owned_objects(
+      models.Task, token, 'reorder tasks',
+      parent_id, before_id, after_id, *task_ids)
+
+  for anchor in (before, after):
+    if anchor is not None and anchor.parent_id != parent_id:
+      raise util_errors.APIError(
+          'Task {} is not a child of the new parent'.format(anchor.object_id),
+          400)
+
+  if task_closure.is_descendant(parent_id, moved):
+    raise util_errors.APIError('Cannot make task its own descendant', 400)
+
+  return tasks, before, after
+
+
+def load_links(
+    tasks: 'List[models.Task]'
+    ) -> 'Tuple[ParentMap, ordering.PointerMap]':
+  """Get the parents and pointers of tasks and their neighbours.
+
+  The neighbours which are not already loaded are fetched in one query.
+  """
+  parents = {task.object_id: task.parent_id for task in tasks}
+  pointers: 'ordering.PointerMap' = {
+      task.object_id: [task.before_id, task.after_id] for task in tasks}
+
+  neighbour_ids = set(
+      object_id for links in pointers.values() for object_id in links
+      if object_id is not None and object_id not in pointers)
+
+  if neighbour_ids:
+    neighbours = db.DB.session.query(
+        models.Task.object_id,
+        models.Task.parent_id,
+        models.Task.before_id,
+        models.Task.after_id
+    ).filter(
+        models.Task.object_id.in_(neighbour_ids)
+    )
+
+    for row in neighbours:
+      parents[row.object_id] = row.parent_id
+      pointers[row.object_id] = [row.before_id, row.after_id]
+
+  return parents, pointers
+
+
+def write_moves(
+    tasks: 'List[models.Task]',
+    parent_id: 'Optional[typevars.ObjectID]',
+    parents: 'ParentMap',
+    pointers: 'ordering.PointerMap',
+    original: 'Dict[typevars.ObjectID, Any]'
+    ) -> 'Set[typevars.ObjectID]':
+  """Write moved tasks' new parents and pointers, and the derived columns.
+
+  `parents` and `pointers` must already have been rearranged; `original` is
+  the (parent_id, (before_id, after_id)) of each task before then. Only tasks
+  which changed are written, with a fixed number of statements.
+
+  Returns:
+    The IDs of every task which changed, including ancestors whose child counts
+    or rollups changed.
+  """
+  child_count_deltas: 'Counter[Optional[typevars.ObjectID]]' = (
+      collections.Counter())
+
+  reparented = [task.object_id for task in tasks if task.parent_id != parent_id]
+
+  # The old and new ancestors of the moved tasks, whose rollups will change.
+  closure = task_closure.TASK_CLOSURE
+  mutated_ids = set()
+  if reparented:
+    mutated_ids.update(row[0] for row in db.DB.session.query(
+        closure.c.ancestor_id
+    ).filter(sqlalchemy.or_(
+        sqlalchemy.and_(
+            closure.c.descendant_id.in_(reparented),
+            closure.c.depth > 0),
+        closure.c.descendant_id == parent_id)))
+
+  for task in tasks:
+    if task.parent_id != parent_id:
+      child_count_deltas[task.parent_id] -= 1
+      child_count_deltas[parent_id] += 1
+    parents[task.object_id] = parent_id
+
+  changed = [
+      {
+          'object_id': object_id,
+          'parent_id': parents[object_id],
+          'before_id': links[0],
+          'after_id': links[1],
+      }
+      for object_id, links in pointers.items()
+      if original[object_id] != (parents[object_id], tuple(links))
+  ]
+
+  db.DB.session.bulk_update_mappings(models.Task, changed)
+  models.Task.adjust_child_counts(child_count_deltas)
+  task_closure.move_subtrees(reparented, parent_id)
+
+  mutated_ids.update(row['object_id'] for row in changed)
+  mutated_ids.update(
+      task_id for task_id, delta in child_count_deltas.items() if delta != 0)
+  mutated_ids.discard(None)
+
+  return mutated_ids
+
+
+@api.endpoint('/reorder_tasks', mutates=True)
+def reorder_tasks(
+    token: 'auth.JWT',
+    task_ids: 'List[typevars.ObjectID]',
+    parent_id: 'Optional[typevars.ObjectID]' = None,
+    before_id: 'Optional[typevars.ObjectID]' = None,
+    after_id: 'Optional[typevars.ObjectID]' = None
+    ) -> 'List[models.Task]':
+  """Move several tasks, in the given order, to one position in a list.
+
+  The tasks are made children of `parent_id` (None for top-level tasks), and
+  placed consecutively after `before_id` or before `after_id`; if neither is
+  given they are appended to the list. The number of statements executed does
+  not depend on how many tasks are moved.
+  """
+  (tasks, before, after) = load_moved_tasks(
+      token, task_ids, parent_id, before_id, after_id)
+
+  tail = None
+  if before is None and after is None:
+    try:
+      tail = models.Task.get_by(
+          owner_id=token.user_id, parent_id=parent_id, after_id=None)
+    except db_errors.ObjectNotFoundError:
+      pass
+
+  (parents, pointers) = load_links(
+      [task for task in tasks + [before, after, tail] if task is not None])
+
+  original = {
+      object_id: (parents[object_id], tuple(links))
+      for object_id, links in pointers.items()}
+
+  ordering.remove_items(pointers, task_ids)
+  ordering.insert_items(pointers, task_ids, *ordering.insertion_point(
+      pointers, task_ids, before_id, after_id,
+      tail.object_id if tail is not None else None))
+
+  mutated_ids = write_moves(tasks, parent_id, parents, pointers, original)
+  db.DB.session.commit()
+
+  if not mutated_ids:
+    return []
+
+  return models.Task.query.filter(
+      models.Task.object_id.in_(mutated_ids)).all()
+
+
+@api.endpoint('/reparent_task', mutates=True)
 def reparent_task(
     token: 'auth.JWT',
     task_id: 'typevars.ObjectID',
@@ -225,15 +602,14 @@ def reparent_task(
     raise util_errors.APIError(
         'Parent already has children. Use /reorder_task instead', 400)
 
-  check_reparent(task, parent)
+  old_parent_id = task.parent_id
+
+  mutated.extend(check_reparent(task, parent))
 
-  if task.before is not None:
-    task.before.after = task.after
-  elif task.after is not None:
-    task.after.before = None
+  models.Task.adjust_child_count(old_parent_id, -1)
+  models.Task.adjust_child_count(parent.object_id, 1)
 
-  task.before = None
-  task.after = None
+  task.unlink()
 
   db.DB.session.commit()
 
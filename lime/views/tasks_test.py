@@ -0,0 +1,310 @@
+"""Tests for task views."""
+
+from unittest import mock
+
+from absl.testing import absltest
+import sqlalchemy
+
+from lime.database import db
+from lime.database import models
+from lime.database import tag_expression
+from lime.database import task_closure
+from lime.system import setup
+from lime.util import api
+from lime.util import testing
+
+
+class ViewTestCase(testing.EndpointTestCase):
+  """Base class for task view tests."""
+
+  def add_tasks(self, *titles, parent_id=None):
+    """Append tasks to a list through /add_task, returning their IDs."""
+    task_ids = []
+
+    for title in titles:
+      (status, _) = self.post('/add_task', title=title, parent_id=parent_id)
+      self.assertEqual(200, status)
+
+      task_ids.append(models.Task.get_by(title=title).object_id)
+
+    return task_ids
+
+  def assertList(self, titles, parent_id=None):  # pylint: disable=invalid-name
+    """Assert the titles of user 1's list, following and checking pointers."""
+    db.DB.session.expire_all()
+    tasks = {
+        task.object_id: task
+        for task in models.Task.query.filter_by(owner_id=1, parent_id=parent_id)
+    }
+
+    order = []
+    task = next(
+        (task for task in tasks.values() if task.before_id is None), None)
+
+    while task is not None and len(order) <= len(tasks):
+      order.append(task.title)
+      after = tasks.get(task.after_id)
+
+      if after is not None:
+        self.assertEqual(task.object_id, after.before_id)
+
+      task = after
+
+    self.assertEqual(titles, order)
+    self.assertEqual(len(tasks), len(order))
+
+  def assertClosure(self, rows):  # pylint: disable=invalid-name
+    """Assert the closure table, as (ancestor, descendant, depth) titles."""
+    titles = {task.object_id: task.title for task in models.Task.query}
+
+    self.assertCountEqual(rows, [
+        (titles[row.ancestor_id], titles[row.descendant_id], row.depth)
+        for row in db.DB.session.execute(task_closure.TASK_CLOSURE.select())
+    ])
+
+
+class GetTasksTest(ViewTestCase):
+  """Tests for /get_tasks."""
+
+  def get_tasks(self, parent_id):
+    """Call /get_tasks, also returning the number of statements it executed."""
+    statements = []
+
+    def record(*args):
+      statements.append(args[2])
+
+    sqlalchemy.event.listen(db.DB.engine, 'before_cursor_execute', record)
+    try:
+      (status, tasks) = self.post('/get_tasks', parent_id=parent_id)
+    finally:
+      sqlalchemy.event.remove(db.DB.engine, 'before_cursor_execute', record)
+
+    self.assertEqual(200, status)
+
+    return tasks, len(statements)
+
+  def test_get_tasks__statements(self):
+    """Test serializing a list does not cost a query per task."""
+    testing.add_users()
+    (parent,) = self.add_tasks('Parent')
+    (child, _) = self.add_tasks('Child1', 'Child2', parent_id=parent)
+    self.add_tasks('Grandchild', parent_id=child)
+
+    (tasks, few) = self.get_tasks(parent)
+
+    self.assertEqual(
+        [('Child1', True), ('Child2', False)],
+        [(task['title'], task['has_children']) for task in tasks])
+
+    self.add_tasks(*['More{}'.format(n) for n in range(10)], parent_id=parent)
+    (tasks, many) = self.get_tasks(parent)
+
+    self.assertLen(tasks, 12)
+    self.assertEqual(few, many)
+
+
+class ReorderTasksTest(ViewTestCase):
+  """Tests for /reorder_tasks."""
+
+  def test_reorder_tasks(self):
+    """Test several tasks are moved, in order, after a task."""
+    testing.add_users()
+    (a, b, _, _, e) = self.add_tasks('A', 'B', 'C', 'D', 'E')
+
+    (status, _) = self.post('/reorder_tasks', task_ids=[e, b], before_id=a)
+
+    self.assertEqual(200, status)
+    self.assertList(['A', 'E', 'B', 'C', 'D'])
+
+  def test_reorder_tasks__tail(self):
+    """Test tasks are appended to a new parent's list."""
+    testing.add_users()
+    (a, b, c) = self.add_tasks('A', 'B', 'C')
+    self.add_tasks('X', parent_id=a)
+
+    (status, _) = self.post('/reorder_tasks', task_ids=[c, b], parent_id=a)
+
+    self.assertEqual(200, status)
+    self.assertList(['A'])
+    self.assertList(['X', 'C', 'B'], parent_id=a)
+    self.assertEqual(3, models.Task.get_by(object_id=a).child_count)
+
+  def test_reorder_tasks__not_owned(self):
+    """Test tasks owned by another user are rejected."""
+    (_, other) = testing.add_users()
+    (a, _) = self.add_tasks('A', 'B')
+    theirs = models.Task(title='Theirs', owner=other)
+    db.DB.session.add(theirs)
+    db.DB.session.commit()
+
+    (status, _) = self.post(
+        '/reorder_tasks', task_ids=[theirs.object_id], before_id=a)
+
+    self.assertEqual(403, status)
+    self.assertList(['A', 'B'])
+
+  def test_reorder_tasks__duplicate(self):
+    """Test a task given more than once is rejected."""
+    testing.add_users()
+    (a, b, c) = self.add_tasks('A', 'B', 'C')
+
+    (status, _) = self.post('/reorder_tasks', task_ids=[c, b, c], before_id=a)
+
+    self.assertEqual(400, status)
+    self.assertList(['A', 'B', 'C'])
+
+
+class DeleteTaskTest(ViewTestCase):
+  """Tests for /delete_task."""
+
+  def add_tree(self):
+    """Add tasks A, B[B1[B1a], B2], C, with B and B1a tagged, returning IDs."""
+    testing.add_users()
+    (_, b, _) = self.add_tasks('A', 'B', 'C')
+    (b1, _) = self.add_tasks('B1', 'B2', parent_id=b)
+    (b1a,) = self.add_tasks('B1a', parent_id=b1)
+
+    (status, _) = self.post('/add_tag', title='T')
+    self.assertEqual(200, status)
+    tag_id = models.Tag.get_by(title='T').object_id
+    (status, _) = self.post(
+        '/apply_tag_to_tasks', tag_id=tag_id, task_ids=[b, b1a])
+    self.assertEqual(200, status)
+
+    return b, b1, tag_id
+
+  def test_delete_task(self):
+    """Test the task's children take its place in its parent's list."""
+    (b, b1, tag_id) = self.add_tree()
+
+    (status, _) = self.post('/delete_task', task_id=b)
+
+    self.assertEqual(200, status)
+    self.assertList(['A', 'B1', 'B2', 'C'])
+    self.assertList(['B1a'], parent_id=b1)
+    self.assertEqual(
+        {'A': 0, 'B1': 1, 'B2': 0, 'C': 0, 'B1a': 0},
+        {task.title: task.child_count for task in models.Task.query})
+    self.assertClosure([
+        ('A', 'A', 0), ('B1', 'B1', 0), ('B2', 'B2', 0), ('C', 'C', 0),
+        ('B1a', 'B1a', 0), ('B1', 'B1a', 1)])
+
+    tag = models.Tag.get_by(object_id=tag_id)
+    self.assertEqual((1, 1), (tag.open_task_count, tag.total_task_count))
+
+  def test_delete_task__cascade(self):
+    """Test the task's descendants are deleted with it."""
+    (b, b1, tag_id) = self.add_tree()
+
+    (status, _) = self.post('/delete_task', task_id=b1, cascade=True)
+
+    self.assertEqual(200, status)
+    self.assertList(['A', 'B', 'C'])
+    self.assertList(['B2'], parent_id=b)
+    self.assertEqual(
+        {'A': 0, 'B': 1, 'B2': 0, 'C': 0},
+        {task.title: task.child_count for task in models.Task.query})
+    self.assertEqual(1, models.Task.get_by(object_id=b).descendant_count)
+    self.assertClosure([
+        ('A', 'A', 0), ('B', 'B', 0), ('B2', 'B2', 0), ('C', 'C', 0),
+        ('B', 'B2', 1)])
+
+    tag = models.Tag.get_by(object_id=tag_id)
+    self.assertEqual((1, 1), (tag.open_task_count, tag.total_task_count))
+
+
+class GetSubtreeTest(ViewTestCase):
+  """Tests for /get_subtree."""
+
+  def test_get_subtree(self):
+    """Test the whole subtree is streamed as one JSON array."""
+    testing.add_users()
+    (a, _) = self.add_tasks('A', 'B')
+    (a1, _) = self.add_tasks('A1', 'A2', parent_id=a)
+    self.add_tasks('A1a', 'A1b', parent_id=a1)
+
+    # Use several chunks, so that the separators between them are checked.
+    with mock.patch.object(api, 'STREAM_CHUNK_SIZE', 2):
+      (status, tasks) = self.post('/get_subtree', root_id=a)
+
+    self.assertEqual(200, status)
+    titles = [task['title'] for task in tasks]
+    self.assertCountEqual(['A', 'A1', 'A2', 'A1a', 'A1b'], titles)
+    self.assertLess(titles.index('A1'), titles.index('A1a'))
+
+  def test_get_subtree__not_owned(self):
+    """Test an unowned root gets an error response rather than a stream."""
+    (_, other) = testing.add_users()
+    theirs = models.Task(title='Theirs', owner=other)
+    db.DB.session.add(theirs)
+    db.DB.session.commit()
+
+    (status, response) = self.post('/get_subtree', root_id=theirs.object_id)
+
+    self.assertEqual(403, status)
+    self.assertIn('error', response)
+
+
+class FindTasksTest(ViewTestCase):
+  """Tests for /find_tasks."""
+
+  def add_tagged_tasks(self):
+    """Add tasks A to E, tagged T, and B also tagged U, returning the tag IDs."""
+    testing.add_users()
+    task_ids = self.add_tasks('A', 'B', 'C', 'D', 'E')
+
+    for title, tagged in (('T', task_ids), ('U', task_ids[1:2])):
+      (status, _) = self.post('/add_tag', title=title)
+      self.assertEqual(200, status)
+      (status, _) = self.post(
+          '/apply_tag_to_tasks',
+          tag_id=models.Tag.get_by(title=title).object_id,
+          task_ids=tagged)
+      self.assertEqual(200, status)
+
+    return (
+        models.Tag.get_by(title='T').object_id,
+        models.Tag.get_by(title='U').object_id)
+
+  def test_find_tasks__pages(self):
+    """Test each page continues after the last task of the one before."""
+    (t, u) = self.add_tagged_tasks()
+    expression = {'and': [t, {'not': u}]}
+    pages = []
+    cursor = None
+
+    for _ in range(3):
+      (status, tasks) = self.post(
+          '/find_tasks', expression=expression, cursor=cursor, limit=2)
+      self.assertEqual(200, status)
+
+      pages.append([task['title'] for task in tasks])
+      if pages[-1]:
+        cursor = models.Task.get_by(title=pages[-1][-1]).object_id
+
+    self.assertEqual([['A', 'C'], ['D', 'E'], []], pages)
+
+  def test_find_tasks__invalid_expression(self):
+    """Test a malformed expression is rejected."""
+    (t, _) = self.add_tagged_tasks()
+
+    (status, response) = self.post(
+        '/find_tasks', expression={'xor': [t, t]})
+
+    self.assertEqual(400, status)
+    self.assertIn('error', response)
+
+  def test_find_tasks__oversized_expression(self):
+    """Test an expression with too many terms is rejected."""
+    (t, _) = self.add_tagged_tasks()
+
+    (status, response) = self.post(
+        '/find_tasks', expression={'or': [t] * tag_expression.MAX_TERMS})
+
+    self.assertEqual(400, status)
+    self.assertIn('error', response)
+
+
+if __name__ == '__main__':
+  setup.configure_app('testing')
+  absltest.main()
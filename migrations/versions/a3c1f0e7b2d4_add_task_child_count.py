@@ -0,0 +1,40 @@
+"""Add denormalized child count to tasks
+
+Revision ID: a3c1f0e7b2d4
+Revises: 56bf3ca5fb5e
+Create Date: 2026-10-18 12:04:51.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c1f0e7b2d4'
+down_revision = '56bf3ca5fb5e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+  op.add_column('task', sa.Column('child_count', sa.Integer(), nullable=True))
+
+  task = sa.table(
+      'task',
+      sa.column('object_id'),
+      sa.column('parent_id'),
+      sa.column('child_count'))
+  children = task.alias('children')
+
+  op.execute(task.update().values(
+      child_count=sa.select([
+          sa.func.count(children.c.object_id)
+      ]).where(
+          children.c.parent_id == task.c.object_id
+      ).as_scalar()))
+
+  op.alter_column('task', 'child_count', nullable=False)
+
+
+def downgrade():
+  op.drop_column('task', 'child_count')
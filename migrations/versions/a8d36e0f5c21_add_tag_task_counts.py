@@ -0,0 +1,56 @@
+"""Add denormalized task counts to tags
+
+Revision ID: a8d36e0f5c21
+Revises: f19a4c7e2b68
+Create Date: 2026-10-18 20:31:07.462915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8d36e0f5c21'
+down_revision = 'f19a4c7e2b68'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+  op.add_column('tag', sa.Column('open_task_count', sa.Integer(), nullable=True))
+  op.add_column(
+      'tag', sa.Column('total_task_count', sa.Integer(), nullable=True))
+
+  tag = sa.table(
+      'tag',
+      sa.column('object_id'),
+      sa.column('open_task_count'),
+      sa.column('total_task_count'))
+  task = sa.table(
+      'task',
+      sa.column('object_id'),
+      sa.column('completed', sa.Boolean()))
+  tag_task_link = sa.table(
+      'tag_task_link',
+      sa.column('tag_id'),
+      sa.column('task_id'))
+
+  tasks = sa.select([
+      sa.func.count()
+  ]).select_from(
+      tag_task_link.join(task, task.c.object_id == tag_task_link.c.task_id)
+  ).where(
+      tag_task_link.c.tag_id == tag.c.object_id
+  )
+
+  op.execute(tag.update().values(
+      open_task_count=tasks.where(~task.c.completed).as_scalar(),
+      total_task_count=tasks.as_scalar()))
+
+  op.alter_column('tag', 'open_task_count', nullable=False)
+  op.alter_column('tag', 'total_task_count', nullable=False)
+
+
+def downgrade():
+  op.drop_column('tag', 'total_task_count')
+  op.drop_column('tag', 'open_task_count')
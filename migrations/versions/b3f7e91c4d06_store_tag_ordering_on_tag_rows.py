@@ -0,0 +1,92 @@
+"""Store tag ordering pointers on the tag rows
+
+Revision ID: b3f7e91c4d06
+Revises: a8d36e0f5c21
+Create Date: 2026-10-18 21:06:52.317840
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f7e91c4d06'
+down_revision = 'a8d36e0f5c21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+  op.add_column('tag', sa.Column('before_id', sa.Integer(), nullable=True))
+  op.add_column('tag', sa.Column('after_id', sa.Integer(), nullable=True))
+  op.create_foreign_key(
+      'tag_before_id_fkey', 'tag', 'tag', ['before_id'], ['object_id'],
+      ondelete='SET NULL')
+  op.create_foreign_key(
+      'tag_after_id_fkey', 'tag', 'tag', ['after_id'], ['object_id'],
+      ondelete='SET NULL')
+
+  tag = sa.table(
+      'tag',
+      sa.column('object_id'),
+      sa.column('before_id'),
+      sa.column('after_id'))
+  link = sa.table(
+      'tag_ordering_link',
+      sa.column('before_id'),
+      sa.column('after_id'))
+
+  op.execute(tag.update().values(
+      after_id=sa.select([
+          link.c.after_id
+      ]).where(
+          link.c.before_id == tag.c.object_id
+      ).limit(1).as_scalar()))
+  op.execute(tag.update().values(
+      before_id=sa.select([
+          link.c.before_id
+      ]).where(
+          link.c.after_id == tag.c.object_id
+      ).limit(1).as_scalar()))
+
+  op.create_index(
+      'ix_tag_list_tail', 'tag', ['group_id'],
+      postgresql_where=sa.text('after_id IS NULL'),
+      sqlite_where=sa.text('after_id IS NULL'))
+
+  op.drop_table('tag_ordering_link')
+
+
+def downgrade():
+  op.create_table(
+      'tag_ordering_link',
+      sa.Column('before_id', sa.Integer(), nullable=True),
+      sa.Column('after_id', sa.Integer(), nullable=True),
+      sa.ForeignKeyConstraint(
+          ['after_id'], ['tag.object_id'], ondelete='CASCADE'),
+      sa.ForeignKeyConstraint(
+          ['before_id'], ['tag.object_id'], ondelete='CASCADE'))
+
+  tag = sa.table(
+      'tag',
+      sa.column('object_id'),
+      sa.column('after_id'))
+  link = sa.table(
+      'tag_ordering_link',
+      sa.column('before_id'),
+      sa.column('after_id'))
+
+  op.execute(link.insert().from_select(
+      ['before_id', 'after_id'],
+      sa.select([
+          tag.c.object_id,
+          tag.c.after_id
+      ]).where(
+          tag.c.after_id.isnot(None)
+      )))
+
+  op.drop_index('ix_tag_list_tail', table_name='tag')
+  op.drop_constraint('tag_after_id_fkey', 'tag', type_='foreignkey')
+  op.drop_constraint('tag_before_id_fkey', 'tag', type_='foreignkey')
+  op.drop_column('tag', 'after_id')
+  op.drop_column('tag', 'before_id')
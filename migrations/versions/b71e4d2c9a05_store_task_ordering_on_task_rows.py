@@ -0,0 +1,92 @@
+"""Store task ordering pointers on the task rows
+
+Revision ID: b71e4d2c9a05
+Revises: a3c1f0e7b2d4
+Create Date: 2026-10-18 14:22:07.905113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71e4d2c9a05'
+down_revision = 'a3c1f0e7b2d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+  op.add_column('task', sa.Column('before_id', sa.Integer(), nullable=True))
+  op.add_column('task', sa.Column('after_id', sa.Integer(), nullable=True))
+  op.create_foreign_key(
+      'task_before_id_fkey', 'task', 'task', ['before_id'], ['object_id'],
+      ondelete='SET NULL')
+  op.create_foreign_key(
+      'task_after_id_fkey', 'task', 'task', ['after_id'], ['object_id'],
+      ondelete='SET NULL')
+
+  task = sa.table(
+      'task',
+      sa.column('object_id'),
+      sa.column('before_id'),
+      sa.column('after_id'))
+  link = sa.table(
+      'task_ordering_link',
+      sa.column('before_id'),
+      sa.column('after_id'))
+
+  op.execute(task.update().values(
+      after_id=sa.select([
+          link.c.after_id
+      ]).where(
+          link.c.before_id == task.c.object_id
+      ).limit(1).as_scalar()))
+  op.execute(task.update().values(
+      before_id=sa.select([
+          link.c.before_id
+      ]).where(
+          link.c.after_id == task.c.object_id
+      ).limit(1).as_scalar()))
+
+  op.create_index(
+      'ix_task_list_tail', 'task', ['owner_id', 'parent_id'],
+      postgresql_where=sa.text('after_id IS NULL'),
+      sqlite_where=sa.text('after_id IS NULL'))
+
+  op.drop_table('task_ordering_link')
+
+
+def downgrade():
+  op.create_table(
+      'task_ordering_link',
+      sa.Column('before_id', sa.Integer(), nullable=True),
+      sa.Column('after_id', sa.Integer(), nullable=True),
+      sa.ForeignKeyConstraint(
+          ['after_id'], ['task.object_id'], ondelete='CASCADE'),
+      sa.ForeignKeyConstraint(
+          ['before_id'], ['task.object_id'], ondelete='CASCADE'))
+
+  task = sa.table(
+      'task',
+      sa.column('object_id'),
+      sa.column('after_id'))
+  link = sa.table(
+      'task_ordering_link',
+      sa.column('before_id'),
+      sa.column('after_id'))
+
+  op.execute(link.insert().from_select(
+      ['before_id', 'after_id'],
+      sa.select([
+          task.c.object_id,
+          task.c.after_id
+      ]).where(
+          task.c.after_id.isnot(None)
+      )))
+
+  op.drop_index('ix_task_list_tail', table_name='task')
+  op.drop_constraint('task_after_id_fkey', 'task', type_='foreignkey')
+  op.drop_constraint('task_before_id_fkey', 'task', type_='foreignkey')
+  op.drop_column('task', 'after_id')
+  op.drop_column('task', 'before_id')
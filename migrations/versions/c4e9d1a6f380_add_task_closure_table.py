@@ -0,0 +1,70 @@
+"""Add closure table of task ancestors and descendants
+
+Revision ID: c4e9d1a6f380
+Revises: b71e4d2c9a05
+Create Date: 2026-10-18 15:37:12.604118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e9d1a6f380'
+down_revision = 'b71e4d2c9a05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+  op.create_table('task_closure',
+  sa.Column('ancestor_id', sa.Integer(), nullable=False),
+  sa.Column('descendant_id', sa.Integer(), nullable=False),
+  sa.Column('depth', sa.Integer(), nullable=False),
+  sa.ForeignKeyConstraint(['ancestor_id'], ['task.object_id'], ondelete='CASCADE'),
+  sa.ForeignKeyConstraint(['descendant_id'], ['task.object_id'], ondelete='CASCADE'),
+  sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id')
+  )
+  op.create_index(
+      'ix_task_closure_descendant_id', 'task_closure',
+      ['descendant_id', 'depth'])
+
+  task = sa.table(
+      'task',
+      sa.column('object_id'),
+      sa.column('parent_id'))
+  task_closure = sa.table(
+      'task_closure',
+      sa.column('ancestor_id'),
+      sa.column('descendant_id'),
+      sa.column('depth'))
+
+  closure = sa.select([
+      task.c.object_id.label('ancestor_id'),
+      task.c.object_id.label('descendant_id'),
+      sa.literal(0).label('depth'),
+  ]).cte(
+      'closure',
+      recursive=True
+  )
+  closure = closure.union_all(
+      sa.select([
+          closure.c.ancestor_id,
+          task.c.object_id,
+          closure.c.depth + 1,
+      ]).where(
+          task.c.parent_id == closure.c.descendant_id
+      ))
+
+  op.execute(task_closure.insert().from_select(
+      ['ancestor_id', 'descendant_id', 'depth'],
+      sa.select([
+          closure.c.ancestor_id,
+          closure.c.descendant_id,
+          closure.c.depth,
+      ])))
+
+
+def downgrade():
+  op.drop_index('ix_task_closure_descendant_id', table_name='task_closure')
+  op.drop_table('task_closure')
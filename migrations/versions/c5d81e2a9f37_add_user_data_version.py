@@ -0,0 +1,27 @@
+"""Add data version to users
+
+Revision ID: c5d81e2a9f37
+Revises: b3f7e91c4d06
+Create Date: 2026-10-18 23:12:47.310529
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d81e2a9f37'
+down_revision = 'b3f7e91c4d06'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+  op.add_column(
+      'user',
+      sa.Column(
+          'data_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+  op.drop_column('user', 'data_version')
@@ -0,0 +1,61 @@
+"""Add denormalized descendant rollups to tasks
+
+Revision ID: d2a7f5b8c913
+Revises: c4e9d1a6f380
+Create Date: 2026-10-18 16:52:40.118734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a7f5b8c913'
+down_revision = 'c4e9d1a6f380'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+  op.add_column(
+      'task', sa.Column('descendant_count', sa.Integer(), nullable=True))
+  op.add_column(
+      'task',
+      sa.Column('completed_descendant_count', sa.Integer(), nullable=True))
+
+  task = sa.table(
+      'task',
+      sa.column('object_id'),
+      sa.column('completed', sa.Boolean()),
+      sa.column('descendant_count'),
+      sa.column('completed_descendant_count'))
+  task_closure = sa.table(
+      'task_closure',
+      sa.column('ancestor_id'),
+      sa.column('descendant_id'),
+      sa.column('depth'))
+  descendant = task.alias('descendant')
+
+  descendants = sa.select([
+      sa.func.count()
+  ]).select_from(
+      task_closure.join(
+          descendant, descendant.c.object_id == task_closure.c.descendant_id)
+  ).where(
+      task_closure.c.ancestor_id == task.c.object_id
+  ).where(
+      task_closure.c.depth > 0
+  )
+
+  op.execute(task.update().values(
+      descendant_count=descendants.as_scalar(),
+      completed_descendant_count=descendants.where(
+          descendant.c.completed).as_scalar()))
+
+  op.alter_column('task', 'descendant_count', nullable=False)
+  op.alter_column('task', 'completed_descendant_count', nullable=False)
+
+
+def downgrade():
+  op.drop_column('task', 'completed_descendant_count')
+  op.drop_column('task', 'descendant_count')
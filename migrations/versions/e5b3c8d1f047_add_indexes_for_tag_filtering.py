@@ -0,0 +1,33 @@
+"""Add indexes for filtering tasks by tag
+
+Revision ID: e5b3c8d1f047
+Revises: d2a7f5b8c913
+Create Date: 2026-10-18 18:21:06.731552
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b3c8d1f047'
+down_revision = 'd2a7f5b8c913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+  op.create_index(
+      'ix_tag_task_link_tag_id_task_id', 'tag_task_link',
+      ['tag_id', 'task_id'])
+  op.create_index(
+      'ix_tag_task_link_task_id_tag_id', 'tag_task_link',
+      ['task_id', 'tag_id'])
+  op.create_index(
+      'ix_task_owner_id_object_id', 'task', ['owner_id', 'object_id'])
+
+
+def downgrade():
+  op.drop_index('ix_task_owner_id_object_id', table_name='task')
+  op.drop_index('ix_tag_task_link_task_id_tag_id', table_name='tag_task_link')
+  op.drop_index('ix_tag_task_link_tag_id_task_id', table_name='tag_task_link')
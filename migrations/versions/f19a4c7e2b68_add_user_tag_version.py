@@ -0,0 +1,27 @@
+"""Add tag catalog version to users
+
+Revision ID: f19a4c7e2b68
+Revises: e5b3c8d1f047
+Create Date: 2026-10-18 19:44:13.905318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f19a4c7e2b68'
+down_revision = 'e5b3c8d1f047'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+  op.add_column(
+      'user',
+      sa.Column(
+          'tag_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+  op.drop_column('user', 'tag_version')
@@ -24,6 +24,7 @@ ALL_PIP_DEPS = [
     requirement("mako"),
     requirement("markupsafe"),
     requirement("mccabe"),
+    requirement("msgpack"),
     requirement("newrelic"),
     requirement("passlib"),
     requirement("pip-tools"),